@@ -1,4 +1,4 @@
-import ast
+import copy
 import fmriproc
 from datetime import (
     datetime,
@@ -12,14 +12,17 @@ from lazyfmri import (
     plotting, 
 )
 import os
+import re
 import math
 import random
 import numpy as np
 import pandas as pd
+import nibabel as nb
+from scipy import sparse
 from prfpy.fit import *
 from prfpy.model import *
 from past.utils import old_div
-from prfpy import rf, stimulus
+from prfpy import stimulus
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
 from scipy.ndimage import rotate
@@ -28,22 +31,65 @@ from joblib import (
     Parallel,
     delayed, 
 )
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
 from scipy import (
     io,
+    stats,
     signal,
-    interpolate,
+    ndimage,
+    spatial,
 )
 import time
+import json
+import hashlib
 import yaml
 import pickle
-import subprocess
+import shutil
+import struct
+import tempfile
+import weakref
+import zipfile
 
 opj = os.path.join
 
+def _interpolation_weights(n_in, n_out, kind="linear"):
+    """_interpolation_weights
+
+    Builds the `(n_out,n_in)`-operator that resamples one axis of an array. Samples are placed on
+    ``np.linspace(0, n_in, n_out)`` and clamped to the last pixel, which mirrors the grid (and nearest-neighbour
+    extrapolation) :func:`scipy.interpolate.interp2d` was called with in earlier versions of
+    :func:`fmriproc.prf.resample2d`.
+    """
+
+    coords = np.clip(np.linspace(0, n_in, n_out), 0, n_in-1)
+    weights = np.zeros((n_out,n_in))
+    rows = np.arange(n_out)
+
+    if kind == "nearest" or n_in == 1:
+        weights[rows,np.rint(coords).astype(int)] = 1
+        return weights
+
+    lo = np.minimum(np.floor(coords).astype(int), n_in-2)
+    frac = coords-lo
+    weights[rows,lo] = 1-frac
+    weights[rows,lo+1] += frac
+
+    return weights
+
 def resample2d(array:np.ndarray, new_size:int, kind='linear'):
     """resample2d
 
-    Resamples a 2D (or 3D) array with :func:`scipy.interpolate.interp2d` to `new_size`. If input is 2D, we'll loop over the final axis.
+    Resamples the first two axes of a 2D (or 3D) array to `new_size`. The full stack is resampled in one go: for
+    ``kind='linear'`` (default) and ``kind='nearest'``, the first two axes are multiplied with separable interpolation
+    operators, yielding the same output as the per-frame :func:`scipy.interpolate.interp2d` calls this function used to
+    make (``interp2d`` has been removed from SciPy). With ``kind='block'``, the array is averaged over non-overlapping
+    blocks if the input size is an integer multiple of `new_size`; otherwise it falls back to :func:`scipy.ndimage.zoom`
+    with linear interpolation. Other values of `kind` ('cubic', 'quintic') are passed on to :func:`scipy.ndimage.zoom` as
+    spline order.
 
     Parameters
     ----------
@@ -52,34 +98,77 @@ def resample2d(array:np.ndarray, new_size:int, kind='linear'):
     new_size: int
         New size of array
     kind: str, optional
-        Interpolation method, by default 'linear'
+        Interpolation method, by default 'linear'. Can be one of 'linear', 'nearest', 'block', 'cubic', or 'quintic'
 
     Returns
     ----------
     np.ndarray
         If 2D: resampled array of shape `(new_size,new_size)`
         If 3D: resampled array of shape `(new_size,new_size, array.shape[-1])`
+
+    Example
+    ----------
+    >>> from fmriproc import prf
+    >>> dm = np.random.rand(270,270,225)
+    >>> prf.resample2d(dm, 100).shape
+    (100, 100, 225)
+    >>> prf.resample2d(dm, 90, kind="block").shape # exact 3x3 block average
+    (90, 90, 225)
     """
-    # set up interpolater
-    x = np.array(range(array.shape[0]))
-    y = np.array(range(array.shape[1]))
 
-    # define new grid
-    xnew = np.linspace(0, x.shape[0], new_size)
-    ynew = np.linspace(0, y.shape[0], new_size)
+    array = np.asarray(array)
+    if not np.issubdtype(array.dtype, np.floating):
+        array = array.astype(float)
 
-    if array.ndim > 2:
-        new = np.zeros((new_size,new_size,array.shape[-1]))
+    n_x,n_y = array.shape[:2]
+    if kind in ["linear","nearest"]:
+        w_x = _interpolation_weights(n_x, new_size, kind=kind).astype(array.dtype)
+        w_y = _interpolation_weights(n_y, new_size, kind=kind).astype(array.dtype)
 
-        for dd in range(array.shape[-1]):
-            f = interpolate.interp2d(x, y, array[...,dd], kind=kind)
-            new[...,dd] = f(xnew,ynew)
+        # resample axis 0, then axis 1; trailing axes (time) ride along
+        new = np.tensordot(w_x, array, axes=(1,0))
+        new = np.moveaxis(np.tensordot(w_y, new, axes=(1,1)), 0, 1)
+        return np.ascontiguousarray(new)
 
-        return new    
-    else:
-        f = interpolate.interp2d(x, y, array, kind=kind)
-        return f(xnew,ynew)
+    if kind == "block" and n_x % new_size == 0 and n_y % new_size == 0:
+        f_x,f_y = n_x//new_size, n_y//new_size
+        blocks = array.reshape((new_size,f_x,new_size,f_y)+array.shape[2:])
+        return blocks.mean(axis=(1,3))
+
+    orders = {"block": 1, "cubic": 3, "quintic": 5}
+    if kind not in orders:
+        raise ValueError(f"Unknown interpolation kind '{kind}'; use one of 'linear', 'nearest', 'block', 'cubic', or 'quintic'")
+
+    factors = [new_size/n_x, new_size/n_y] + [1]*(array.ndim-2)
+    return ndimage.zoom(array, factors, order=orders[kind], mode="nearest")
+    
+def stimulus_energy_regressor(design_matrix, TR=1.5):
+    """stimulus_energy_regressor
+
+    Fraction of the screen that is stimulated per volume, convolved with a canonical double-gamma HRF. Correlating
+    timecourses with this regressor is a cheap proxy of whether a timecourse responds to the stimulus at all.
+
+    Parameters
+    ----------
+    design_matrix: numpy.ndarray
+        <n_pix, n_pix, time> numpy array containing the paradigm
+    TR: float, optional
+        repetition time, by default 1.5
+
+    Returns
+    ----------
+    numpy.ndarray
+        <time> array
+    """
+
+    energy = design_matrix.reshape(-1, design_matrix.shape[-1]).mean(axis=0)
+
+    # canonical double-gamma HRF sampled at the TR
+    t = np.arange(0, 32, TR)
+    hrf = stats.gamma.pdf(t, 6) - stats.gamma.pdf(t, 16)/6
     
+    return np.convolve(energy, hrf/hrf.sum())[:energy.shape[0]]
+
 def normalize_prf(src,targ):
 
     # check that we have enough parameters
@@ -110,7 +199,7 @@ def normalize_prf(src,targ):
 
     return p_prime
     
-def read_par_file(prf_file, key="pars"):
+def read_par_file(prf_file, key="pars", mmap_mode=None):
 
     """read_par_file
 
@@ -118,7 +207,10 @@ def read_par_file(prf_file, key="pars"):
     `np.ndarray`, `npy`-file, `mat`-file (will read in the data from the last item in `list(prf_file.keys())`), `pkl`-file
     (assumes has key 'pars' in it). Because we generally save the design matrix as a *.mat*-file, we can use the same function
     to read in that file and obtain the design matrix in `np.ndarray`-format. Inputs `pd.DataFrame` will be converted to
-    `np.ndarray` with :func:`fmriproc.prf.Parameters`, assuming certain column names to be present.
+    `np.ndarray` with :func:`fmriproc.prf.Parameters`, assuming certain column names to be present. Use `mmap_mode` to read
+    `npy`-files as memory-mapped arrays (see :func:`numpy.load`), so large timecourse files are not loaded into memory.
+    Parameter stores (`npz`-files written by :func:`fmriproc.prf.write_par_file`) are read column-wise with
+    :func:`fmriproc.prf.read_par_store`; use `key="settings"` to get the settings instead of the parameters.
 
     Returns
     ----------
@@ -152,10 +244,15 @@ def read_par_file(prf_file, key="pars"):
     if isinstance(prf_file, str):
         if os.path.exists(prf_file):
             if prf_file.endswith("npy"):
-                pars = np.load(prf_file)
+                pars = np.load(prf_file, mmap_mode=mmap_mode)
             elif prf_file.endswith("mat"):
                 tmp = io.loadmat(prf_file)
                 pars = tmp[list(tmp.keys())[-1]] # find last key in list
+            elif prf_file.endswith("npz"):
+                if key == "settings":
+                    pars = read_par_meta(prf_file).get("settings")
+                else:
+                    pars = read_par_store(prf_file, mmap_mode=mmap_mode)
             elif prf_file.endswith("pkl"):
                 with open(prf_file, 'rb') as input:
                     data = pickle.load(input)
@@ -177,12 +274,271 @@ def read_par_file(prf_file, key="pars"):
 
     return pars
      
-def get_prfdesign(screenshot_path, n_pix=40, dm_edges_clipping=[0,0,0,0]):
+# raw parameter columns per model, in the order of the fitters; HRF-parameters are optional
+PAR_COLUMNS = {
+    "gauss": ["x","y","prf_size","prf_ampl","bold_bsl"],
+    "css": ["x","y","prf_size","prf_ampl","bold_bsl","css_exp"],
+    "dog": ["x","y","prf_size","prf_ampl","bold_bsl","surr_ampl","surr_size"],
+    "norm": ["x","y","prf_size","prf_ampl","bold_bsl","surr_ampl","surr_size","neur_bsl","surr_bsl"],
+    "abc": ["x","y","prf_size","prf_ampl","bold_bsl","surr_ampl","surr_size","neur_bsl","surr_bsl"],
+    "abd": ["x","y","prf_size","prf_ampl","bold_bsl","surr_ampl","surr_size","neur_bsl","surr_bsl"],
+}
+
+def par_columns(model, n_params):
+    """par_columns
+
+    Column names of a `(n_vertices,n_params)`-array of pRF-estimates from `model`, matching the names used by
+    :func:`fmriproc.prf.Parameters.to_array`. Falls back to `par_0`, `par_1`, etc. if `n_params` does not match the model.
+    """
+
+    cols = PAR_COLUMNS.get(model, [])
+    if n_params == len(cols)+1:
+        return cols+["r2"]
+    elif n_params == len(cols)+3:
+        return cols+["hrf_deriv","hrf_disp","r2"]
+    
+    return [f"par_{ii}" for ii in range(n_params)]
+
+def _json_default(obj):
+    """make numpy-types in settings serializable"""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    
+    return str(obj)
+
+def write_par_file(params, out_file, model=None, stage=None, settings=None):
+    """write_par_file
+
+    Write pRF-estimates to a parameter store: an uncompressed `npz`-file with one array per parameter column (see
+    :func:`fmriproc.prf.par_columns`) and a JSON-header with the model, stage, column names, and settings. Unlike a pickle,
+    columns can be memory-mapped straight from the file with :func:`fmriproc.prf.read_par_store`, so reading a single vertex
+    or parameter does not require loading the full array.
+
+    Parameters
+    ----------
+    params: np.ndarray
+        `(n_vertices,n_params)`-array of pRF-estimates
+    out_file: str
+        Output file; should end with `npz`
+    model: str, optional
+        Model the estimates came from; determines the column names
+    stage: str, optional
+        Stage the estimates came from (e.g., 'grid', 'iter')
+    settings: dict, optional
+        Settings of the fit (e.g., `pRFmodelFitting.settings`); stored in the header
+
+    Example
+    ----------
+    >>> from fmriproc import prf
+    >>> prf.write_par_file(pars, "sub-01_model-gauss_stage-iter_desc-prf_params.npz", model="gauss", stage="iter")
+    """
+
+    params = np.asarray(params)
+    if params.ndim == 1:
+        params = params[np.newaxis,:]
+
+    columns = par_columns(model, params.shape[-1])
+    meta = {
+        "model": model,
+        "stage": stage,
+        "columns": columns,
+        "n_vertices": int(params.shape[0]),
+        "dtype": str(params.dtype),
+        "settings": settings
+    }
+
+    meta = np.frombuffer(json.dumps(meta, default=_json_default).encode(), dtype=np.uint8)
+    arrays = {col: np.ascontiguousarray(params[:,ix]) for ix,col in enumerate(columns)}
+
+    # write to temporary file first so readers never see a half-written store
+    with open(f"{out_file}.tmp", "wb") as f:
+        np.savez(f, __meta__=meta, **arrays)
+
+    os.replace(f"{out_file}.tmp", out_file)
+
+def _npz_members(npz_file):
+    """locate the data of each uncompressed member in an `npz`-file; returns (offset, shape, order, dtype) per member"""
+
+    members = {}
+    with zipfile.ZipFile(npz_file) as zf, open(npz_file, "rb") as f:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                members[name] = None
+                continue
+
+            # skip the local file header to reach the npy-header
+            f.seek(info.header_offset)
+            n_name,n_extra = struct.unpack("<HH", f.read(30)[26:30])
+            f.seek(info.header_offset+30+n_name+n_extra)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1,0):
+                shape,fortran,dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape,fortran,dtype = np.lib.format.read_array_header_2_0(f)
+
+            members[name] = (f.tell(), shape, "F" if fortran else "C", dtype)
+
+    return members
+
+def _read_npz_member(npz_file, members, name, mmap_mode="r"):
+    if members[name] is None or mmap_mode is None:
+        with np.load(npz_file) as data:
+            return data[name]
+
+    offset,shape,order,dtype = members[name]
+    return np.memmap(npz_file, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape, order=order)
+
+def read_par_meta(prf_file):
+    """read_par_meta
+
+    Read the JSON-header (model, stage, columns, n_vertices, dtype, settings) of a parameter store written by
+    :func:`fmriproc.prf.write_par_file`.
+    """
+
+    members = _npz_members(prf_file)
+    if "__meta__" not in members:
+        raise ValueError(f"'{prf_file}' is not a parameter store; it does not have a '__meta__' entry")
+
+    meta = _read_npz_member(prf_file, members, "__meta__", mmap_mode=None)
+    return json.loads(meta.tobytes().decode())
+
+def read_par_store(prf_file, columns=None, vertices=None, mmap_mode="r"):
+    """read_par_store
+
+    Read (parts of) a parameter store written by :func:`fmriproc.prf.write_par_file`. Each column is memory-mapped from the
+    file, so selecting a few `vertices` or `columns` only touches the corresponding bytes on disk.
+
+    Parameters
+    ----------
+    prf_file: str
+        Parameter store (`npz`-file)
+    columns: str, list, optional
+        Column name(s) to read (see :func:`fmriproc.prf.par_columns`). If a single string is specified, a 1D array is
+        returned. By default all columns are read into a `(n_vertices,n_params)`-array
+    vertices: int, list, np.ndarray, slice, optional
+        Vertex indices to read. By default all vertices are read
+    mmap_mode: str, optional
+        Memory-map mode for the columns, by default 'r'. A single column without `vertices` is returned as memory-map; use
+        `None` to read the columns into memory instead
+
+    Returns
+    ----------
+    np.ndarray
+        Selected parameters
+
+    Example
+    ----------
+    >>> from fmriproc import prf
+    >>> in_file = "sub-01_model-norm_stage-iter_desc-prf_params.npz"
+    >>> prf.read_par_store(in_file, vertices=1053)          # all parameters of one vertex
+    >>> prf.read_par_store(in_file, columns="r2")           # memory-mapped r2-column
+    >>> prf.read_par_store(in_file, columns=["x","y"])      # (n_vertices,2)
+    """
+
+    members = _npz_members(prf_file)
+    meta = read_par_meta(prf_file)
+
+    single = isinstance(columns, str)
+    if columns is None:
+        columns = meta["columns"]
+    elif single:
+        columns = [columns]
+
+    missing = [ii for ii in columns if ii not in members]
+    if len(missing) > 0:
+        raise ValueError(f"Column(s) {missing} not in '{prf_file}'; available: {meta['columns']}")
+
+    pars = []
+    for col in columns:
+        arr = _read_npz_member(prf_file, members, col, mmap_mode=mmap_mode)
+        if vertices is not None:
+            arr = arr[vertices]
+
+        pars.append(arr)
+
+    if single:
+        return pars[0]
+
+    return np.stack(pars, axis=-1)
+
+def convert_par_file(pkl_file, out_file=None, model=None, stage=None, remove=False, verbose=False):
+    """convert_par_file
+
+    Migrate a `*_desc-prf_params.pkl`-file from :class:`fmriproc.prf.pRFmodelFitting` to a parameter store (see
+    :func:`fmriproc.prf.write_par_file`). If not specified, `model` and `stage` are read from the BIDS-components of the
+    filename, and the output is written next to the input with the `npz`-extension.
+
+    Returns
+    ----------
+    str
+        Path to the parameter store
+    """
+
+    if not isinstance(out_file, str):
+        out_file = re.sub(r"\.pkl$", ".npz", pkl_file)
+
+    try:
+        comps = utils.split_bids_components(os.path.basename(pkl_file))
+    except:
+        comps = {}
+
+    if not isinstance(model, str):
+        model = comps.get("model")
+
+    if not isinstance(stage, str):
+        stage = comps.get("stage")
+
+    with open(pkl_file, "rb") as f:
+        data = pickle.load(f)
+
+    utils.verbose(f"Converting '{pkl_file}' (model={model}, stage={stage}) to '{out_file}'", verbose)
+    write_par_file(
+        data["pars"],
+        out_file,
+        model=model,
+        stage=stage,
+        settings=data.get("settings")
+    )
+
+    if remove:
+        os.remove(pkl_file)
+
+    return out_file
+
+def find_par_file(search_for, directory, **kwargs):
+    """find_par_file
+
+    Find a file with pRF-estimates in `directory` matching the substrings in `search_for` (see
+    :func:`lazyfmri.utils.get_file_from_substring`). Parameter stores (`desc-prf_params.npz`) are preferred over pickles from
+    earlier versions (`desc-prf_params.pkl`). Returns `None` if neither exists.
+    """
+
+    if isinstance(search_for, str):
+        search_for = [search_for]
+
+    for ext in ["npz","pkl"]:
+        par_file = utils.get_file_from_substring(
+            search_for+[f"desc-prf_params.{ext}"],
+            directory,
+            return_msg=None,
+            **kwargs
+        )
+
+        if par_file is not None:
+            return par_file
+
+    return None
+
+def get_prfdesign(screenshot_path, n_pix=40, dm_edges_clipping=[0,0,0,0], n_jobs=None, cache_dir=None):
     """
     get_prfdesign
 
     Basically Marco's gist, but then incorporated in the repo. It takes the directory of screenshots and creates a
-    vis_design.mat file, telling pRFpy at what point are certain stimulus was presented.
+    vis_design.mat file, telling pRFpy at what point are certain stimulus was presented. Screenshots are decoded and
+    binarized in parallel, and each frame is clipped and downsampled to `n_pix` straight away, so the full-resolution stack
+    is never created.
 
     Parameters
     ----------
@@ -197,6 +553,12 @@ def get_prfdesign(screenshot_path, n_pix=40, dm_edges_clipping=[0,0,0,0]):
         showing them the cross of for instance the BOLD-screen (the matlab one, not the linux one) and clip the image
         accordingly. This is a list of 4 values, which are the number of pixels to clip from the left, right, top and bottom
         of the image. Default is [0,0,0,0], which means no clipping. Negative values will be set to 0.
+    n_jobs: int, optional
+        Number of threads used to decode the screenshots. Default is None (number of CPUs)
+    cache_dir: str, optional
+        Directory in which the design matrix is stored as `design_<hash>.npy`, where the hash is computed from the contents of
+        the screenshots, `n_pix`, and `dm_edges_clipping`. If a matching file exists, it's loaded instead of decoding the
+        screenshots. Default is None (no caching)
 
     Returns
     ----------
@@ -216,20 +578,33 @@ def get_prfdesign(screenshot_path, n_pix=40, dm_edges_clipping=[0,0,0,0]):
 
     """
 
-    image_list = os.listdir(screenshot_path)
-
-    # get first image to get screen size
-    img = (255*mpimg.imread(opj(screenshot_path, image_list[0]))).astype('int')
+    image_list = sorted(os.listdir(screenshot_path))
 
-    # there is one more MR image than screenshot
-    design_matrix = np.zeros((img.shape[0], img.shape[0], 1+len(image_list)))
+    #clipping edges; top, bottom, left, right
+    if isinstance(dm_edges_clipping, dict):
+        dm_edges_clipping = [
+            dm_edges_clipping['top'],
+            dm_edges_clipping['bottom'],
+            dm_edges_clipping['left'],
+            dm_edges_clipping['right']]
 
-    for image_file in image_list:
-        
-        # assuming last three numbers before .png are the screenshot number
-        img_number = int(image_file[-7:-4])-1
-        
-        # subtract one to start from zero
+    # ensure absolute values; should be a list by now anyway
+    dm_edges_clipping = [abs(int(ele)) for ele in dm_edges_clipping]
+
+    # content-addressed cache
+    if isinstance(cache_dir, str):
+        sha = hashlib.sha1()
+        sha.update(f"n_pix={n_pix};clip={dm_edges_clipping}".encode())
+        for image_file in image_list:
+            sha.update(image_file.encode())
+            with open(opj(screenshot_path, image_file), "rb") as f:
+                sha.update(f.read())
+
+        cache_file = opj(cache_dir, f"design_{sha.hexdigest()}.npy")
+        if os.path.exists(cache_file):
+            return np.load(cache_file)
+
+    def make_frame(image_file):
         img = (255*mpimg.imread(opj(screenshot_path, image_file))).astype('int')
         
         # make it square
@@ -239,36 +614,43 @@ def get_prfdesign(screenshot_path, n_pix=40, dm_edges_clipping=[0,0,0,0]):
 
         # binarize image into dm matrix
         # assumes: standard RGB255 format; only colors present in image are black, white, grey, red, green.
-        design_matrix[...,img_number][np.where(((img[...,0] == 0) & (
-            img[...,1] == 0)) | ((img[...,0] == 255) & (img[...,1] == 255)))] = 1
+        frame = np.zeros(img.shape[:2])
+        frame[((img[...,0] == 0) & (img[...,1] == 0)) | ((img[...,0] == 255) & (img[...,1] == 255))] = 1
+        frame[(img[...,0] == img[...,1]) & (img[...,1] == img[...,2]) & (img[...,0] != 127)] = 1
 
-        design_matrix[...,img_number][np.where(((img[...,0] == img[...,1]) & (
-            img[...,1] == img[...,2]) & (img[...,0] != 127)))] = 1
+        frame[:dm_edges_clipping[0], :] = 0
+        frame[(frame.shape[0]-dm_edges_clipping[1]):, :] = 0
+        frame[:, :dm_edges_clipping[2]] = 0
+        frame[:, (frame.shape[0]-dm_edges_clipping[3]):] = 0
 
-    #clipping edges; top, bottom, left, right
-    if isinstance(dm_edges_clipping, dict):
-        dm_edges_clipping = [
-            dm_edges_clipping['top'],
-            dm_edges_clipping['bottom'],
-            dm_edges_clipping['left'],
-            dm_edges_clipping['right']]
+        # downsample
+        if n_pix != frame.shape[0]:
+            frame = resample2d(frame, n_pix)
+            frame[frame<0.9] = 0
 
-    # ensure absolute values; should be a list by now anyway
-    dm_edges_clipping = [abs(ele) for ele in dm_edges_clipping]
+        return frame
 
-    design_matrix[:dm_edges_clipping[0], :, :] = 0
-    design_matrix[(design_matrix.shape[0]-dm_edges_clipping[1]):, :, :] = 0
-    design_matrix[:, :dm_edges_clipping[2], :] = 0
-    design_matrix[:, (design_matrix.shape[0]-dm_edges_clipping[3]):, :] = 0
+    frames = Parallel(n_jobs=-1 if n_jobs is None else n_jobs, prefer="threads")(
+        delayed(make_frame)(image_file) for image_file in image_list
+    )
 
-    # downsample (resample2d can also deal with 3D input)
-    if n_pix != design_matrix.shape[0]:
-        dm_resampled = resample2d(design_matrix, n_pix)
-        dm_resampled[dm_resampled<0.9] = 0
-        return dm_resampled
-    else:
-        return design_matrix
+    # there is one more MR image than screenshot
+    design_matrix = np.zeros((frames[0].shape[0], frames[0].shape[0], 1+len(image_list)))
+    for image_file,frame in zip(image_list, frames):
+
+        # assuming last three numbers before .png are the screenshot number; subtract one to start from zero
+        img_number = int(image_file[-7:-4])-1
+        design_matrix[...,img_number] = frame
+
+    if isinstance(cache_dir, str):
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # write to temporary file first; other subjects might be reading the cache
+        tmp = opj(cache_dir, f".{os.path.basename(cache_file)}.{os.getpid()}.npy")
+        np.save(tmp, design_matrix)
+        os.replace(tmp, cache_file)
 
+    return design_matrix
 
 def radius(stim_arr):
 
@@ -668,7 +1050,9 @@ def make_prf(
     Returns
     ----------
     numpy.ndarray
-        meshgrid containing Gaussian characteristics of the pRF. Can be plotted with :func:`lazyfmri.plotting.LazyPRF`
+        meshgrid containing Gaussian characteristics of the pRF. Can be plotted with :func:`lazyfmri.plotting.LazyPRF`. If
+        `params` is a `(n_vertices,n_params)`-array, a `(n_vertices,n_pix,n_pix)`-stack is returned (use
+        :func:`fmriproc.prf.render_prfs` to render large numbers of vertices in chunks)
     """
 
     # prf = np.rot90(rf.gauss2D_iso_cart(
@@ -678,6 +1062,11 @@ def make_prf(
     #     sigma=params[2],
     #     normalize_RFs=False).T, axes=(1, 2))
 
+    params = np.asarray(params)
+    if params.ndim > 1:
+        # (n_vertices,n_params): render all vertices in one go
+        params = params.T
+
     prf = create_model_rf_wrapper(
         model,
         prf_object,
@@ -685,33 +1074,116 @@ def make_prf(
 
     # spatially smooth for visualization
     if isinstance(resize_pix, int):
-        prf_squeezed = np.squeeze(prf, axis=0)
-        prf = resample2d(prf_squeezed, resize_pix)
+        prf = np.moveaxis(resample2d(np.moveaxis(prf, 0, -1), resize_pix), -1, 0)
     
     # save a bunch of problems if returned array is 2D
-    if prf.ndim > 2:
+    if prf.ndim > 2 and prf.shape[0] == 1:
         prf = np.squeeze(prf,axis=0)
         
     return prf
 
 
 # From Marco's https://github.com/VU-Cog-Sci/prfpytools/blob/master/prfpytools/postproc_utils.py
-def norm_2d_sr_function(a,b,c,d,s_1,s_2,x,y,stims,mu_x=0,mu_y=0):
-    """create size/response function given set of parameters and stimuli"""
+def norm_2d_sr_function(a,b,c,d,s_1,s_2,x,y,stims,mu_x=0,mu_y=0,chunk_size=None,n_jobs=1):
+    """create size/response function given set of parameters and stimuli
+
+    The overlap between each Gaussian and each stimulus is computed as one `(n_vertices,n_pix**2) @ (n_pix**2,n_stims)`
+    matrix product instead of tiling the Gaussians across stimuli. Vertices are processed in chunks of `chunk_size`, so
+    peak memory is bounded by `chunk_size*n_pix**2` elements per Gaussian regardless of the number of vertices (by
+    default, a chunk takes up ~128MB). With `n_jobs>1`, chunks are distributed over threads.
+    """
 
     xx,yy = np.meshgrid(x,y)
 
-    if isinstance(stims, np.ndarray):
-        n_stims = stims.shape[-1]
-    elif isinstance(stims, list):
-        n_stims = len(stims)
-    else:
+    if isinstance(stims, list):
+        stims = np.concatenate([ii[...,np.newaxis] for ii in stims], axis=-1)
+    elif not isinstance(stims, np.ndarray):
         raise TypeError(f"Stimuli must be a list or np.ndarray, not {type(stims)}")
 
-    sr_function = ((a[...,np.newaxis]*np.sum(np.tile(np.exp(-((xx[...,np.newaxis]-mu_x)**2+(yy[...,np.newaxis]-mu_y)**2)/(2*s_1**2))[...,np.newaxis],n_stims)*stims[:,:,np.newaxis,:],axis=(0,1)) +b[...,np.newaxis])/\
-    ((c[...,np.newaxis]*np.sum(np.tile(np.exp(-((xx[...,np.newaxis]-mu_x)**2+(yy[...,np.newaxis]-mu_y)**2)/(2*s_2**2))[...,np.newaxis],n_stims)*stims[:,:,np.newaxis,:],axis=(0,1)) +d[...,np.newaxis])) - (b/d)[...,np.newaxis])    
-    
-    return sr_function
+    # (n_pix**2,n_stims)-matrix of stimuli
+    n_stims = stims.shape[-1]
+    stim_mat = stims.reshape(-1,n_stims).astype(float)
+    xx,yy = xx.ravel(),yy.ravel()
+
+    a,b,c,d,s_1,s_2,mu_x,mu_y = np.broadcast_arrays(*[np.atleast_1d(np.asarray(ii, dtype=float)) for ii in [a,b,c,d,s_1,s_2,mu_x,mu_y]])
+    n_vertices = a.shape[0]
+
+    if not isinstance(chunk_size, int):
+        chunk_size = max(1, int(2**24/xx.shape[0]))
+
+    def sr_chunk(sl):
+        dist = (xx[np.newaxis,:]-mu_x[sl,np.newaxis])**2+(yy[np.newaxis,:]-mu_y[sl,np.newaxis])**2
+        act = np.exp(-dist/(2*s_1[sl,np.newaxis]**2)) @ stim_mat
+        norm = np.exp(-dist/(2*s_2[sl,np.newaxis]**2)) @ stim_mat
+
+        return (a[sl,np.newaxis]*act+b[sl,np.newaxis])/(c[sl,np.newaxis]*norm+d[sl,np.newaxis]) - (b[sl]/d[sl])[...,np.newaxis]
+
+    chunks = [slice(ii,ii+chunk_size) for ii in range(0,n_vertices,chunk_size)]
+    if n_jobs == 1 or len(chunks) == 1:
+        sr_function = [sr_chunk(sl) for sl in chunks]
+    else:
+        sr_function = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(sr_chunk)(sl) for sl in chunks
+        )
+
+    return np.concatenate(sr_function, axis=0)
+
+def norm_2d_sr_function_local(a,b,c,d,s_1,s_2,x,y,radii,mu_x=0,mu_y=0,dt="fill",chunk_size=None,n_jobs=1):
+    """create size/response function for stimuli centered on each pRF
+
+    Equivalent to calling :func:`fmriproc.prf.norm_2d_sr_function` for every pRF with its own stimulus set from
+    :func:`fmriproc.prf.make_stims` (`loc=(mu_x,mu_y)`), but without regenerating stimuli. Because the disks are
+    centered on the pRF, only the distance of each screen pixel to the pRF-center matters: pixels are binned by the
+    first stimulus radius they fall within, and the Gaussian weights are accumulated over the bins. This gives the
+    overlap with all `len(radii)` disks ('fill') or their complements ('hole') in one pass over the screen. Vertices are
+    processed in chunks of `chunk_size` (~128MB by default), optionally distributed over `n_jobs` threads.
+    """
+
+    if dt not in ["fill","hole"]:
+        raise ValueError(f"Stimulus type must be 'fill' or 'hole', not '{dt}'")
+
+    xx,yy = np.meshgrid(x,y)
+    xx,yy = xx.ravel(),yy.ravel()
+    radii = np.asarray(radii, dtype=float)
+    n_stims = radii.shape[0]
+
+    a,b,c,d,s_1,s_2,mu_x,mu_y = np.broadcast_arrays(*[np.atleast_1d(np.asarray(ii, dtype=float)) for ii in [a,b,c,d,s_1,s_2,mu_x,mu_y]])
+    n_vertices = a.shape[0]
+
+    if not isinstance(chunk_size, int):
+        chunk_size = max(1, int(2**24/xx.shape[0]))
+
+    def overlap(weights, bins, n):
+        # sum weights per radius bin, then accumulate into disks of growing radius
+        flat = (np.arange(n)[:,np.newaxis]*(n_stims+1)+bins).ravel()
+        per_bin = np.bincount(flat, weights=weights.ravel(), minlength=n*(n_stims+1)).reshape(n,n_stims+1)
+        disks = np.cumsum(per_bin, axis=1)[:,:n_stims]
+
+        if dt == "hole":
+            return per_bin.sum(axis=1, keepdims=True)-disks
+
+        return disks
+
+    def sr_chunk(sl):
+        dist_sq = (xx[np.newaxis,:]-mu_x[sl,np.newaxis])**2+(yy[np.newaxis,:]-mu_y[sl,np.newaxis])**2
+
+        # pixel is part of disk k if its distance < radii[k]
+        bins = np.searchsorted(radii, dist_sq**0.5, side="right")
+        n = bins.shape[0]
+        act = overlap(np.exp(-dist_sq/(2*s_1[sl,np.newaxis]**2)), bins, n)
+        norm = overlap(np.exp(-dist_sq/(2*s_2[sl,np.newaxis]**2)), bins, n)
+
+        return (a[sl,np.newaxis]*act+b[sl,np.newaxis])/(c[sl,np.newaxis]*norm+d[sl,np.newaxis]) - (b[sl]/d[sl])[...,np.newaxis]
+
+    chunks = [slice(ii,ii+chunk_size) for ii in range(0,n_vertices,chunk_size)]
+    if n_jobs == 1 or len(chunks) == 1:
+        sr_function = [sr_chunk(sl) for sl in chunks]
+    else:
+        sr_function = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(sr_chunk)(sl) for sl in chunks
+        )
+
+    return np.concatenate(sr_function, axis=0)
 
 # from https://github.com/mdaghlian/MD_toy_dn_scotoma/blob/2d0c208307536fd1853a6befdc38be7fe0d969fb/dn_scripts/RF.py
 def gauss_1d_function(x, mu, sigma):
@@ -1049,12 +1521,12 @@ def select_stims(settings_dict, stim_library, frames=225, baseline_frames=15, ra
             utils.verbose("Done", verbose)
             return design
 
-def prf_neighbouring_vertices(subject, hemi='lh', vertex=None, prf_params=None, compare=False, vertices_only=False):
+def prf_neighbouring_vertices(subject, hemi='lh', vertex=None, prf_params=None, compare=False, vertices_only=False, model="norm"):
 
     """prf_neighbouring_vertices
 
     Function to extract pRF-parameters from vertices neighbouring a particular vertex of interest. Internally uses
-    "call_prfinfo" to extract the parameters, so it assumes a particular kind of data structure (for now..)
+    :func:`fmriproc.prf.vertex_lookup`, so the surface and the pRF-parameters are only read once per process.
 
     Parameters
     ----------
@@ -1066,16 +1538,18 @@ def prf_neighbouring_vertices(subject, hemi='lh', vertex=None, prf_params=None,
         vertex from which to extract neighbouring vertices
     prf_params: str, np.ndarray
         if you do not want to depend on fixed data structures, you can specify the pRF-parameters directly with a string
-        pointing to a numpy-file or the numpy-array itself
+        pointing to a parameter file or the numpy-array itself (whole-brain; left hemisphere first)
     compare: bool
         if True, it will compare the parameters of neighbouring vertices with the parameters of <vertex>
     vertices_only: bool
         only return the vertices, not their pRF-parameters (which might depend on a certain project structure)
+    model: str, optional
+        model of the pRF-parameters, by default 'norm'
 
     Returns
     ----------
-    list
-        list of dictionaries containing the pRF-parameters for each vertex
+    dict
+        dictionary with the pRF-parameters for each vertex
 
     list
         list of the neighbouring vertices
@@ -1085,55 +1559,252 @@ def prf_neighbouring_vertices(subject, hemi='lh', vertex=None, prf_params=None,
     Note that the last element in both is the information about the requested vertex itself!
     """
 
-    if not isinstance(vertex, int):
+    if not isinstance(vertex, (int,np.integer)):
         raise ValueError("Must specify vertex from which to extract neighbours")
 
-    # fetch the surface used for vertex extraction
-    surf = utils.get_file_from_substring(
-        f"{hemi}.fiducial",
-        opj(os.environ.get('SUBJECTS_DIR'), subject, 'surf')
-    )
-
-    # define the command to fetch neighbouring vertices
-    cmd_2 = ('mris_info', '--vx', str(vertex), surf)
+    lookup = vertex_lookup(subject, prf_params=prf_params, model=model)
+    idx = int(lookup.index(vertex, hemi=hemi))
 
-    # read the output
-    L = utils.decode(subprocess.check_output(cmd_2)).splitlines()
+    # neighbours in hemisphere-specific IDs
+    offset = idx-vertex
+    verts = [int(ii-offset) for ii in lookup.neighbours(idx)]
 
-    # read number of neighbours
-    n_neighbours = int(L[4].split(' ')[-1])
-
-    if n_neighbours < 1:
+    if len(verts) < 1:
         raise ValueError("Vertex only has a few neighbours..?")
 
-    # loop through neighbouring vertices to extract their vertices
-    verts = []
-    list_neighbours = np.arange(0,n_neighbours)
-    for ii in list_neighbours:
-        line = list(filter(None, L[5+ii].split(' ')))
-        if line[0] == 'nbr' and line[1] == str(list_neighbours[ii]):
-            verts.append(int(line[2]))
-
     verts.append(vertex)
 
     if not vertices_only:
         # extract pRF parameters for each vertex
-        prfs = {}
-        for ii in verts:
-            cmd_1 = ('call_prfinfo', '-s', str(subject), '-v', str(ii), '-h', str(hemi))
-            prfs[ii] = ast.literal_eval(utils.decode(subprocess.check_output(cmd_1)).splitlines()[0])
+        df = lookup.prf(np.array(verts)+offset)
+        prfs = {ii: df.iloc[ix].to_dict() for ix,ii in enumerate(verts)}
 
         if compare:
             for ii in verts[:-1]:
                 print(f'Vertex {ii}:')
-                for el in ['x', 'y', 'size']:
-                    x = round((prfs[ii][el]/prfs[list(prfs.keys())[-1]][el])*100,2)
+                for el in ['x', 'y', 'prf_size']:
+                    x = round((prfs[ii][el]/prfs[vertex][el])*100,2)
                     print(f" {el} = {x}% similar")
 
         return prfs, verts
     else:
         return verts
 
+def surface_adjacency(subject, hemi="both", surf="fiducial"):
+
+    """surface_adjacency
+
+    Vertex adjacency of a FreeSurfer surface as sparse matrix, read from the triangles of `<hemi>.<surf>` in
+    `SUBJECTS_DIR/<subject>/surf`. With `hemi="both"`, the right hemisphere is appended to the left hemisphere, in line with
+    the `hemi-LR` files from `call_prf`.
+
+    Parameters
+    ----------
+    subject: str
+        string used as subject ID (e.g., 'sub-001')
+    hemi: str, optional
+        'lh', 'rh', or 'both' (default)
+    surf: str, optional
+        surface to read, by default 'fiducial'
+
+    Returns
+    ----------
+    scipy.sparse.csr_matrix
+        <vertices,vertices> boolean matrix that is True for neighbouring vertices
+    """
+
+    if hemi == "both":
+        return sparse.block_diag(
+            [surface_adjacency(subject, hemi=hh, surf=surf) for hh in ["lh","rh"]],
+            format="csr"
+        )
+
+    surf_file = utils.get_file_from_substring(
+        f"{hemi}.{surf}",
+        opj(os.environ.get('SUBJECTS_DIR'), subject, 'surf')
+    )
+
+    coords,faces = nb.freesurfer.read_geometry(surf_file)
+    edges = np.concatenate([faces[:,[0,1]], faces[:,[1,2]], faces[:,[2,0]]])
+    edges = np.concatenate([edges, edges[:,::-1]])
+
+    adj = sparse.coo_matrix(
+        (np.ones(edges.shape[0], dtype=bool), (edges[:,0], edges[:,1])),
+        shape=(coords.shape[0], coords.shape[0])
+    )
+
+    return adj.tocsr()
+
+class VertexLookup():
+
+    """VertexLookup
+
+    In-process lookup of surface neighbours and pRF-parameters. The surface adjacency (see
+    :func:`fmriproc.prf.surface_adjacency`) and the pRF-parameters are read once, after which neighbour, k-ring, and
+    pRF-queries for (many) vertices are answered from memory. This replaces calling `mris_info` and `call_prfinfo` per
+    vertex. Vertex indices are whole-brain indices (left hemisphere first, in line with the `hemi-LR` files from `call_prf`);
+    use :func:`fmriproc.prf.VertexLookup.index` to convert hemisphere-specific vertex IDs. Use
+    :func:`fmriproc.prf.vertex_lookup` to reuse the same object across calls.
+
+    Parameters
+    ----------
+    subject: str
+        string used as subject ID (e.g., 'sub-001')
+    prf_params: str, np.ndarray, optional
+        pRF-estimates; a file readable by :func:`fmriproc.prf.read_par_file` or the array itself. If None, we'll look for
+        `model-<model>`, `stage-<stage>` estimates in `prf_dir` with :func:`fmriproc.prf.find_par_file`
+    model: str, optional
+        model the estimates came from, by default 'norm'
+    stage: str, optional
+        stage the estimates came from, by default 'iter'
+    prf_dir: str, optional
+        directory to search for estimates, by default `$PRF/<subject>/ses-1`
+    surf: str, optional
+        surface used for the adjacency, by default 'fiducial'
+    verbose: bool, optional
+        print progress to the terminal
+
+    Example
+    ----------
+    >>> from fmriproc import prf
+    >>> lookup = prf.vertex_lookup("sub-001", model="norm")
+    >>> vert = lookup.index(3386, hemi="rh")
+    >>> lookup.neighbours(vert)
+    >>> lookup.k_ring(vert, k=2)
+    >>> lookup.prf(lookup.k_ring(vert, k=1, include_self=True))
+    """
+
+    def __init__(
+        self,
+        subject,
+        prf_params=None,
+        model="norm",
+        stage="iter",
+        prf_dir=None,
+        surf="fiducial",
+        verbose=False):
+
+        self.subject = subject
+        self.prf_params = prf_params
+        self.model = model
+        self.stage = stage
+        self.prf_dir = prf_dir
+        self.surf = surf
+        self.verbose = verbose
+        self._adjacency = None
+        self._params = None
+        self._n_lh = None
+
+    @property
+    def adjacency(self):
+        if self._adjacency is None:
+            utils.verbose(f"Reading {self.surf}-surface adjacency of {self.subject}", self.verbose)
+            adj = [surface_adjacency(self.subject, hemi=hh, surf=self.surf) for hh in ["lh","rh"]]
+            self._n_lh = adj[0].shape[0]
+            self._adjacency = sparse.block_diag(adj, format="csr")
+
+        return self._adjacency
+
+    @property
+    def n_lh(self):
+        if self._n_lh is None:
+            surf_file = opj(os.environ.get('SUBJECTS_DIR'), self.subject, 'surf', f"lh.{self.surf}")
+            self._n_lh = nb.freesurfer.read_geometry(surf_file)[0].shape[0]
+
+        return self._n_lh
+
+    def find_params(self):
+        """locate the parameter file if no estimates were specified"""
+        if self.prf_params is None:
+            if self.prf_dir is None:
+                self.prf_dir = opj(os.environ.get('PRF'), self.subject, 'ses-1')
+
+            self.prf_params = find_par_file([f"model-{self.model}", self.stage], self.prf_dir, exclude="_roi-V1")
+            if not isinstance(self.prf_params, str):
+                raise FileNotFoundError(f"Could not find model-{self.model}, stage-{self.stage} estimates in '{self.prf_dir}'")
+
+        return self.prf_params
+
+    @property
+    def params(self):
+        if self._params is None:
+            utils.verbose(f"Reading pRF-estimates from '{self.find_params()}'", self.verbose)
+            self._params = np.asarray(read_par_file(self.prf_params))
+
+        return self._params
+
+    def index(self, vertex, hemi="lh"):
+        """convert hemisphere-specific vertex ID(s) to whole-brain indices"""
+        vertex = np.asarray(vertex)
+        if hemi in ["rh","R","right"]:
+            return vertex+self.n_lh
+
+        return vertex
+
+    def neighbours(self, vertex):
+        """direct neighbours of `vertex`"""
+        adj = self.adjacency
+        return adj.indices[adj.indptr[vertex]:adj.indptr[vertex+1]].copy()
+
+    def k_ring(self, vertex, k=1, include_self=False):
+        """vertices within `k` edges of `vertex` (or of each vertex in a list of vertices)"""
+        adj = self.adjacency
+        visited = np.zeros(adj.shape[0], dtype=bool)
+        frontier = np.atleast_1d(vertex)
+        visited[frontier] = True
+
+        for _ in range(k):
+            nbrs = np.unique(np.concatenate([adj.indices[adj.indptr[ii]:adj.indptr[ii+1]] for ii in frontier]))
+            frontier = nbrs[~visited[nbrs]]
+            visited[frontier] = True
+
+        if not include_self:
+            visited[np.atleast_1d(vertex)] = False
+
+        return np.flatnonzero(visited)
+
+    def prf(self, vertices):
+        """pRF-parameters of `vertices` as dataframe (see :class:`fmriproc.prf.Parameters`), indexed by vertex"""
+        vertices = np.atleast_1d(vertices)
+        par_file = self.find_params() if self._params is None else None
+        if isinstance(par_file, str) and par_file.endswith("npz"):
+            # parameter store: read the requested rows only, rather than the full array
+            pars = read_par_store(par_file, vertices=vertices)
+        else:
+            pars = self.params[vertices]
+
+        df = Parameters(pars, model=self.model).to_df()
+        df.index = pd.Index(vertices, name="vertex")
+        return df
+
+    def query(self, vertices, k=1):
+        """pRF-parameters of each vertex in `vertices` and its `k`-ring; returns a dictionary with a dataframe per vertex"""
+        return {int(ii): self.prf(self.k_ring(ii, k=k, include_self=True)) for ii in np.atleast_1d(vertices)}
+
+# VertexLookup-objects kept for the lifetime of the process; see vertex_lookup
+_vertex_lookups = {}
+
+def vertex_lookup(subject, prf_params=None, model="norm", stage="iter", prf_dir=None, surf="fiducial", verbose=False):
+    """vertex_lookup
+
+    Return a :class:`fmriproc.prf.VertexLookup` for `subject`, reusing the object (and the surface/parameters it already read)
+    if the same lookup was requested before in this process.
+    """
+
+    key = (subject, prf_params if isinstance(prf_params, str) else id(prf_params), model, stage, prf_dir, surf)
+    if key not in _vertex_lookups:
+        _vertex_lookups[key] = VertexLookup(
+            subject,
+            prf_params=prf_params,
+            model=model,
+            stage=stage,
+            prf_dir=prf_dir,
+            surf=surf,
+            verbose=verbose
+        )
+
+    return _vertex_lookups[key]
+
 def create_line_prf_matrix(
     log_dir, 
     nr_trs=None,
@@ -1147,7 +1818,8 @@ def create_line_prf_matrix(
     baseline_after=24,
     skip_first_img=True,
     verbose=False,
-    dm_edges_clipping=[0,0,0,0]):
+    dm_edges_clipping=[0,0,0,0],
+    n_jobs=None):
 
     """create_line_prf_matrix
 
@@ -1189,6 +1861,8 @@ def create_line_prf_matrix(
         people don't always see the entirety of the screen so it's important to check what the subject can actually see by
         showing them the cross of for instance the BOLD-screen (the matlab one, not the linux one) and clip the image
         accordingly
+    n_jobs: int, optional
+        Number of threads used to decode the screenshots. Default is None (number of CPUs)
         
     Returns
     ----------
@@ -1267,9 +1941,6 @@ def create_line_prf_matrix(
         
         return dm
     else:
-        
-        # define empty design matrix
-        design_matrix = np.zeros((img.shape[0], img.shape[0], nr_trs))
 
         if verbose:
             print("Reading onset times from log-file")
@@ -1291,100 +1962,115 @@ def create_line_prf_matrix(
         # check baseline first
         baseline_start = settings['design'].get('start_duration')
 
-        utils.verbose("Creating design matrix (can take a few minutes with thousands of TRs)", verbose)
+        utils.verbose("Creating design matrix", verbose)
+
+        # time of each TR; optionally at the middle of TR
+        tr_in_sec = np.arange(nr_trs)*onsets.TR
+        if stim_at_half_TR:
+            tr_in_sec += 0.5*onsets.TR
+
+        # ix represents the trial ID in the onset dataframe, which starts at the first 't'
+        trial_ix = nearest_onsets(trial_df['onset'].values, tr_in_sec)
 
         # compatible with lineprf2
+        valid = np.ones(nr_trs, dtype=bool)
         if "baseline" in np.unique(trial_df['event_type'].values):
 
-            # find blank onsets; parse ranges into list of tuples and check if tr_in_sec falls in that range or not
-            # https://stackoverflow.com/a/6054040
+            # start doing stuff if tr_in_sec is greater than baseline and outside of blank periods
             blank_periods = trial_df.loc[(trial_df['event_type'] == 'blank')]['onset'].values
             blank_duration = settings['design'].get('inter_sweep_blank')
-            blank_ranges = [(i,i+blank_duration) for i in blank_periods]
 
-            for tr in range(nr_trs):
-                
-                # find time at the middle of TR
-                if stim_at_half_TR:
-                    tr_in_sec = (tr * onsets.TR)+0.5*onsets.TR
-                else:
-                    tr_in_sec = (tr * onsets.TR)
+            valid = tr_in_sec > baseline_start
+            if blank_periods.shape[0] > 0:
+                in_blank = (tr_in_sec[:,np.newaxis] >= blank_periods[np.newaxis,:]) & (tr_in_sec[:,np.newaxis] <= (blank_periods+blank_duration)[np.newaxis,:])
+                valid &= ~in_blank.any(axis=1)
 
-                # start doing stuff if tr_in_sec is greater than baseline
-                if tr_in_sec > baseline_start:
-                    
-                    # check blank area
-                    if not any(lower <= tr_in_sec <= upper for (lower, upper) in blank_ranges):
+        # index directory once: trial ID > file
+        screenshots = index_screenshots(screenshot_path)
+        
+        unique_trials = np.unique(trial_ix[valid])
+        missing = [ii for ii in unique_trials if ii not in screenshots]
+        for ii in missing:
+            print(f"WARNING; could not find image for trial #{ii}")
 
-                        # ix now represents the trial ID in the onset dataframe, which starts at the first 't'
-                        ix,_ = utils.find_nearest(trial_df['onset'].values, tr_in_sec)
-                        image_file = utils.get_file_from_substring(f"Screenshots{ix}.png", screenshot_path, return_msg=None)
-                        
-                        if image_file is not None:
-                            
-                            img = (255*mpimg.imread(image_file)).astype('int')
+        unique_trials = np.array([ii for ii in unique_trials if ii in screenshots], dtype=int)
 
-                            if img.shape[0] != img.shape[1]:
-                                offset = int((img.shape[1]-img.shape[0])/2)
-                                img = img[:, offset:(offset+img.shape[0])]
+        # decode, binarize, clip, and downsample every unique screenshot once
+        def make_frame(trial):
+            frame = read_screenshot_mask(opj(screenshot_path, screenshots[trial])).astype(float)
 
-                            # binarize image into dm matrix; i use ranges because I have another cue in the screenshots
-                            design_matrix[..., tr][np.where(((img[..., 0] < 40) & (img[..., 1] < 40)) |
-                                                            ((img[..., 0] > 200) & (img[..., 1] > 200)))] = 1
-        else:
+            #top, bottom, left, right
+            frame[:dm_edges_clipping[0], :] = 0
+            frame[(frame.shape[0]-dm_edges_clipping[1]):, :] = 0
+            frame[:, :dm_edges_clipping[2]] = 0
+            frame[:, (frame.shape[0]-dm_edges_clipping[3]):] = 0
 
-            # backwards compatibility for older versions of lineprf
-            for tr in range(nr_trs):
-    
-                # find time at the middle of TR
-                if stim_at_half_TR:
-                    tr_in_sec = (tr * onsets.TR)+0.5*onsets.TR
-                else:
-                    tr_in_sec = (tr * onsets.TR)
+            if n_pix != frame.shape[0]:
+                frame = resample2d(frame, n_pix)
+                frame[frame<0.9] = 0
 
-                # ix now represents the trial ID in the onset dataframe, which starts at the first 't'
-                ix,_ = utils.find_nearest(trial_df['onset'].values, tr_in_sec)
-                
-                # zero-pad number https://stackoverflow.com/questions/2189800/how-to-find-length-of-digits-in-an-integer
-                zfilling = len(str(len(os.listdir(screenshot_path))))
-                img_number = str(ix).zfill(zfilling)
-                search_for = f"Screenshots{img_number}.png"
-                try:
-                    image_file = utils.get_file_from_substring(search_for, screenshot_path)
-                except:
-                    image_file = None
+            return frame
 
-                if isinstance(image_file, list):
-                    raise ValueError(f"Found multiple ({len(image_file)}) files for '{search_for}': {image_file}")
-                
-                if image_file is not None:
-                    
-                    img = (255*mpimg.imread(image_file)).astype('int')
+        frames = Parallel(n_jobs=-1 if n_jobs is None else n_jobs, prefer="threads")(
+            delayed(make_frame)(trial) for trial in unique_trials
+        )
 
-                    if img.shape[0] != img.shape[1]:
-                        offset = int((img.shape[1]-img.shape[0])/2)
-                        img = img[:, offset:(offset+img.shape[0])]
+        utils.verbose(f"Decoded {len(frames)} unique screenshots for {valid.sum()} TRs", verbose)
 
-                    # binarize image into dm matrix
-                    # assumes: standard RGB255 format; only colors present in image are black, white, grey, red, green.
-                    design_matrix[..., tr][np.where(((img[..., 0] < 40) & (img[..., 1] < 40)) |
-                                                    ((img[..., 0] > 200) & (img[..., 1] > 200)))] = 1
-                else:
-                    print(f"WARNING; could not find image for trial #{tr} ({search_for})")
+        # assign frames to TRs; last frame is empty for TRs without stimulus
+        n_out = frames[0].shape[0] if len(frames) > 0 else n_pix
+        frames = np.stack(frames+[np.zeros((n_out,n_out))], axis=-1)
+        frame_ix = np.full(nr_trs, frames.shape[-1]-1)
+        has_img = valid & np.isin(trial_ix, unique_trials)
+        frame_ix[has_img] = np.searchsorted(unique_trials, trial_ix[has_img])
 
-        #top, bottom, left, right
-        design_matrix[:dm_edges_clipping[0], :, :] = 0
-        design_matrix[(design_matrix.shape[0]-dm_edges_clipping[1]):, :, :] = 0
-        design_matrix[:, :dm_edges_clipping[2], :] = 0
-        design_matrix[:, (design_matrix.shape[0]-dm_edges_clipping[3]):, :] = 0
+        return frames[...,frame_ix]
 
-        # downsample (resample2d can also deal with 3D input)
-        if n_pix != design_matrix.shape[0]:
-            dm_resampled = resample2d(design_matrix, n_pix)
-            dm_resampled[dm_resampled<0.9] = 0
-            return dm_resampled
-        else:
-            return design_matrix
+def nearest_onsets(onsets, times):
+    """vectorized :func:`lazyfmri.utils.find_nearest`: index of the onset closest to each element in `times`"""
+
+    srt = np.argsort(onsets, kind="stable")
+    on = onsets[srt]
+    
+    right = np.clip(np.searchsorted(on, times), 0, len(on)-1)
+    left = np.clip(right-1, 0, len(on)-1)
+
+    # first occurrence of repeated onsets; the stable sort keeps their original order
+    right = srt[np.searchsorted(on, on[right])]
+    left = srt[np.searchsorted(on, on[left])]
+    
+    # ties go to the first onset in the list, like np.argmin
+    d_right = np.abs(onsets[right]-times)
+    d_left = np.abs(onsets[left]-times)
+    return np.where(d_right < d_left, right, np.where(d_left < d_right, left, np.minimum(left, right)))
+
+def index_screenshots(screenshot_path):
+    """map trial numbers to the files of a Screenshots-directory (e.g., 'Screenshots12.png' or 'Screenshots012.png' > 12)"""
+
+    index = {}
+    for ff in os.listdir(screenshot_path):
+        match = re.search(r"Screenshots(\d+)\.png$", ff)
+        if match:
+            trial = int(match.group(1))
+            if trial in index:
+                raise ValueError(f"Found multiple files for trial #{trial} in '{screenshot_path}': '{index[trial]}' and '{ff}'")
+
+            index[trial] = ff
+
+    return index
+
+def read_screenshot_mask(image_file, lower=40, upper=200):
+    """read screenshot, crop it to a square, and binarize it; black and white pixels are stimulus"""
+
+    img = (255*mpimg.imread(image_file)).astype('int')
+
+    if img.shape[0] != img.shape[1]:
+        offset = int((img.shape[1]-img.shape[0])/2)
+        img = img[:, offset:(offset+img.shape[0])]
+
+    # i use ranges because I have another cue in the screenshots
+    # assumes: standard RGB255 format; only colors present in image are black, white, grey, red, green.
+    return ((img[..., 0] < lower) & (img[..., 1] < lower)) | ((img[..., 0] > upper) & (img[..., 1] > upper))
 
 def create_stim_library(n_pix, prf_stim, range_around_center=[40,40], concentricity=0.5, stim_factor=4, beam_size=26):
 
@@ -1699,6 +2385,174 @@ def generate_model_params(
     # return
     return settings, prf_stim
 
+def grid_cache_key(model, *args, **kwargs):
+    """grid_cache_key
+
+    Hash everything that determines the grid predictions of a `prfpy`-model: the model type, the design matrix, the TR, the
+    coordinates of the stimulus (screen size/distance), the HRF, filter settings, and the grid definitions passed to
+    `create_grid_predictions`.
+
+    Parameters
+    ----------
+    model: prfpy.model.Iso2DGaussianModel
+        model object of which the grid predictions will be created
+    args: optional
+        positional arguments passed on to `create_grid_predictions` (e.g., ecc/polar/size grids)
+    kwargs: optional
+        keyword arguments passed on to `create_grid_predictions`
+
+    Returns
+    ----------
+    str
+        sha1 hex digest
+    """
+
+    sha = hashlib.sha1()
+    sha.update(type(model).__name__.encode())
+
+    stim = model.stimulus
+    sha.update(str(stim.design_matrix.dtype).encode())
+    for el in [stim.design_matrix, stim.x_coordinates, stim.y_coordinates]:
+        sha.update(np.ascontiguousarray(el, dtype=float).tobytes())
+
+    sha.update(repr(float(stim.TR)).encode())
+
+    for attr in ["hrf", "hrf_params", "filter_predictions", "filter_type", "filter_params", "normalize_RFs"]:
+        val = getattr(model, attr, None)
+        if isinstance(val, np.ndarray):
+            sha.update(np.ascontiguousarray(val, dtype=float).tobytes())
+        else:
+            sha.update(repr(val).encode())
+
+    for val in list(args) + [kwargs[key] for key in sorted(kwargs)]:
+        if isinstance(val, (np.ndarray, list, tuple)):
+            sha.update(np.ascontiguousarray(val, dtype=float).tobytes())
+        else:
+            sha.update(repr(val).encode())
+
+    return sha.hexdigest()
+
+def prune_grid_cache(cache_dir, max_size=10):
+    """remove least recently used entries from `cache_dir` until the total size is below `max_size` (in GB)"""
+
+    entries = []
+    for el in os.listdir(cache_dir):
+        path = opj(cache_dir, el)
+        if os.path.isdir(path) and not el.startswith("."):
+            size = sum([os.path.getsize(opj(path, ff)) for ff in os.listdir(path)])
+            entries.append((os.path.getmtime(path), size, path))
+
+    total = sum([el[1] for el in entries])
+    for _,size,path in sorted(entries):
+        if total <= max_size*1e9:
+            break
+        
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+def cast_grid_predictions(model, dtype=np.float32):
+    """cast the grid predictions of a `prfpy`-model to `dtype` as soon as they are created"""
+
+    create_grid_predictions = model.create_grid_predictions
+
+    def cast_predictions(*args, **kwargs):
+        create_grid_predictions(*args, **kwargs)
+        if isinstance(getattr(model, "predictions", None), np.ndarray):
+            model.predictions = model.predictions.astype(dtype, copy=False)
+
+    model.create_grid_predictions = cast_predictions
+    return model
+
+def cache_grid_predictions(model, cache_dir=None, max_size=10, verbose=False):
+    """cache_grid_predictions
+
+    Wraps `create_grid_predictions` of a `prfpy`-model so that the grid predictions are stored on disk in `cache_dir`. The
+    entries are keyed by :func:`fmriproc.prf.grid_cache_key`, so subjects sharing the same design matrix, TR, HRF, and grid
+    settings will read the predictions as memory-mapped arrays rather than regenerating them. Once the cache exceeds
+    `max_size`, the least recently used entries are removed.
+
+    Parameters
+    ----------
+    model: prfpy.model.Iso2DGaussianModel
+        model object to wrap
+    cache_dir: str
+        directory to store the predictions in
+    max_size: float, optional
+        maximum size of the cache in GB. Default = 10
+    verbose: bool, optional
+        print messages to the terminal
+
+    Returns
+    ----------
+    prfpy.model.Iso2DGaussianModel
+        same object, with cached `create_grid_predictions`
+
+    Example
+    ----------
+
+    .. code-block:: python
+
+        from fmriproc import prf
+        model = prf.cache_grid_predictions(Iso2DGaussianModel(stimulus=prf_stim), cache_dir="/path/to/cache")
+    """
+
+    if not isinstance(cache_dir, str):
+        raise ValueError(f"Please specify a directory to cache the grid predictions, not '{cache_dir}'")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    create_grid_predictions = model.create_grid_predictions
+
+    def cached_grid_predictions(*args, **kwargs):
+
+        key = grid_cache_key(model, *args, **kwargs)
+        entry = opj(cache_dir, key)
+
+        if os.path.isdir(entry):
+            utils.verbose(f"Reading grid predictions from cache '{entry}'", verbose)
+            with open(opj(entry, "attrs.pkl"), "rb") as f:
+                attrs = pickle.load(f)
+
+            for attr in attrs["arrays"]:
+                setattr(model, attr, np.load(opj(entry, f"{attr}.npy"), mmap_mode="c"))
+
+            for attr,val in attrs["other"].items():
+                setattr(model, attr, val)
+
+            # mark as recently used
+            os.utime(entry)
+            return
+
+        # keep track of which attributes are created/updated
+        before = {attr: id(val) for attr,val in vars(model).items()}
+        create_grid_predictions(*args, **kwargs)
+        changed = {attr: val for attr,val in vars(model).items() if before.get(attr) != id(val)}
+
+        # write to temporary directory first; another subject might be writing the same entry
+        tmp = opj(cache_dir, f".{key}.{os.getpid()}")
+        os.makedirs(tmp, exist_ok=True)
+
+        attrs = {"arrays": [], "other": {}}
+        for attr,val in changed.items():
+            if isinstance(val, np.ndarray):
+                np.save(opj(tmp, f"{attr}.npy"), val)
+                attrs["arrays"].append(attr)
+            else:
+                attrs["other"][attr] = val
+
+        with open(opj(tmp, "attrs.pkl"), "wb") as f:
+            pickle.dump(attrs, f)
+
+        try:
+            os.rename(tmp, entry)
+            utils.verbose(f"Stored grid predictions in cache '{entry}'", verbose)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        prune_grid_cache(cache_dir, max_size=max_size)
+
+    model.create_grid_predictions = cached_grid_predictions
+    return model
+
 class GaussianModel():
 
     def __init__(self):     
@@ -1789,8 +2643,9 @@ class GaussianModel():
         self.optimizer_kws_gauss = self.fetch_optimizer_info(self.constraints[0])
 
         # fit
-        self.gaussian_fitter.iterative_fit(
-            rsq_threshold=self.settings['rsq_threshold'], 
+        self.batched_iterfit(
+            self.gaussian_fitter,
+            model="gauss",
             bounds=self.gauss_bounds,
             **self.optimizer_kws_gauss
         )
@@ -1908,14 +2763,22 @@ class ExtendedModel():
                 self.verbose
             )
 
-            self.tmp_fitter.grid_fit(
-                *self.grid_list,
-                n_batches=self.nr_jobs,
-                verbose=self.verbose,
-                rsq_threshold=self.settings['rsq_threshold'],
-                fixed_grid_baseline=self.fix_grid_baseline,
-                grid_bounds=self.grid_bounds
-            )
+            # adaptive grid for DN-models; 'adaptive_depth' can be overwritten in the call to pRFmodelFitting
+            depth = 0
+            if self.model in ["norm","abc","abd"]:
+                depth = getattr(self, "adaptive_depth", self.settings['norm'].get('adaptive_depth', 0))
+
+            if isinstance(depth, int) and depth > 0:
+                self.adaptive_gridfit(depth=depth)
+            else:
+                self.tmp_fitter.grid_fit(
+                    *self.grid_list,
+                    n_batches=self.nr_jobs,
+                    verbose=self.verbose,
+                    rsq_threshold=self.settings['rsq_threshold'],
+                    fixed_grid_baseline=self.fix_grid_baseline,
+                    grid_bounds=self.grid_bounds
+                )
 
             elapsed = (time.time() - start)
 
@@ -1946,6 +2809,91 @@ class ExtendedModel():
 
         setattr(self, f"{self.model}_fitter", self.tmp_fitter)
 
+    def subset_fitter(self, idx):
+        """fitter of the active model for the timecourses in `idx`, with a matching subset of the Gaussian fitter"""
+
+        kws = self.ext_fit_kws.copy()
+        if "previous_gaussian_fitter" in list(kws.keys()):
+            prev = kws["previous_gaussian_fitter"]
+            n_units = prev.data.shape[0]
+
+            sub = copy.copy(prev)
+            for attr in ["data", "data_var", "gridsearch_params", "iterative_search_params", "rsq_mask", "gridsearch_rsq_mask"]:
+                val = getattr(prev, attr, None)
+                if isinstance(val, np.ndarray) and val.shape[0] == n_units:
+                    setattr(sub, attr, val[idx])
+
+            sub.n_units = idx.shape[0]
+            kws["previous_gaussian_fitter"] = sub
+
+        fitter = self.active_fitter(
+            self.active_model, 
+            self.data[idx],
+            n_jobs=self.nr_jobs,
+            **kws
+        )
+
+        fitter.fit_hrf = self.tmp_fitter.fit_hrf
+        return fitter
+
+    def adaptive_gridfit(self, depth=1):
+        """adaptive_gridfit
+
+        Coarse-to-fine alternative to the dense grid of the DN-model. The grid is first evaluated on every `2**depth`-th value
+        of each dense grid (surround amplitude/size, neural/surround baseline). Each refinement pass halves this stride and
+        evaluates, per vertex, only the grid points within one stride of the best grid point so far. Vertices that share the
+        same neighbourhood are fitted together. The last pass has a stride of 1, i.e., it searches the direct neighbours in
+        the dense grid. For each vertex, the parameters with the highest r2 across all passes are kept, so refinement can
+        never decrease r2 relative to the coarse grid.
+
+        Parameters
+        ----------
+        depth: int, optional
+            Number of refinement passes, by default 1
+        """
+
+        dense = [np.unique(np.array(grid, dtype='float32')) for grid in self.grid_list]
+        stride = 2**depth
+        grid_kws = {
+            "n_batches": self.nr_jobs,
+            "verbose": False,
+            "rsq_threshold": self.settings['rsq_threshold'],
+            "fixed_grid_baseline": self.fix_grid_baseline,
+            "grid_bounds": self.grid_bounds
+        }
+
+        # coarse grid; always include the extremes of the dense grid
+        coarse = [np.unique(np.r_[grid[::stride], grid[-1]]) for grid in dense]
+        utils.verbose(f"Adaptive grid: coarse grid of {[len(i) for i in coarse]} (dense={[len(i) for i in dense]})", self.verbose)
+        self.tmp_fitter.grid_fit(*coarse, **grid_kws)
+        best = self.tmp_fitter.gridsearch_params.copy()
+
+        # columns of surround amplitude, surround size, neural baseline, surround baseline in DN-parameters
+        cols = [5,6,7,8]
+        for _ in range(depth):
+            stride //= 2
+
+            # index of the current best value per vertex in each dense grid
+            ix = np.stack([np.abs(best[:,col,np.newaxis]-grid[np.newaxis,:]).argmin(axis=-1) for col,grid in zip(cols,dense)], axis=-1)
+
+            # vertices with the same best grid point share their local grid
+            uniq, groups = np.unique(ix, axis=0, return_inverse=True)
+            groups = groups.ravel()
+            utils.verbose(f"Adaptive grid: refining with stride {stride} in {uniq.shape[0]} neighbourhood(s)", self.verbose)
+            for gr,center in enumerate(uniq):
+                idx = np.where(groups == gr)[0]
+                local = [grid[np.unique(np.clip([c-stride, c, c+stride], 0, len(grid)-1))] for c,grid in zip(center,dense)]
+
+                fitter = self.subset_fitter(idx)
+                fitter.grid_fit(*local, **grid_kws)
+                pars = fitter.gridsearch_params
+
+                improved = pars[:,-1] > best[idx,-1]
+                best[idx[improved]] = pars[improved]
+
+        self.tmp_fitter.gridsearch_params = best
+        self.tmp_fitter.gridsearch_rsq_mask = best[:,-1] > self.settings['rsq_threshold']
+
     def iterfit(self):
 
         # fetch bounds from settings > HRF bounds are automatically appended if fit_hrf=True
@@ -1978,8 +2926,9 @@ class ExtendedModel():
         self.optimizer_kws_ext = self.fetch_optimizer_info(self.constraints[1])
 
         # fit
-        self.tmp_fitter.iterative_fit(
-            rsq_threshold=self.settings['rsq_threshold'], 
+        self.batched_iterfit(
+            self.tmp_fitter,
+            model=self.model,
             bounds=self.tmp_bounds,
             **self.optimizer_kws_ext
         )
@@ -2018,7 +2967,8 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
     ----------
     data: numpy.ndarray
         <voxels,time> numpy array | when reading in the data later again, the format must be <time,voxels>. This is highly
-        annoying, but it seems to be required for predictions to work properly.
+        annoying, but it seems to be required for predictions to work properly. Can also be a path to an `npy`-file, which
+        is read memory-mapped; masks and batches are then sliced from the file rather than copying the full array.
     design_matrix: numpy.ndarray
         <n_pix, n_pix, time> numpy array containing the paradigm
     TR: float
@@ -2089,11 +3039,45 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
     fix_hrf: bool, optional
         Fix the HRF parameters from a previous fitter. For instance, you run a Gaussian model followed by DoG model and would
         like to use the fitted parameters from the Gaussian model for the DoG model. Default is False.
+    mask: numpy.ndarray, list, optional
+        Boolean array (same length as the number of voxels/vertices in `data`) or list of indices describing which
+        timecourses should be fitted (e.g., the vertices of a V1-label). Only these timecourses are sent to the fitters,
+        which avoids fitting hundreds of thousands of flat timecourses. Output parameters are scattered back into arrays with
+        the original dimensions on save (zeros outside the mask).
+    min_variance: float, optional
+        Only fit timecourses with a variance larger than `min_variance`. Can be combined with `mask`, in which case both
+        criteria need to be satisfied. Default is None (no variance floor).
+    min_stim_corr: float, optional
+        Only fit timecourses of which the absolute correlation with the stimulus energy (see
+        :func:`fmriproc.prf.stimulus_energy_regressor`) exceeds `min_stim_corr`. Excluded timecourses skip both the grid and
+        iterative stages and get zeros as parameters. Can be combined with `mask` and `min_variance`. Default is None
+    batch_size: int, optional
+        Run the iterative stages in batches of `batch_size` timecourses. After each batch, the parameters are written to a
+        shard (`batch-<nr>.npy`) in `<output_dir>/<output_base>_model-<model>_desc-checkpoints` together with a `manifest.json`.
+        If the fit is killed, a new call with the same settings will skip the batches listed in the manifest and only fit
+        what remains. Checkpoints written with different starting parameters, data dimensions, bounds, or settings are
+        ignored. Requires `write_files=True`; the checkpoint directory is removed once the final `npz`-file is written.
+        Default is None (fit all timecourses in one go).
+    grid_cache: str, optional
+        Directory in which the predictions of the Gaussian grid are cached (see :func:`fmriproc.prf.cache_grid_predictions`).
+        The predictions are keyed by the design matrix, TR, HRF, grid settings and model, so subjects that share the same
+        stimulus load the grid from disk rather than regenerating it. Default is None (no caching).
+    grid_cache_size: float, optional
+        Maximum size of `grid_cache` in GB; least recently used entries are removed beyond this limit. Default = 10
+    precision: str, optional
+        Floating point precision of the data, design matrix, grid predictions, and output parameters/predictions. Use
+        `float32` to halve the memory and bandwidth of the grid stage. Default = "float64"
+    adjacency: str, scipy.sparse.spmatrix, optional
+        Vertex adjacency of the surface the data lives on (see :func:`fmriproc.prf.surface_adjacency`), or a subject ID
+        (e.g., 'sub-001') to create it from the FreeSurfer surfaces. If specified, the iterative stages are run
+        neighbour-seeded (see :func:`fmriproc.prf.pRFmodelFitting.neighbour_iterfit`): vertices are fitted in waves over the
+        surface, and each optimizer starts from the best of its own grid solution and already converged neighbours. This
+        replaces `batch_size`-checkpointing. Default is None
 
     Returns
     ----------
-    pkl-file
-        For each model, a pickle file with the settings, parameters, and predictions all in one
+    npz-file
+        For each model, a parameter store with the settings and parameters (see :func:`fmriproc.prf.write_par_file`)
 
     Example
     ----------
@@ -2147,6 +3131,13 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
         skip_grid=False,
         use_grid_bounds=True,
         mask=None,
+        min_variance=None,
+        min_stim_corr=None,
+        batch_size=None,
+        grid_cache=None,
+        grid_cache_size=10,
+        precision="float64",
+        adjacency=None,
         transpose=False,
         skip_settings=False,
         **kwargs):
@@ -2175,6 +3166,13 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
         self.skip_grid          = skip_grid
         self.use_grid_bounds    = use_grid_bounds
         self.mask               = mask
+        self.min_variance       = min_variance
+        self.min_stim_corr      = min_stim_corr
+        self.batch_size         = batch_size
+        self.grid_cache         = grid_cache
+        self.grid_cache_size    = grid_cache_size
+        self.precision          = precision
+        self.adjacency          = adjacency
         self.transpose          = transpose
         self.skip_settings      = skip_settings
         self.__dict__.update(kwargs)
@@ -2187,7 +3185,19 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
         # read design matrix if needed
         if isinstance(self.data, str):
             utils.verbose(f"Reading data from '{self.data}'", self.verbose)
-            self.data = read_par_file(self.data)            
+            self.data = read_par_file(self.data, mmap_mode="r")
+
+        # single or double precision throughout
+        allowed_precision = ["float32", "float64"]
+        if self.precision not in allowed_precision:
+            raise ValueError(f"Precision must be one of {allowed_precision}, not '{self.precision}'")
+        
+        self.dtype = np.dtype(self.precision)
+        if self.precision == "float32":
+            utils.verbose("Using single precision (float32) for data, design, and grid predictions", self.verbose)
+            self.design_matrix = self.design_matrix.astype(self.dtype, copy=False)
+            if isinstance(self.data, np.ndarray):
+                self.data = self.data.astype(self.dtype, copy=False)
 
         # adjust design matrix to data
         # make data 2D
@@ -2218,6 +3228,19 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
                     self.verbose
                 )
 
+        # surface adjacency for neighbour-seeded fits
+        if isinstance(self.adjacency, str):
+            utils.verbose(f"Reading surface adjacency of '{self.adjacency}'", self.verbose)
+            self.adjacency = surface_adjacency(self.adjacency)
+
+        # only send a subset of vertices to the fitters if requested; keep track of the original dimensions so we can
+        # scatter the parameters back on save
+        self.fit_idx = None
+        if isinstance(self.data, np.ndarray):
+            self.n_vertices = self.data.shape[0]
+            if self.mask is not None or isinstance(self.min_variance, (int,float)) or isinstance(self.min_stim_corr, (int,float)):
+                self.define_fit_vertices()
+
         #-----------------------------------------------------------------------------
         # Fetch the settings
         self.define_settings()
@@ -2269,6 +3292,344 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
             utils.verbose(f"Setting {self.model_obj} as '{model}_model'-attribute", self.verbose)
             setattr(self, f'{model}_model', self.model_obj)
 
+        if self.precision == "float32":
+            for mod in np.unique(["gauss", "css", "dog", self.model]):
+                cast_grid_predictions(getattr(self, f"{mod}_model"), dtype=self.dtype)
+
+        # the Gaussian grid only depends on the stimulus/HRF/grid settings, so it can be shared across subjects. Extended
+        # grids are built from the Gaussian parameters of each vertex and are not cached
+        if isinstance(self.grid_cache, str):
+            cache_grid_predictions(
+                self.gauss_model,
+                cache_dir=self.grid_cache,
+                max_size=self.grid_cache_size,
+                verbose=self.verbose
+            )
+
+    def define_fit_vertices(self):
+
+        keep = np.ones(self.n_vertices, dtype=bool)
+        if self.mask is not None:
+            mask = np.asarray(self.mask)
+            if mask.dtype == bool:
+                if mask.shape[0] != self.n_vertices:
+                    raise ValueError(f"Shape of mask ({mask.shape[0]}) does not match number of timecourses ({self.n_vertices})")
+
+                keep &= mask
+            else:
+                roi = np.zeros_like(keep)
+                roi[mask.astype(int)] = True
+                keep &= roi
+
+        # chunked so memory-mapped data is not read in all at once
+        if isinstance(self.min_variance, (int,float)):
+            for ix in range(0, self.n_vertices, 10000):
+                keep[ix:ix+10000] &= np.nanvar(self.data[ix:ix+10000], axis=-1) > self.min_variance
+
+        # correlation with stimulus energy
+        if isinstance(self.min_stim_corr, (int,float)):
+            reg = stimulus_energy_regressor(self.design_matrix, TR=self.TR)
+            reg = (reg-reg.mean())/reg.std()
+            n_before = keep.sum()
+            for ix in range(0, self.n_vertices, 10000):
+                tc = np.nan_to_num(np.asarray(self.data[ix:ix+10000], dtype=float))
+                tc = tc-tc.mean(axis=-1, keepdims=True)
+                std = tc.std(axis=-1)
+                corr = np.divide(tc @ reg/reg.shape[0], std, out=np.zeros_like(std), where=std>0)
+                keep[ix:ix+10000] &= np.abs(corr) > self.min_stim_corr
+
+            self.n_prefiltered = n_before-keep.sum()
+            utils.verbose(
+                f"Prefilter: skipping {self.n_prefiltered}/{n_before} timecourses with |r| < {self.min_stim_corr} with the stimulus energy",
+                self.verbose
+            )
+
+        self.fit_idx = np.where(keep)[0]
+        if self.fit_idx.shape[0] == 0:
+            raise ValueError("No timecourses survived the mask/variance/prefilter criteria; nothing to fit")
+
+        self.data = self.data[self.fit_idx]
+        utils.verbose(
+            f"Sparse fitting: sending {self.fit_idx.shape[0]}/{self.n_vertices} timecourses to the fitters",
+            self.verbose
+        )
+
+    def scatter_params(self, params):
+        """scatter parameters of the fitted vertices back into an array with the original number of vertices"""
+
+        if self.fit_idx is None or params.shape[0] == self.n_vertices:
+            return params
+
+        full = np.zeros((self.n_vertices, params.shape[-1]), dtype=params.dtype)
+        full[self.fit_idx] = params
+        return full
+
+    def checkpoint_dir(self, model=None):
+        return opj(self.output_dir, f"{self.output_base}_model-{model}_desc-checkpoints")
+
+    def checkpoint_key(self, data, start_params, bounds=None, **kwargs):
+        """sha1 identifying a batched iterfit: starting (grid) parameters, data shape/dtype, bounds, settings, and the
+        arguments passed on to `iterative_fit`"""
+
+        sha = hashlib.sha1()
+        sha.update(np.ascontiguousarray(start_params).tobytes())
+        sha.update(str((data.shape, str(data.dtype))).encode())
+
+        if bounds is not None:
+            for b in bounds:
+                sha.update(np.asarray(b, dtype=float).tobytes())
+
+        for ddict in [self.settings, kwargs]:
+            sha.update(json.dumps(ddict, sort_keys=True, default=str).encode())
+
+        return sha.hexdigest()
+
+    def read_manifest(self, model=None, n_units=None, n_params=None, key=None):
+        """read the manifest of an interrupted fit; start fresh if it was created with different dimensions or a different
+        `key` (see :func:`fmriproc.prf.pRFmodelFitting.checkpoint_key`)"""
+
+        ddict = {
+            "model": model,
+            "n_units": int(n_units),
+            "n_params": int(n_params),
+            "batch_size": int(self.batch_size),
+            "key": key,
+            "completed": []
+        }
+
+        manifest = opj(self.checkpoint_dir(model=model), "manifest.json")
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                old = json.load(f)
+            
+            if all([old.get(key) == ddict[key] for key in ["model", "n_units", "n_params", "batch_size", "key"]]):
+                ddict["completed"] = old["completed"]
+                utils.verbose(
+                    f"Resuming {model} iterfit from '{manifest}': {len(ddict['completed'])} batch(es) completed",
+                    self.verbose
+                )
+            else:
+                utils.verbose(f"Manifest '{manifest}' does not match current fit; starting from scratch", self.verbose)
+
+        return ddict
+
+    def write_manifest(self, ddict, model=None):
+
+        # write to temporary file first so a killed job never leaves a corrupt manifest
+        manifest = opj(self.checkpoint_dir(model=model), "manifest.json")
+        with open(f"{manifest}.tmp", "w") as f:
+            json.dump(ddict, f, indent=4)
+
+        os.replace(f"{manifest}.tmp", manifest)
+
+    def remove_checkpoints(self, model=None):
+        
+        if isinstance(self.output_dir, str):
+            ckpt_dir = self.checkpoint_dir(model=model)
+            if os.path.isdir(ckpt_dir):
+                utils.verbose(f"Removing checkpoints in '{ckpt_dir}'", self.verbose)
+                shutil.rmtree(ckpt_dir)
+
+    def iterfit_subset(self, fitter, data, idx, start_params, bounds, **kwargs):
+        """run `iterative_fit` of `fitter` on the timecourses in `idx` only and return their parameters"""
+
+        unitwise = bounds is not None and isinstance(bounds[0], np.ndarray) and bounds[0].ndim == 2
+
+        # prfpy only derives these if they are missing; otherwise they'd be those of the previous subset
+        for attr in ["rsq_mask", "starting_params"]:
+            if hasattr(fitter, attr):
+                delattr(fitter, attr)
+
+        fitter.data = data[idx]
+        fitter.n_units = idx.shape[0]
+        if hasattr(fitter, "data_var"):
+            fitter.data_var = fitter.data.var(axis=-1)
+
+        fitter.iterative_fit(
+            rsq_threshold=self.settings['rsq_threshold'],
+            starting_params=start_params[idx],
+            bounds=[bounds[i] for i in idx] if unitwise else bounds,
+            **kwargs
+        )
+
+        return fitter.iterative_search_params
+
+    def restore_fitter(self, fitter, data, start_params, params):
+        """restore `fitter` as if `iterative_fit` ran on all data at once"""
+
+        fitter.data = data
+        fitter.n_units = data.shape[0]
+        if hasattr(fitter, "data_var"):
+            fitter.data_var = data.var(axis=-1)
+
+        fitter.starting_params = start_params
+        fitter.iterative_search_params = params
+        fitter.rsq_mask = start_params[:,-1] > self.settings['rsq_threshold']
+
+    def batched_iterfit(self, fitter, model=None, bounds=None, **kwargs):
+        """batched_iterfit
+
+        Run `iterative_fit` of `fitter` in batches of `batch_size` timecourses, writing the parameters of each batch to a
+        shard in :func:`fmriproc.prf.pRFmodelFitting.checkpoint_dir`. Batches listed in the manifest are read from disk
+        rather than fitted. Falls back to a single call to `iterative_fit` if `batch_size` is not set or `write_files=False`.
+        If `adjacency` is specified, :func:`fmriproc.prf.pRFmodelFitting.neighbour_iterfit` is used instead. After
+        completion, `iterative_search_params` and `rsq_mask` of `fitter` span all timecourses as if fitted in one go.
+        """
+
+        if self.adjacency is not None:
+            self.neighbour_iterfit(fitter, bounds=bounds, **kwargs)
+            return
+
+        if not isinstance(self.batch_size, int) or not self.write_files:
+            fitter.iterative_fit(
+                rsq_threshold=self.settings['rsq_threshold'],
+                bounds=bounds,
+                **kwargs
+            )
+            return
+
+        # keep full data; we'll swap batches in and out of the fitter
+        data = fitter.data
+        start_params = fitter.gridsearch_params
+        n_units = data.shape[0]
+        
+        ckpt_dir = self.checkpoint_dir(model=model)
+        os.makedirs(ckpt_dir, exist_ok=True)
+        manifest = self.read_manifest(
+            model=model,
+            n_units=n_units,
+            n_params=start_params.shape[-1],
+            key=self.checkpoint_key(data, start_params, bounds=bounds, **kwargs)
+        )
+        
+        batches = np.array_split(np.arange(n_units), math.ceil(n_units/self.batch_size))
+        params = np.zeros_like(start_params)
+        for ix,idx in enumerate(batches):
+
+            shard = opj(ckpt_dir, f"batch-{str(ix).zfill(4)}.npy")
+            if ix in manifest["completed"] and os.path.exists(shard):
+                params[idx] = np.load(shard)
+                continue
+            
+            utils.verbose(f" Fitting batch {ix+1}/{len(batches)} ({idx.shape[0]} timecourses)", self.verbose)
+            params[idx] = self.iterfit_subset(fitter, data, idx, start_params, bounds, **kwargs)
+            np.save(shard, params[idx])
+
+            manifest["completed"].append(ix)
+            self.write_manifest(manifest, model=model)
+
+        self.restore_fitter(fitter, data, start_params, params)
+
+    def neighbour_waves(self, adjacency, rsq):
+        """neighbour_waves
+
+        Order the timecourses in breadth-first waves over the surface, starting at the vertex with the highest `rsq` of each
+        connected component. Consecutive waves are merged until they contain at least `min_wave` vertices (10x `nr_jobs`,
+        but at least 100), so that each call to `iterative_fit` still keeps all jobs busy.
+
+        Returns
+        ----------
+        list
+            list of index arrays, one per wave
+        """
+
+        n_units = adjacency.shape[0]
+        min_wave = max(100, 10*self.nr_jobs)
+        visited = np.zeros(n_units, dtype=bool)
+        order = np.argsort(np.nan_to_num(rsq, nan=-np.inf))[::-1]
+
+        waves = []
+        current = []
+        seed_ix = 0
+        frontier = np.zeros(n_units, dtype=bool)
+        while not visited.all():
+
+            # new component: start at the best unvisited vertex
+            if not frontier.any():
+                while visited[order[seed_ix]]:
+                    seed_ix += 1
+                frontier[order[seed_ix]] = True
+
+            visited |= frontier
+            current.append(np.where(frontier)[0])
+            if sum([len(i) for i in current]) >= min_wave:
+                waves.append(np.concatenate(current))
+                current = []
+
+            frontier = (adjacency @ frontier.astype(np.int8) > 0) & ~visited
+
+        if len(current) > 0:
+            waves.append(np.concatenate(current))
+
+        return waves
+
+    def neighbour_iterfit(self, fitter, bounds=None, **kwargs):
+        """neighbour_iterfit
+
+        Neighbour-seeded iterative fit. Vertices are fitted in breadth-first waves over the surface (see
+        :func:`fmriproc.prf.pRFmodelFitting.neighbour_waves`). Before each wave, every vertex gets the best starting point of
+        its own grid solution and the converged solutions of neighbours from earlier waves, in terms of r2 on its own
+        timecourse. On the cortical surface, neighbouring pRFs are very similar, so the optimizer starts closer to the optimum.
+        Seeding only replaces the starting position; the last column of the starting parameters keeps the grid r2, so the
+        `rsq_threshold` selects the same vertices as a regular iterative fit. The r2 of the seeds is stored in the `seed_rsq`
+        attribute of `fitter` (NaN for vertices that started from their grid solution).
+        """
+
+        data = fitter.data
+        start_params = fitter.gridsearch_params.copy()
+        grid_params = fitter.gridsearch_params
+        n_units = data.shape[0]
+        
+        # select adjacency of fitted vertices
+        adjacency = self.adjacency
+        if self.fit_idx is not None:
+            adjacency = adjacency[self.fit_idx][:,self.fit_idx]
+
+        adjacency = adjacency.tocsr()
+        if adjacency.shape[0] != n_units:
+            raise ValueError(f"Shape of adjacency ({adjacency.shape[0]}) does not match number of timecourses ({n_units})")
+
+        waves = self.neighbour_waves(adjacency, start_params[:,-1])
+        utils.verbose(f"Neighbour-seeded iterfit in {len(waves)} waves", self.verbose)
+
+        done = np.zeros(n_units, dtype=bool)
+        params = np.zeros_like(start_params)
+        seed_rsq = np.full(n_units, np.nan)
+        for ix,idx in enumerate(waves):
+
+            # candidate starting points: converged neighbours
+            rows,cols = adjacency[idx].nonzero()
+            keep = done[cols]
+            rows,cols = rows[keep], cols[keep]
+            if rows.shape[0] > 0:
+                cands = params[cols]
+                tc = data[idx[rows]]
+                pred = fitter.model.return_prediction(*cands[:,:-1].T)
+                rss = ((tc-pred)**2).sum(axis=-1)
+                tss = ((tc-tc.mean(axis=-1, keepdims=True))**2).sum(axis=-1)
+                r2 = np.nan_to_num(1-rss/tss, nan=-np.inf)
+
+                # best neighbour per vertex (last after sorting on vertex, then r2); only use it if it beats the own grid
+                srt = np.lexsort((r2, rows))
+                top = srt[np.r_[rows[srt][1:] != rows[srt][:-1], True]]
+                seed = r2[top] > grid_params[idx[rows[top]],-1]
+                top = top[seed]
+
+                # keep grid r2 in the last column; it gates the fit through rsq_threshold
+                start_params[idx[rows[top]],:-1] = cands[top,:-1]
+                seed_rsq[idx[rows[top]]] = r2[top]
+
+                utils.verbose(
+                    f" Wave {ix+1}/{len(waves)}: {idx.shape[0]} vertices, {top.shape[0]} seeded by neighbours",
+                    self.verbose
+                )
+
+            params[idx] = self.iterfit_subset(fitter, data, idx, start_params, bounds, **kwargs)
+            done[idx] = True
+
+        self.restore_fitter(fitter, data, start_params, params)
+        fitter.seed_rsq = seed_rsq
+
     def define_settings(self, old_settings=None):
 
         self.settings, self.prf_stim_ = generate_model_params(
@@ -2340,6 +3701,20 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
 
     def fit(self):
 
+        start = time.time()
+        self.run_fit()
+
+        # upper bound of the time the prefilter saved, assuming skipped timecourses would have taken equally long
+        if getattr(self, "n_prefiltered", 0) > 0:
+            elapsed = time.time()-start
+            saved = elapsed/self.data.shape[0]*self.n_prefiltered
+            utils.verbose(
+                f"Prefilter skipped {self.n_prefiltered} timecourses, saving up to an estimated {timedelta(seconds=round(saved))}",
+                self.verbose
+            )
+
+    def run_fit(self):
+
         # check whether we got old parameters so we can skip Gaussian fit:
         if isinstance(self.old_params, (np.ndarray,str)):
             
@@ -2349,6 +3724,10 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
             if self.old_params.ndim == 1:
                 self.old_params = self.old_params[np.newaxis,...]
 
+            # full-surface parameters from a previous (sparse) fit; select the vertices we're fitting
+            if self.fit_idx is not None and self.old_params.shape[0] == self.n_vertices:
+                self.old_params = self.old_params[self.fit_idx]
+
             # initiate Gaussian model
             GaussianModel.__init__(self)
 
@@ -2665,8 +4044,12 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
                     else:
                         mm = model
 
+                data = {}
                 if par_file.endswith('npy'):
                     params = np.load(par_file)
+                elif par_file.endswith('npz'):
+                    params = read_par_file(par_file)
+                    data['settings'] = read_par_meta(par_file).get("settings")
                 elif par_file.endswith('pkl'):
                     with open(par_file, 'rb') as input:
                         data = pickle.load(input)
@@ -2676,6 +4059,7 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
                         if el in list(data.keys()):
                             setattr(self, f'{mm}_{stage}_predictions', data['predictions'])
                 
+                if isinstance(data.get('settings'), dict):
                     if not skip_settings:
                         utils.verbose(f"Reading settings from '{par_file}' (safest option; overwrites other settings)",
                                       self.verbose)
@@ -2719,8 +4103,42 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
                 utils.verbose(f"Inserting parameters from {type(par_file)} as '{mm}_{stage}' in {self}", self.verbose)
                 setattr(self, f'{mm}_{stage}', params)
 
-    def make_predictions(self, vox_nr=None, model='gauss', stage='iter'):
-        
+    def make_predictions(
+        self,
+        vox_nr=None,
+        model='gauss',
+        stage='iter',
+        chunk_size=1000,
+        write_file=False):
+
+        """make_predictions
+
+        Create predictions given the parameters of `model` and `stage`. If `vox_nr` is specified, the prediction of that
+        single voxel/vertex is returned. Otherwise, all parameter rows are evaluated in one vectorized call to
+        `return_prediction` per chunk of `chunk_size` rows, rather than looping over voxels.
+
+        Parameters
+        ----------
+        vox_nr: int, str, optional
+            Voxel/vertex index or `best` for the voxel with the highest r2. Default = None (all voxels)
+        model: str, optional
+            Model from which the parameters came from, by default 'gauss'
+        stage: str, optional
+            Stage from which the parameters came from, by default 'iter'
+        chunk_size: int, optional
+            Number of parameter rows evaluated per call; bounds the memory needed for the receptive fields. Default = 1000
+        write_file: bool, optional
+            Write the predictions to `<output_base>_model-<model>_stage-<stage>_desc-predictions.npy` in `output_dir`. The
+            predictions are written directly into a memory-mapped array, so the full array is never kept in memory. Default
+            is False
+
+        Returns
+        ----------
+        numpy.ndarray
+            <voxels,time> array with predictions. If `vox_nr` is specified, a tuple of the prediction, parameters, and voxel
+            index is returned
+        """
+
         try:
             use_model = getattr(self, f"{model}_model")
         except:
@@ -2741,12 +4159,28 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
                 pred = use_model.return_prediction(*params[:-1]).T
                 return pred, params, vox
             else:
-                predictions = []
-                for vox in range(params.shape[0]):
-                    pars = params[vox,...]
-                    predictions.append(use_model.return_prediction(*pars[:-1]).T)
+                n_tps = use_model.stimulus.design_matrix.shape[-1]
+                if write_file:
+                    pred_file = opj(self.output_dir, f'{self.output_base}_model-{model}_stage-{stage}_desc-predictions.npy')
+                    utils.verbose(f"Writing {stage}-fit predictions to {pred_file}", self.verbose)
+                    predictions = np.lib.format.open_memmap(
+                        pred_file,
+                        mode="w+",
+                        dtype=self.dtype,
+                        shape=(params.shape[0], n_tps)
+                    )
+                else:
+                    predictions = np.zeros((params.shape[0], n_tps), dtype=self.dtype)
+
+                # prfpy models broadcast over parameter arrays, so we can feed chunks of voxels at once
+                for start in range(0, params.shape[0], chunk_size):
+                    pars = params[start:start+chunk_size,:-1]
+                    predictions[start:start+pars.shape[0]] = use_model.return_prediction(*pars.T)
                 
-                return np.squeeze(np.array(predictions), axis=-1)
+                if write_file:
+                    predictions.flush()
+
+                return predictions
 
         else:
             raise ValueError(f"Could not find {stage} parameters for {model}")
@@ -3105,86 +4539,500 @@ class pRFmodelFitting(GaussianModel, ExtendedModel):
             # set output stuff
             for flag,el in zip([output_base,output_dir],["output_base","output_dir"]):
                 if isinstance(flag, str):
-                    setattr(self, el)
+                    setattr(self, el, flag)
                 else:
                     if not hasattr(self, el):
                         raise ValueError(f"'{el}' is not set. Use the flags in 'save_params' or define in {self}")
 
-            # define pickle
-            pkl_file = opj(self.output_dir, f'{self.output_base}_model-{model}_stage-{stage}_desc-prf_params.pkl')
+            # define parameter store
+            par_file = opj(self.output_dir, f'{self.output_base}_model-{model}_stage-{stage}_desc-prf_params.npz')
 
-            # get parameters given model and stage
-            params = getattr(self, f"{model}_{stage}")
+            # get parameters given model and stage; scatter back to full size if we did a sparse fit
+            params = self.scatter_params(getattr(self, f"{model}_{stage}")).astype(self.dtype, copy=False)
 
-            # write a pickle-file with relevant outputs
-            out_dict = {}
-            out_dict['pars'] = params
-            out_dict['settings'] = self.settings
-            # out_dict['predictions'] = self.make_predictions(model=model, stage=stage)
+            # write parameter columns + settings
+            utils.verbose(f"Save {stage}-fit parameters in {par_file}", self.verbose)
+            write_par_file(
+                params,
+                par_file,
+                model=model,
+                stage=stage,
+                settings=self.settings
+            )
 
-            utils.verbose(f"Save {stage}-fit parameters in {pkl_file}", self.verbose)
-            with open(pkl_file, "wb") as f:
-                pickle.dump(out_dict, f)
+            # final parameters are safe, shards of interrupted batches are no longer needed
+            if stage == "iter":
+                self.remove_checkpoints(model=model)
 
         else:
             raise ValueError(f"{self} does not have attribute '{model}_{stage}'. Not saving parameters")
 
-def find_most_similar_prf(reference_prf, look_in_params, verbose=False, return_nr='all', r2_thresh=0.5):
+# designs and data memory-mapped by a worker process of FitSubjects; keyed by path so each file is opened once per worker
+_worker_arrays = {}
 
-    """find_most_similar_prf
+def _worker_array(fname):
+    """memory-map `fname` once per worker process"""
+    if fname not in _worker_arrays:
+        _worker_arrays[fname] = np.load(fname, mmap_mode="r")
+
+    return _worker_arrays[fname]
+
+def _init_prf_worker():
+    """limit each worker to a single thread, the pool already occupies all cores"""
+    try:
+        import mkl
+        mkl.set_num_threads(1)
+    except ImportError:
+        pass
+
+def _fit_prf_batch(data_file, idx, design_file, old_params=None, **kwargs):
+    """fit rows `idx` of the timecourses in `data_file` in a worker of :class:`fmriproc.prf.FitSubjects`"""
+
+    fitter = pRFmodelFitting(
+        np.asarray(_worker_array(data_file)[idx]),
+        design_matrix=_worker_array(design_file),
+        old_params=old_params,
+        write_files=False,
+        nr_jobs=1,
+        verbose=False,
+        **kwargs
+    )
+
+    fitter.fit()
+
+    output = {}
+    for model in np.unique(["gauss", fitter.model]):
+        for stage in ["grid", "iter"]:
+            if hasattr(fitter, f"{model}_{stage}"):
+                output[f"{model}_{stage}"] = getattr(fitter, f"{model}_{stage}")
+
+    return output
+
+class FitSubjects():
+
+    """FitSubjects
 
-    find a pRF with similar characteristics in one array given the specifications of another pRF
+    Fit pRFs of multiple subjects/sessions on one shared process pool. Rather than running one :class:`fmriproc.prf.pRFmodelFitting`
+    per subject (each with its own `nr_jobs`-pool, its own copy of the design, and its own grid), the timecourses of all
+    subjects are cut into batches of `batch_size` vertices that are pushed into a single pool of `n_jobs` single-threaded
+    workers. Each unique design matrix is read once and shared with the workers via a temporary `npy`-file, and the Gaussian
+    grid predictions are shared via :func:`fmriproc.prf.cache_grid_predictions`, so the per-batch fit only sets up the
+    models and reads the grid from the cache. The (masked) timecourses of each subject are written to a temporary `npy`-file
+    as well; the main process only keeps the mask and settings of each subject, and workers memory-map the rows of their
+    batch. Once all batches of a subject are done, its parameters are written with
+    :func:`fmriproc.prf.pRFmodelFitting.save_params`, so the output is identical to that of a regular fit. From the command
+    line, use `call_prfsubjects`.
 
     Parameters
     ----------
-    reference_prf: numpy.ndarray
-        pRF-parameters from the reference pRF, where `reference_prf[0]` = **x**, `reference_prf[1]` = **y**, and 
-        `reference_prf[2]` = **size**
-    look_in_params: numpy.ndarray
-        array of pRF-parameters in which we will be looking for `reference_prf`
+    subjects: list
+        List of dictionaries, one per subject/session. Each dictionary needs the keys `data` (<voxels,time> array or file),
+        `design_matrix` (array or file), `output_dir`, and `output_base`. Any other key is passed on to
+        :class:`fmriproc.prf.pRFmodelFitting` for that subject only (e.g., `mask`, `TR`, or `old_params`).
+    n_jobs: int, optional
+        Number of workers in the pool. Defaults to the number of CPUs on the machine
+    batch_size: int, optional
+        Number of vertices per batch. Default = 500
+    grid_cache: str, optional
+        Directory for the cached Gaussian grid predictions. If None, a temporary directory is used for the duration of the
+        fits
     verbose: bool, optional
-        Set to True if you want some messages along the way (default = False)
-    return_nr: str, int
-        same parameter as in :func:`lazyfmri.utils.find_nearest`, where we can specify how many matches we want to have
-        returned (default = "all") 
-    r2_thresh: float
-        after finding matching pRF, throw away fits below `r2_thresh`
+        Print progress and throughput (vertices/sec). Default = True
+    **kwargs: dict
+        Passed on to :class:`fmriproc.prf.pRFmodelFitting` for all subjects (e.g., `model`, `stage`, `constraints`)
 
-    Returns
+    Example
     ----------
-    numpy.ndarray
-        array containing the indices of `look_in_params` that conform the search
+
+    .. code-block:: python
+
+        from fmriproc import prf
+        subjects = [
+            {
+                "data": f"sub-{sub}_ses-1_task-2R_hemi-LR_desc-avg_bold.npy",
+                "design_matrix": "design_task-2R.mat",
+                "output_dir": f"derivatives/prf/sub-{sub}/ses-1",
+                "output_base": f"sub-{sub}_ses-1_task-2R",
+            } for sub in ["001", "002", "003"]
+        ]
+
+        fitter = prf.FitSubjects(subjects, model="norm", TR=1.5, transpose=True)
+        fitter.fit()
     """
 
-    x_par,_ = utils.find_nearest(look_in_params[...,0], reference_prf[0], return_nr='all')
+    def __init__(
+        self,
+        subjects,
+        n_jobs=None,
+        batch_size=500,
+        grid_cache=None,
+        verbose=True,
+        **kwargs):
+
+        self.subjects = subjects
+        self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.grid_cache = grid_cache
+        self.verbose = verbose
+        self.kwargs = kwargs
+
+        if not isinstance(self.n_jobs, int):
+            self.n_jobs = os.cpu_count()
 
-    utils.verbose(f"{x_par.shape} survived x-parameter matching", verbose)
+        if isinstance(self.subjects, dict):
+            self.subjects = [self.subjects]
 
-    y_par,_ = utils.find_nearest(look_in_params[x_par,1], reference_prf[1], return_nr='all')
-    xy_par = x_par[y_par]
+        for key in ["data", "design_matrix", "output_dir", "output_base"]:
+            for ix,subj in enumerate(self.subjects):
+                if key not in list(subj.keys()):
+                    raise ValueError(f"Subject {ix} is missing key '{key}'")
 
-    utils.verbose(f"{xy_par.shape} survived y-parameter matching", verbose)
+    def read_design(self, design_matrix):
+        """read each unique design matrix once and store it in the temporary directory for the workers"""
 
-    size_par,_ = utils.find_nearest(look_in_params[xy_par,2], reference_prf[2], return_nr='all')
-    xysize_par = xy_par[size_par]
+        if isinstance(design_matrix, str):
+            key = os.path.abspath(design_matrix)
+        else:
+            key = id(design_matrix)
 
-    utils.verbose(f"{xysize_par.shape} survived size-parameter matching", verbose)
+        if key not in self.designs:
+            if isinstance(design_matrix, str):
+                utils.verbose(f"Reading design matrix from '{design_matrix}'", self.verbose)
+                design_matrix = read_par_file(design_matrix)
 
-    # filter indices with r2
-    if r2_thresh is not None:
-        filt = look_in_params[xysize_par][...,-1] > r2_thresh
-        true_idc = np.where(filt)
-        xysize_par = xysize_par[true_idc]
+            design_file = opj(self.tmp_dir, f"design-{len(self.designs)}.npy")
+            np.save(design_file, design_matrix)
+            self.designs[key] = (design_matrix, design_file)
+
+        return self.designs[key]
+
+    def prepare_subjects(self):
+        """initialize a pRFmodelFitting object per subject and cut its (masked) timecourses into batches"""
+
+        self.fitters = []
+        self.batches = []
+        for ix,subj in enumerate(self.subjects):
+
+            kws = {**self.kwargs, **subj}
+            for key in ["data", "write_files", "verbose", "nr_jobs"]:
+                kws.pop(key, None)
+
+            design, design_file = self.read_design(kws.pop("design_matrix"))
+            
+            # the main process keeps track of the mask/settings/output; workers read their batch from `data_file`
+            fitter = pRFmodelFitting(
+                subj["data"],
+                design_matrix=design,
+                write_files=True,
+                verbose=False,
+                **kws
+            )
+
+            old_params = None
+            if isinstance(fitter.old_params, (np.ndarray,str)):
+                old_params = fitter.load_params(fitter.old_params, return_pars=True, skip_settings=fitter.skip_settings)
+                if old_params.ndim == 1:
+                    old_params = old_params[np.newaxis,...]
+
+                if fitter.fit_idx is not None and old_params.shape[0] == fitter.n_vertices:
+                    old_params = old_params[fitter.fit_idx]
+
+            # pass on the resolved settings rather than the per-subject input
+            worker_kws = {key: val for key,val in kws.items() if key not in ["mask", "min_variance", "min_stim_corr", "old_params", "batch_size", "adjacency", "transpose", "output_dir", "output_base", "grid_cache"]}
+            worker_kws["TR"] = fitter.TR
+            worker_kws["grid_cache"] = self.grid_cache
+
+            # design might have been trimmed to the data
+            if fitter.design_matrix.shape[-1] != design.shape[-1]:
+                design_file = opj(self.tmp_dir, f"design-{len(self.designs)}_sub-{ix}.npy")
+                np.save(design_file, fitter.design_matrix)
+                self.designs[design_file] = (fitter.design_matrix, design_file)
+
+            # hand the timecourses to the workers; don't keep all subjects' data in this process
+            data_file = opj(self.tmp_dir, f"data-{ix}.npy")
+            np.save(data_file, fitter.data)
+
+            fitter.n_units = fitter.data.shape[0]
+            fitter.data = None
+
+            n_units = fitter.n_units
+            for idx in np.array_split(np.arange(n_units), math.ceil(n_units/self.batch_size)):
+                self.batches.append({
+                    "subject": ix,
+                    "idx": idx,
+                    "data_file": data_file,
+                    "design_file": design_file,
+                    "old_params": None if old_params is None else old_params[idx],
+                    "kwargs": worker_kws
+                })
+
+            fitter.results = {}
+            fitter.n_done = 0
+            self.fitters.append(fitter)
+
+        self.n_total = sum([batch["idx"].shape[0] for batch in self.batches])
+        utils.verbose(
+            f"Prepared {len(self.batches)} batches ({self.n_total} vertices) for {len(self.fitters)} subject(s) on {self.n_jobs} workers",
+            self.verbose
+        )
+
+    def collect_batch(self, batch, output):
+        """insert the parameters of a finished batch; write the output files once a subject is complete"""
+
+        fitter = self.fitters[batch["subject"]]
+        for key,pars in output.items():
+            if key not in list(fitter.results.keys()):
+                fitter.results[key] = np.zeros((fitter.n_units, pars.shape[-1]))
+
+            fitter.results[key][batch["idx"]] = pars
 
-        utils.verbose(f"{xysize_par.shape} survived r2>{r2_thresh}", verbose)
+        fitter.n_done += batch["idx"].shape[0]
+        if fitter.n_done == fitter.n_units:
+            for key,pars in fitter.results.items():
+                setattr(fitter, key, pars)
+                model,stage = key.split("_")
+                if stage == "iter" or fitter.save_grid:
+                    fitter.save_params(model=model, stage=stage)
 
-    if len(xysize_par) == 0:
+            utils.verbose(f"Finished '{fitter.output_base}'", self.verbose)
+
+    def fit(self):
+
+        self.tmp_dir = tempfile.mkdtemp(prefix="fitsubjects_")
+        self.designs = {}
+
+        tmp_cache = not isinstance(self.grid_cache, str)
+        if tmp_cache:
+            self.grid_cache = opj(self.tmp_dir, "grid_cache")
+
+        try:
+            self.prepare_subjects()
+
+            # grid predictions are identical for subjects sharing a design, so let the first batch of each design fill the
+            # cache before the other workers start asking for it
+            start = time.time()
+            n_done = 0
+            seeds = {}
+            for batch in self.batches:
+                seeds.setdefault(batch["design_file"], batch)
+
+            with ProcessPoolExecutor(max_workers=self.n_jobs, initializer=_init_prf_worker) as pool:
+                
+                def submit(batch):
+                    return pool.submit(
+                        _fit_prf_batch,
+                        batch["data_file"],
+                        batch["idx"],
+                        batch["design_file"],
+                        old_params=batch["old_params"],
+                        **batch["kwargs"]
+                    )
+
+                queue = [batch for batch in self.batches if not any([batch is el for el in seeds.values()])]
+                running = {submit(batch): batch for batch in seeds.values()}
+                wait(list(running.keys()))
+
+                # keep the number of pending batches bounded so the pool doesn't hold all batches at once
+                while len(running) > 0:
+                    while len(queue) > 0 and len(running) < 2*self.n_jobs:
+                        batch = queue.pop(0)
+                        running[submit(batch)] = batch
+
+                    finished,_ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        batch = running.pop(future)
+                        self.collect_batch(batch, future.result())
+
+                        n_done += batch["idx"].shape[0]
+                        elapsed = time.time()-start
+                        utils.verbose(
+                            f" {n_done}/{self.n_total} vertices | {round(n_done/elapsed,2)} vertices/sec | elapsed: {timedelta(seconds=round(elapsed))}",
+                            self.verbose
+                        )
+        finally:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            if tmp_cache:
+                self.grid_cache = None
+
+class PRFIndex():
+
+    """PRFIndex
+
+    KD-tree (:class:`scipy.spatial.cKDTree`) over the (x, y, size) of a set of pRF-estimates, to find the pRFs that are most
+    similar to (many) reference pRFs at once. Dimensions can be weighted to make them comparable (e.g., to give size more
+    weight than position), and pRFs with r2 below `r2_thresh` are left out of the index. Use :func:`fmriproc.prf.prf_index` to
+    reuse an index built from the same parameter file.
+
+    Parameters
+    ----------
+    params: str, numpy.ndarray
+        pRF-estimates (anything readable by :func:`fmriproc.prf.read_par_file`), with x, y, and size in the first three
+        columns and r2 in the last column
+    weights: list, numpy.ndarray, optional
+        weights for x, y, and size, by default equal weights
+    r2_thresh: float, optional
+        only index pRFs with r2 > `r2_thresh`
+
+    Example
+    ----------
+    >>> from fmriproc import prf
+    >>> index = prf.PRFIndex("sub-01_ses-2_model-gauss_stage-iter_desc-prf_params.npz", r2_thresh=0.3)
+    >>> dist,idx = index.query(ref_pars, k=5)                 # 5 most similar pRFs for each row in `ref_pars`
+    >>> matches = index.query_radius(ref_pars, r=0.5)       # all pRFs within 0.5 (weighted) dva
+    """
+
+    def __init__(self, params, weights=None, r2_thresh=None):
+
+        self.params = read_par_file(params)
+        if self.params.ndim == 1:
+            self.params = self.params[np.newaxis,:]
+
+        self.weights = np.ones(3) if weights is None else np.asarray(weights, dtype=float)
+        self.r2_thresh = r2_thresh
+
+        if r2_thresh is not None:
+            self.idx = np.flatnonzero(self.params[:,-1] > r2_thresh)
+        else:
+            self.idx = np.arange(self.params.shape[0])
+
+        self.tree = spatial.cKDTree(self.params[self.idx,:3]*self.weights)
+
+    def _points(self, reference_prfs):
+        return np.atleast_2d(np.asarray(reference_prfs, dtype=float))[:,:3]*self.weights
+
+    def query(self, reference_prfs, k=1, n_jobs=1):
+        """`k` most similar pRFs for each reference pRF; returns distances and indices in `params`, both `(n_refs,k)`.
+        If fewer than `k` pRFs are indexed, missing neighbours have distance `inf` and index -1."""
+
+        dist,ix = self.tree.query(self._points(reference_prfs), k=k, workers=n_jobs)
+        dist,ix = dist.reshape(-1,k),ix.reshape(-1,k)
+
+        valid = ix < self.idx.shape[0]
+        idx = np.full(ix.shape, -1)
+        idx[valid] = self.idx[ix[valid]]
+
+        return dist,idx
+
+    def query_radius(self, reference_prfs, r, n_jobs=1):
+        """all pRFs within (weighted) distance `r` of each reference pRF, sorted by distance; returns a list of indices in
+        `params` per reference pRF"""
+
+        points = self._points(reference_prfs)
+        matches = self.tree.query_ball_point(points, r, workers=n_jobs)
+
+        sorted_matches = []
+        for pt,ix in zip(points,matches):
+            ix = np.asarray(ix, dtype=int)
+            dist = np.linalg.norm(self.tree.data[ix]-pt, axis=-1)
+            sorted_matches.append(self.idx[ix[np.argsort(dist)]])
+
+        return sorted_matches
+
+    def rank(self, reference_prfs):
+        """all indexed pRFs sorted by (weighted) distance to each reference pRF; returns a `(n_refs,n_indexed)`-array of
+        indices in `params`. Distances are computed one reference pRF at a time, which is cheaper than a `query` with `k` set
+        to the size of the index"""
+
+        points = self._points(reference_prfs)
+        ranked = np.empty((points.shape[0],self.idx.shape[0]), dtype=int)
+        for ix,pt in enumerate(points):
+            dist = np.linalg.norm(self.tree.data-pt, axis=-1)
+            ranked[ix] = self.idx[np.argsort(dist, kind="stable")]
+
+        return ranked
+
+# PRFIndex-objects built from parameter files; see prf_index
+_prf_indices = {}
+
+def prf_index(params, weights=None, r2_thresh=None):
+    """prf_index
+
+    Return a :class:`fmriproc.prf.PRFIndex` for `params`. If `params` is a file, the index is kept for the lifetime of the
+    process (keyed on path, modification time, `weights`, and `r2_thresh`), so matching many targets against the same session
+    only builds the tree once.
+    """
+
+    if not isinstance(params, str):
+        return PRFIndex(params, weights=weights, r2_thresh=r2_thresh)
+
+    params = os.path.abspath(params)
+    key = (
+        params, 
+        os.path.getmtime(params), 
+        None if weights is None else tuple(np.asarray(weights, dtype=float)),
+        r2_thresh
+    )
+
+    if key not in _prf_indices:
+        _prf_indices[key] = PRFIndex(params, weights=weights, r2_thresh=r2_thresh)
+
+    return _prf_indices[key]
+
+def find_most_similar_prf(
+    reference_prf, 
+    look_in_params, 
+    verbose=False, 
+    return_nr='all', 
+    r2_thresh=0.5, 
+    weights=None, 
+    radius=None,
+    n_jobs=1):
+
+    """find_most_similar_prf
+
+    find pRFs with similar characteristics in one array given the specifications of other pRF(s). pRFs are ranked by their
+    (weighted) euclidean distance in (x, y, size) with :class:`fmriproc.prf.PRFIndex`; if `look_in_params` is a file, the
+    index is reused across calls (see :func:`fmriproc.prf.prf_index`).
+
+    Parameters
+    ----------
+    reference_prf: numpy.ndarray
+        pRF-parameters from the reference pRF, where `reference_prf[0]` = **x**, `reference_prf[1]` = **y**, and 
+        `reference_prf[2]` = **size**. Can also be a `(n_refs,n_params)`-array to search for multiple pRFs in one call
+    look_in_params: numpy.ndarray, str
+        array (or file) of pRF-parameters in which we will be looking for `reference_prf`
+    verbose: bool, optional
+        Set to True if you want some messages along the way (default = False)
+    return_nr: str, int
+        how many matches we want to have returned (default = "all") 
+    r2_thresh: float
+        only consider pRFs with r2 > `r2_thresh`
+    weights: list, numpy.ndarray, optional
+        weights for x, y, and size in the distance, by default equal weights
+    radius: float, optional
+        return all pRFs within this (weighted) distance instead of a fixed number of matches
+    n_jobs: int, optional
+        number of workers for the queries
+
+    Returns
+    ----------
+    numpy.ndarray, list
+        indices of `look_in_params` sorted by similarity. For a 1D `reference_prf`, a 1D array. For multiple reference pRFs,
+        a `(n_refs,return_nr)`-array (missing matches are -1), or a list of arrays if `radius` is specified. With
+        `return_nr="all"`, this array holds every pRF surviving `r2_thresh` for each reference pRF, so specify `return_nr` or
+        `radius` when matching many reference pRFs against a large set
+    """
+
+    index = prf_index(look_in_params, weights=weights, r2_thresh=r2_thresh)
+    utils.verbose(f"{index.idx.shape[0]} pRFs survived r2>{r2_thresh}", verbose)
+
+    if index.idx.shape[0] == 0:
         raise ValueError(f"Could not find similar pRFs. Maybe lower r2-threshold?")
         
+    single = np.asarray(reference_prf).ndim == 1
+    if radius is not None:
+        matches = index.query_radius(reference_prf, radius, n_jobs=n_jobs)
+        if return_nr != "all":
+            matches = [ii[:return_nr] for ii in matches]
+
+        return matches[0] if single else matches
+
     if return_nr == "all":
-        return xysize_par
+        matches = index.rank(reference_prf)
     else:
-        return xysize_par[:return_nr]
+        _,matches = index.query(reference_prf, k=min(return_nr, index.idx.shape[0]), n_jobs=n_jobs)
+
+    return matches[0] if single else matches
 
 
 class SizeResponse():
@@ -3388,7 +5236,10 @@ class SizeResponse():
         params, 
         stims=None,
         center_prf=True,
-        normalize=False):
+        normalize=False,
+        radii=None,
+        chunk_size=None,
+        n_jobs=1):
 
         if not isinstance(params, (pd.DataFrame,pd.Series)):
             params = Parameters(params, model="norm").to_df()
@@ -3406,7 +5257,7 @@ class SizeResponse():
         if mu_y.ndim == 0:
             mu_y = mu_y[...,np.newaxis]            
 
-        sr = norm_2d_sr_function(
+        sr_args = [
             self.dx**2*params.A.values, 
             params.B.values, 
             self.dx**2*params.C.values, 
@@ -3414,10 +5265,27 @@ class SizeResponse():
             params.prf_size.values, 
             params.surr_size.values, 
             self.x, 
-            self.y, 
-            stims, 
-            mu_x=mu_x, 
-            mu_y=mu_y)
+            self.y
+        ]
+
+        if radii is not None:
+            # stimuli of type `stims` ('fill'/'hole') centered on each pRF
+            sr = norm_2d_sr_function_local(
+                *sr_args,
+                radii,
+                mu_x=mu_x, 
+                mu_y=mu_y,
+                dt=stims,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs)
+        else:
+            sr = norm_2d_sr_function(
+                *sr_args,
+                stims, 
+                mu_x=mu_x, 
+                mu_y=mu_y,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs)
 
         if normalize:
             sr /= sr.max()
@@ -3431,14 +5299,18 @@ class SizeResponse():
         normalize=None, 
         stims=None,
         sizes=None,
-        batch_size=100,
+        batch_size=None,
         parallel=True,
         thresh=0,
         max_jobs=20
         ):
 
         """create Size-Response function. If you want to ignore the actual location of the pRF, set `center_prf=True`. You can
-        also scale the pRF-size with a factor `scale_factor`, for instance if you want to simulate pRF-sizes across depth."""
+        also scale the pRF-size with a factor `scale_factor`, for instance if you want to simulate pRF-sizes across depth. With
+        `center_prf=True`, all pRFs are evaluated on the same stimuli in chunks of `batch_size` vertices (by default sized to
+        ~128MB, see :func:`fmriproc.prf.norm_2d_sr_function`), spread over `max_jobs` threads if `parallel=True`. With
+        `normalize="max"`, centered SR-functions are scaled by their maximum per stimulus if there are more vertices than
+        `batch_size` (100 if None), and by their global maximum otherwise."""
         
         if not isinstance(params, np.ndarray):
             params = Parameters(params, model="norm").to_df()
@@ -3453,75 +5325,52 @@ class SizeResponse():
         # filter out zeros
         df_filtered = params.loc[params.index[idc_valid]]
                 
-        # use batches
-        if df_filtered.shape[0] > batch_size and center_prf:
-            
-            n_batches = int(np.ceil(df_filtered.shape[0]/batch_size))
-            if parallel:
-                if n_batches > max_jobs:
-                    n_batches = max_jobs
-                    batch_size = int(np.ceil(df_filtered.shape[0]/n_batches))
-
-            utils.verbose(f"Split data in {n_batches} batches of {batch_size} vertices", self.verbose)
-
-            # parse dataframe into list of batch dataframes for parallellization
-            act = 0
-            df_batches = []
-            for batch in range(n_batches):
-                interval = (batch*batch_size)+batch_size
-
-                try:
-                    df_batch = df_filtered.iloc[act:interval,:]
-                except:
-                    df_batch = df_filtered.iloc[act:,:]
-
-                df_batches.append(df_batch)
-                act += batch_size
-
-            # loop through dfs
-            if parallel:
-                utils.verbose("Running parallel jobs", self.verbose)
-                dd = Parallel(n_jobs=n_batches,verbose=True)(
-                delayed(self.make_sr_function)(
-                    batch, 
-                    stims=stims,
-                    center_prf=center_prf)
-                    for batch in df_batches
-                )
-            else:
-                utils.verbose("Running serial jobs", self.verbose)
+        if center_prf:
+            # use same stimulus sequence for all pRFs
+            n_jobs = max_jobs if parallel else 1
+            utils.verbose(f"Running {n_jobs} job(s) over {df_filtered.shape[0]} vertices", self.verbose)
 
-                # use same stimulus sequence for all pRFs
-                dd = []
-                for ix,batch in enumerate(df_batches):
-                    start = time.time()
-                    tmp = self.make_sr_function(batch, stims=stims)
-                    elapsed = (time.time() - start)
-                    utils.verbose(f"batch #{ix}: {tmp.shape} | process took {timedelta(seconds=elapsed)}", self.verbose)
-                    dd.append(tmp)
+            start = time.time()
+            func = self.make_sr_function(
+                df_filtered,
+                stims=stims,
+                center_prf=True,
+                chunk_size=batch_size,
+                n_jobs=n_jobs)
 
-            # concatenate into single array
-            func = np.concatenate(dd)
+            elapsed = (time.time() - start)
+            utils.verbose(f"SR-functions: {func.shape} | process took {timedelta(seconds=elapsed)}", self.verbose)
 
             if normalize == "max":
-                func /= func.max(axis=0)
+                # inputs that used to fit in a single batch (100 vertices by default) are scaled by their global maximum
+                if df_filtered.shape[0] > (100 if batch_size is None else batch_size):
+                    func /= func.max(axis=0)
+                else:
+                    func /= func.max()
 
             n_stims = stims.shape[-1]
         else:
-            # make single SR function
-            if center_prf:
+            if stims in ["fill","hole"]:
+                # one canonical set of disks; the stimuli move along with each pRF
+                _,sizes = self.make_stimuli(factor=1, dt="fill")
+                utils.verbose(f"Creating unique stimulus (type='{stims}') set for each pRF from {len(sizes)} centered stimuli", self.verbose)
+
+                start = time.time()
                 func = self.make_sr_function(
                     df_filtered,
                     stims=stims,
-                    center_prf=True)
-
-                n_stims = stims.shape[-1]
-
+                    center_prf=False,
+                    radii=np.asarray(sizes)/2,
+                    chunk_size=batch_size,
+                    n_jobs=max_jobs if parallel else 1)
+
+                elapsed = (time.time() - start)
+                utils.verbose(f"SR-functions: {func.shape} | process took {timedelta(seconds=elapsed)}", self.verbose)
+                n_stims = func.shape[-1]
             else:
                 # custom stimuli for each pRF
                 func = []
                 utils.verbose(f"Creating unique stimulus (type='{stims}') set for each pRF", self.verbose)
-                collect_stims = []
                 for rf_ix in range(df_filtered.shape[0]):
                     
                     # get parameters
@@ -3533,7 +5382,6 @@ class SizeResponse():
                         dt=stims, 
                         loc=(rf.x.values[0],rf.y.values[0]))
 
-                    collect_stims.append(rf_stims)
                     n_stims = rf_stims.shape[-1]
 
                     # get srf
@@ -3544,7 +5392,6 @@ class SizeResponse():
                     
                     func.append(dd)
 
-                stims = rf_stims.copy()
                 sizes = rf_sizes.copy()
                 func = np.concatenate(func)
 
@@ -3894,7 +5741,7 @@ class CollectSubject(pRFmodelFitting):
 
         # try to read iterative fit parameters
         allowed_models = ['gauss', 'css', 'dog', 'norm', 'abc', 'abd']
-        look_for = ["stage-iter", "params.pkl"]
+        look_for = ["stage-iter"]
         
         # add some filters
         if self.v1_data:
@@ -3908,10 +5755,9 @@ class CollectSubject(pRFmodelFitting):
 
         utils.verbose(f"Reading full-cortex pRF estimates with {look_for}", self.verbose)
         for model in allowed_models:
-            par_file = utils.get_file_from_substring(
+            par_file = find_par_file(
                 look_for+[f"model-{model}"],
                 self.prf_dir,
-                return_msg=None,
                 exclude=exclude
             )
             if isinstance(par_file, str):
@@ -4033,6 +5879,30 @@ def baseline_from_dm(dm, n_trs=7):
 
 class Parameters():
 
+    """Parameters
+
+    Columnar view on pRF-estimates of a given model. Parameters from the fit (x, y, prf_size, ...) are served as views on the
+    columns of the underlying array, and derived measures (ecc, polar, ratios, suppression index) are computed on first access
+    and stored, so repeated access is free. Individual columns can be accessed with `Parameters(...)["ecc"]`; use
+    :func:`fmriproc.prf.Parameters.to_df` to collect (a selection of) columns in a dataframe. If `params` is a parameter store
+    (see :func:`fmriproc.prf.write_par_file`), only the columns that are accessed are read from disk.
+
+    Parameters
+    ----------
+    params: numpy.ndarray, str, pandas.DataFrame
+        pRF-estimates; `(n_vertices,n_params)`-array, file readable by :func:`fmriproc.prf.read_par_file`, or dataframe (for
+        :func:`fmriproc.prf.Parameters.to_array`)
+    model: str, optional
+        model the estimates came from, by default 'gauss'
+
+    Example
+    ----------
+    >>> from fmriproc import prf
+    >>> pars = prf.Parameters("sub-01_model-norm_stage-iter_desc-prf_params.npz", model="norm")
+    >>> pars["ecc"]                             # computed once, then reused
+    >>> pars.to_df(columns=["x","y","r2"])      # only these columns are materialized
+    """
+
     def __init__(
         self,
         params,
@@ -4041,106 +5911,160 @@ class Parameters():
         self.params = params
         self.model = model
         self.allow_models = ["gauss","dog","css","norm",'abc','abd']
+        self.par_file = None
+        self._cache = {}
 
         if isinstance(self.params, str):
-            self.params = read_par_file(self.params)
-            
-    def to_df(self):
-        
-        if isinstance(self.params, pd.DataFrame):
-            return self.params
-        
-        if not isinstance(self.params, np.ndarray):
-            raise ValueError(f"Input must be np.ndarray, not '{type(self.params)}'")
+            if self.params.endswith("npz"):
+                # parameter store; columns are read when they are accessed
+                self.par_file = self.params
+                self.store_columns = read_par_meta(self.par_file)["columns"]
+            else:
+                self.params = read_par_file(self.params)
 
-        if self.params.ndim == 1:
+        if isinstance(self.params, np.ndarray) and self.params.ndim == 1:
             self.params = self.params[np.newaxis,:]
 
+    @property
+    def n_params(self):
+        if self.par_file is not None:
+            return len(self.store_columns)
+
+        return self.params.shape[-1]
+
+    def _column(self, ix):
+        """column `ix` of the estimates; a view on the array or a memory-mapped column of the parameter store"""
+        if self.par_file is not None:
+            return read_par_store(self.par_file, columns=self.store_columns[ix])
+
+        return self.params[:,ix]
+
+    def _spec(self):
+        """column names mapped to their index in the estimates (int) or to a function of other columns (derived)"""
+
         # see: https://github.com/VU-Cog-Sci/prfpy_tools/blob/master/utils/postproc_utils.py#L377
-        if self.model in self.allow_models:
-            if self.model == "gauss":
-                params_dict = {
-                    "x": self.params[:,0], 
-                    "y": self.params[:,1], 
-                    "prf_size": self.params[:,2],
-                    "prf_ampl": self.params[:,3],
-                    "bold_bsl": self.params[:,4],
-                    "r2": self.params[:,-1],
-                    "ecc": np.sqrt(self.params[:,0]**2+self.params[:,1]**2),
-                    "polar": np.angle(self.params[:,0]+self.params[:,1]*1j)
-                }
+        c = self._column
+        ecc = lambda: np.sqrt(c(0)**2+c(1)**2)
+        polar = lambda: np.angle(c(0)+c(1)*1j)
+        size_ratio = lambda: c(6)/c(2)
+        suppression = lambda: (c(5)*c(6)**2)/(c(3)*c(2)**2)
 
-                if self.params.shape[-1] > 6:
-                    params_dict["hrf_deriv"] = self.params[:,-3]
-                    params_dict["hrf_disp"] = self.params[:,-2]
+        n_params = self.n_params
+        if self.model == "gauss":
+            spec = {
+                "x": 0, 
+                "y": 1, 
+                "prf_size": 2,
+                "prf_ampl": 3,
+                "bold_bsl": 4,
+                "r2": -1,
+                "ecc": ecc,
+                "polar": polar
+            }
+            hrf = ["hrf_deriv","hrf_disp"] if n_params > 6 else []
 
-            elif self.model in ["norm","abc","abd"]:
-                    
-                params_dict = {
-                    "x": self.params[:,0], 
-                    "y": self.params[:,1], 
-                    "prf_size": self.params[:,2],
-                    "prf_ampl": self.params[:,3],
-                    "bold_bsl": self.params[:,4],
-                    "surr_ampl": self.params[:,5],
-                    "surr_size": self.params[:,6], 
-                    "neur_bsl": self.params[:,7],
-                    "surr_bsl": self.params[:,8],
-                    "A": self.params[:,3], 
-                    "B": self.params[:,7], #/params[:,3], 
-                    "C": self.params[:,5], 
-                    "D": self.params[:,8],
-                    "ratio (B/D)": self.params[:,7]/self.params[:,8],
-                    "r2": self.params[:,-1],
-                    "size ratio": self.params[:,6]/self.params[:,2],
-                    "suppression index": (self.params[:,5]*self.params[:,6]**2)/(self.params[:,3]*self.params[:,2]**2),
-                    "ecc": np.sqrt(self.params[:,0]**2+self.params[:,1]**2),
-                    "polar": np.angle(self.params[:,0]+self.params[:,1]*1j)}
-
-                if self.params.shape[-1] > 10:
-                    params_dict["hrf_deriv"] = self.params[:,-3]
-                    params_dict["hrf_dsip"] = self.params[:,-2]
-
-            elif self.model == "dog":
-                params_dict = {
-                    "x": self.params[:,0], 
-                    "y": self.params[:,1], 
-                    "prf_size": self.params[:,2],
-                    "prf_ampl": self.params[:,3],
-                    "bold_bsl": self.params[:,4],
-                    "surr_ampl": self.params[:,5],
-                    "surr_size": self.params[:,6], 
-                    "r2": self.params[:,-1],
-                    "size ratio": self.params[:,6]/self.params[:,2],
-                    "suppression index": (self.params[:,5]*self.params[:,6]**2)/(self.params[:,3]*self.params[:,2]**2),
-                    "ecc": np.sqrt(self.params[:,0]**2+self.params[:,1]**2),
-                    "polar": np.angle(self.params[:,0]+self.params[:,1]*1j)}
+        elif self.model in ["norm","abc","abd"]:
+            spec = {
+                "x": 0, 
+                "y": 1, 
+                "prf_size": 2,
+                "prf_ampl": 3,
+                "bold_bsl": 4,
+                "surr_ampl": 5,
+                "surr_size": 6, 
+                "neur_bsl": 7,
+                "surr_bsl": 8,
+                "A": 3, 
+                "B": 7, #/params[:,3], 
+                "C": 5, 
+                "D": 8,
+                "ratio (B/D)": lambda: c(7)/c(8),
+                "r2": -1,
+                "size ratio": size_ratio,
+                "suppression index": suppression,
+                "ecc": ecc,
+                "polar": polar
+            }
+            hrf = ["hrf_deriv","hrf_dsip"] if n_params > 10 else []
 
-                
-                if self.params.shape[-1] > 8:
-                    params_dict["hrf_deriv"] = self.params[:,-3]
-                    params_dict["hrf_dsip"] = self.params[:,-2]
-
-            elif self.model == "css":
-                params_dict = {
-                    "x": self.params[:,0], 
-                    "y": self.params[:,1], 
-                    "prf_size": self.params[:,2],
-                    "prf_ampl": self.params[:,3],
-                    "bold_bsl": self.params[:,4],
-                    "css_exp": self.params[:,5],
-                    "r2": self.params[:,-1],
-                    "ecc": np.sqrt(self.params[:,0]**2+self.params[:,1]**2),
-                    "polar": np.angle(self.params[:,0]+self.params[:,1]*1j)}     
-                
-                if self.params.shape[-1] > 7:
-                    params_dict["hrf_deriv"] = self.params[:,-3]
-                    params_dict["hrf_dsip"] = self.params[:,-2]
+        elif self.model == "dog":
+            spec = {
+                "x": 0, 
+                "y": 1, 
+                "prf_size": 2,
+                "prf_ampl": 3,
+                "bold_bsl": 4,
+                "surr_ampl": 5,
+                "surr_size": 6, 
+                "r2": -1,
+                "size ratio": size_ratio,
+                "suppression index": suppression,
+                "ecc": ecc,
+                "polar": polar
+            }
+            hrf = ["hrf_deriv","hrf_dsip"] if n_params > 8 else []
+
+        elif self.model == "css":
+            spec = {
+                "x": 0, 
+                "y": 1, 
+                "prf_size": 2,
+                "prf_ampl": 3,
+                "bold_bsl": 4,
+                "css_exp": 5,
+                "r2": -1,
+                "ecc": ecc,
+                "polar": polar
+            }
+            hrf = ["hrf_deriv","hrf_dsip"] if n_params > 7 else []
 
         else:
             raise ValueError(f"Model must be one of {self.allow_models}. Not '{self.model}'")
 
-        return pd.DataFrame(params_dict)
+        for ix,name in zip([-3,-2],hrf):
+            spec[name] = ix
+
+        return spec
+
+    def _check(self):
+        if self.par_file is None and not isinstance(self.params, np.ndarray):
+            raise ValueError(f"Input must be np.ndarray, not '{type(self.params)}'")
+
+    @property
+    def columns(self):
+        """column names in the order of :func:`fmriproc.prf.Parameters.to_df`"""
+        self._check()
+        return list(self._spec().keys())
+
+    def __getitem__(self, name):
+        self._check()
+        if name in self._cache:
+            return self._cache[name]
+
+        spec = self._spec()
+        if name not in spec:
+            raise KeyError(f"Unknown column '{name}' for model '{self.model}'; available: {list(spec.keys())}")
+
+        src = spec[name]
+        if isinstance(src, int):
+            return self._column(src)
+
+        self._cache[name] = src()
+        return self._cache[name]
+
+    def to_df(self, columns=None):
+        """collect `columns` (by default all columns of the model) in a dataframe; columns that are not requested are not
+        computed"""
+        
+        if isinstance(self.params, pd.DataFrame):
+            return self.params if columns is None else self.params[columns]
+        
+        if columns is None:
+            columns = self.columns
+        elif isinstance(columns, str):
+            columns = [columns]
+
+        return pd.DataFrame({ii: self[ii] for ii in columns})
 
     def to_array(self):
         
@@ -4171,42 +6095,164 @@ class Parameters():
             
         return np.concatenate(self.parr,axis=1)
 
+# flattened coordinate grids per stimulus object; see _rf_grid
+_rf_grids = weakref.WeakKeyDictionary()
+
+def _rf_grid(stim):
+    """x/y-coordinates of `stim` in the orientation of rendered RFs (i.e., after `np.rot90(rf.T)`), computed once per stimulus"""
+    try:
+        return _rf_grids[stim]
+    except (KeyError,TypeError):
+        grid = (
+            np.ascontiguousarray(np.rot90(stim.x_coordinates.T)).ravel(),
+            np.ascontiguousarray(np.rot90(stim.y_coordinates.T)).ravel(),
+            np.rot90(stim.x_coordinates.T).shape
+        )
+
+        try:
+            _rf_grids[stim] = grid
+        except TypeError:
+            pass
+
+        return grid
+
+def render_prfs(params, stim, model="gauss", chunk_size=1000, normalize_RFs=False):
+    """render_prfs
+
+    Render receptive fields for many vertices in chunks. The coordinate grids of `stim` are computed once and each chunk is
+    evaluated as one vectorized expression, following the model definitions in :func:`fmriproc.prf.create_model_rf_wrapper`.
+
+    Parameters
+    ----------
+    params: numpy.ndarray
+        `(n_vertices,n_params)`-array of pRF-estimates from `model`
+    stim: prfpy.stimulus.PRFStimulus2D
+        stimulus object defining the visual field
+    model: str, optional
+        one of 'gauss', 'css', 'dog', 'norm', 'abc', 'abd'; by default 'gauss'
+    chunk_size: int, optional
+        number of vertices per chunk, by default 1000
+    normalize_RFs: bool, optional
+        normalize the Gaussians to unit volume (see :func:`prfpy.rf.gauss2D_iso_cart`)
+
+    Yields
+    ----------
+    slice, numpy.ndarray
+        the vertices of the chunk and their `(n_chunk,n_pix,n_pix)` receptive fields
+
+    Example
+    ----------
+    >>> from fmriproc import prf
+    >>> for sl,rfs in prf.render_prfs(pars, fitter.prf_stim, model="norm"):
+    >>>     overlap[sl] = (rfs*mask).sum(axis=(1,2))
+    """
+
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    xx,yy,shape = _rf_grid(stim)
+
+    def gauss(p, sigma):
+        rfs = np.exp(-((xx-p[:,0,np.newaxis])**2+(yy-p[:,1,np.newaxis])**2)/(2*sigma[:,np.newaxis]**2))
+        if normalize_RFs:
+            rfs /= 2*np.pi*sigma[:,np.newaxis]**2
+
+        return rfs
+
+    for start in range(0,params.shape[0],chunk_size):
+        sl = slice(start, min(start+chunk_size,params.shape[0]))
+        p = params[sl]
+
+        prf = p[:,3,np.newaxis]*gauss(p, p[:,2])
+        if model == 'css':
+            prf **= p[:,5,np.newaxis]
+
+        elif model == 'dog':
+            prf -= p[:,5,np.newaxis]*gauss(p, p[:,6])
+
+        elif model in ["norm","abc","abd"]:
+            prf += p[:,7,np.newaxis]
+            prf /= p[:,5,np.newaxis]*gauss(p, p[:,6]) + p[:,8,np.newaxis]
+            prf -= (p[:,7]/p[:,8])[:,np.newaxis]
+
+        yield sl, prf.reshape((-1,)+shape)
+
 def create_model_rf_wrapper(model,stim,params,normalize_RFs=False):
-    prf = params[3][...,np.newaxis,np.newaxis]*np.rot90(
-        rf.gauss2D_iso_cart(
-            x=stim.x_coordinates[...,np.newaxis],
-            y=stim.y_coordinates[...,np.newaxis],
-            mu=(params[0], params[1]),
-            sigma=params[2],
-            normalize_RFs=normalize_RFs).T, axes=(1,2))
-
-    if model == 'css':
-        prf **= params[5][...,np.newaxis,np.newaxis]
-
-    elif model == 'dog':
-        prf -= params[5][...,np.newaxis,np.newaxis]*np.rot90(
-            rf.gauss2D_iso_cart(
-                x=stim.x_coordinates[...,np.newaxis],
-                y=stim.y_coordinates[...,np.newaxis],
-                mu=(params[0], params[1]),
-                sigma=params[6],
-                normalize_RFs=normalize_RFs).T, axes=(1,2))
-
-    elif model in ["norm","abc","abd"]:
-        prf += params[7][...,np.newaxis,np.newaxis]
-        prf /= (params[5][...,np.newaxis,np.newaxis]*np.rot90(
-            rf.gauss2D_iso_cart(
-                x=stim.x_coordinates[...,np.newaxis],
-                y=stim.y_coordinates[...,np.newaxis],
-                mu=(params[0], params[1]),
-                sigma=params[6],
-                normalize_RFs=normalize_RFs).T, 
-            axes=(1,2)) + params[8][...,np.newaxis,np.newaxis])
-
-        prf -= (params[7]/params[8])[...,np.newaxis,np.newaxis]
+    """render the receptive field(s) of `params` (indexed as `params[<parameter>]`, either scalars or arrays over vertices) as
+    `(n_vertices,n_pix,n_pix)`-array; see :func:`fmriproc.prf.render_prfs`"""
 
+    params = np.asarray(params, dtype=float)
+    if params.ndim == 1:
+        params = params[:,np.newaxis]
+
+    _,prf = next(render_prfs(params.T, stim, model=model, chunk_size=max(1,params.shape[-1]), normalize_RFs=normalize_RFs))
     return prf
 
+def prf_coverage(
+    params, 
+    stim, 
+    model="gauss", 
+    reduction="max", 
+    r2_thresh=None, 
+    normalize=True, 
+    chunk_size=1000, 
+    normalize_RFs=False):
+
+    """prf_coverage
+
+    Visual field coverage of a set of pRFs, computed as streaming reduction over chunks from
+    :func:`fmriproc.prf.render_prfs`, so the `(n_vertices,n_pix,n_pix)`-stack is never held in memory.
+
+    Parameters
+    ----------
+    params: numpy.ndarray, str
+        `(n_vertices,n_params)`-array of pRF-estimates (or file readable by :func:`fmriproc.prf.read_par_file`)
+    stim: prfpy.stimulus.PRFStimulus2D
+        stimulus object defining the visual field
+    model: str, optional
+        model of `params`, by default 'gauss'
+    reduction: str, optional
+        how to combine the receptive fields: 'max' (default), 'sum', or 'mean'
+    r2_thresh: float, optional
+        only include pRFs with r2 > `r2_thresh`
+    normalize: bool, optional
+        scale each receptive field to a peak of 1 before combining (default = True)
+    chunk_size: int, optional
+        number of vertices rendered at once, by default 1000
+
+    Returns
+    ----------
+    numpy.ndarray
+        `(n_pix,n_pix)` coverage map
+    """
+
+    params = read_par_file(params) if isinstance(params, str) else np.atleast_2d(params)
+    if r2_thresh is not None:
+        params = params[params[:,-1] > r2_thresh]
+
+    if reduction not in ["max","sum","mean"]:
+        raise ValueError(f"reduction must be one of 'max', 'sum', or 'mean'; not '{reduction}'")
+
+    coverage = None
+    for _,rfs in render_prfs(params, stim, model=model, chunk_size=chunk_size, normalize_RFs=normalize_RFs):
+        if normalize:
+            peak = np.abs(rfs).max(axis=(1,2), keepdims=True)
+            rfs /= np.where(peak > 0, peak, 1)
+
+        chunk = rfs.max(axis=0) if reduction == "max" else rfs.sum(axis=0)
+        if coverage is None:
+            coverage = chunk
+        elif reduction == "max":
+            np.maximum(coverage, chunk, out=coverage)
+        else:
+            coverage += chunk
+
+    if coverage is None:
+        raise ValueError("No pRFs to compute coverage from. Maybe lower r2-threshold?")
+
+    if reduction == "mean":
+        coverage /= params.shape[0]
+
+    return coverage
+
 class FormatTimeCourses():
 
     def __init__(
@@ -4225,6 +6271,10 @@ class FormatTimeCourses():
         )
     
     def return_data(self):
+        # don't copy memory-mapped output into memory
+        if isinstance(self.formatted_data, np.memmap):
+            return self.formatted_data
+
         return self.formatted_data.copy()
     
     @classmethod
@@ -4270,35 +6320,28 @@ class FormatTimeCourses():
         psc=False,
         n_folds=None,
         dm=None,
+        out_file=None,
+        chunk_size=10000,
         *args,
         **kwargs
         ):
 
-        # different function for giftis
+        # different function for giftis; npy-files are memory-mapped so we only read the chunks we need
         if gifti:
             hemi_data = [dataset.ParseGiftiFile(pair[ix]).data for ix in range(len(pair))]
         else:
-            hemi_data = [np.load(pair[ix]) for ix in range(len(pair))]
+            hemi_data = [np.load(pair[ix], mmap_mode="r") for ix in range(len(pair))]
 
         n_verts = [ii.shape[-1] for ii in hemi_data]
 
-        # stack into array (time,voxels)
-        hemi_data = np.hstack(hemi_data)
-
         # cut vols?
-        if "cut_vols" in list(kwargs.keys()):
-            # print(f"cutting {kwargs['cut_vols']} away")
-            hemi_data = hemi_data[kwargs["cut_vols"]:,:]
-            kwargs.pop("cut_vols")
+        cut_vols = kwargs.pop("cut_vols", None)
+        if not isinstance(cut_vols, int):
+            cut_vols = 0
 
-        # check if we got multiple repeats within runs
+        n_vols = hemi_data[0].shape[0]-cut_vols
         if isinstance(n_folds, int):
-            hemi_data = self.average_iterations(
-                hemi_data, 
-                n_folds=n_folds, 
-                *args, 
-                **kwargs
-            )
+            n_vols = n_vols//n_folds
 
         # do percent change following marco's method
         if psc:
@@ -4306,19 +6349,52 @@ class FormatTimeCourses():
             if not isinstance(dm, (str,np.ndarray,dict)):
                 raise ValueError(f"Please specify a path representing the design matrix, or a numpy array, not {dm} of type {type(dm)}")
             
-            if hemi_data.shape[0] != dm.shape[-1]:
-                diff = dm.shape[-1]-hemi_data.shape[0]
-                # print(f"cutting {diff} from design")
+            if n_vols != dm.shape[-1]:
+                diff = dm.shape[-1]-n_vols
                 dm = dm[...,diff:]
 
-            hemi_data = utils.percent_change(
-                hemi_data,
-                0,
-                prf=True,
-                dm=dm
+        # preallocate (time,voxels) output; memory-mapped float32 if a file is specified
+        if isinstance(out_file, str):
+            hemi_out = np.lib.format.open_memmap(
+                out_file,
+                mode="w+",
+                dtype=np.float32,
+                shape=(n_vols, sum(n_verts))
             )
+        else:
+            hemi_out = np.zeros((n_vols, sum(n_verts)))
+
+        # fill output per chunk of vertices rather than stacking the hemispheres
+        start = 0
+        for data in hemi_data:
+            for ix in range(0, data.shape[-1], chunk_size):
+                chunk = np.asarray(data[cut_vols:,ix:ix+chunk_size], dtype=float)
+
+                # check if we got multiple repeats within runs
+                if isinstance(n_folds, int):
+                    chunk = self.average_iterations(
+                        chunk, 
+                        n_folds=n_folds, 
+                        *args, 
+                        **kwargs
+                    )
+
+                if psc:
+                    chunk = utils.percent_change(
+                        chunk,
+                        0,
+                        prf=True,
+                        dm=dm
+                    )
+
+                hemi_out[:,start+ix:start+ix+chunk.shape[-1]] = chunk
+
+            start += data.shape[-1]
+
+        if isinstance(hemi_out, np.memmap):
+            hemi_out.flush()
 
-        return hemi_data,n_verts
+        return hemi_out,n_verts
 
 class Profile1D(pRFmodelFitting):
 
@@ -6,11 +6,16 @@ from lazyfmri import (
 )
 import os
 import json
+import shutil
+import hashlib
 import datetime
+import importlib.util
+import tempfile
 import numpy as np
 import pandas as pd
 import nibabel as nb
 import matplotlib.pyplot as plt
+from scipy import sparse
 from joblib import (
     Parallel,
     delayed, 
@@ -24,6 +29,368 @@ class DateTimeEncoder(json.JSONEncoder):
         if isinstance(obj, (datetime.date, datetime.datetime)):
             return obj.isoformat()
 
+class ROIIndex():
+
+    """ROIIndex
+
+    Compiled set of ROIs. Every ROI is read once and its voxels are selected once: binary ROIs use all voxels within the mask,
+    float ROIs (e.g., zstat/tstat) the `nr` highest (or lowest) voxels, like :func:`fmriproc.roi.ExtractFromROIs.extract_data`.
+    The selected voxels of all ROIs are stored as one sorted array (`voxels`) and each ROI as a row of a sparse
+    `(n_rois, n_selected)` averaging matrix over those voxels. Extracting a run is then a single fancy-indexed gather of the
+    selected voxels followed by a single (sparse) matrix product, rather than a mask or `argpartition` per ROI and run. Use
+    :func:`fmriproc.roi.roi_index` to reuse an index across runs and subjects (e.g., ROIs in MNI-space).
+
+    Parameters
+    ----------
+    rois: list
+        List of ROIs, either strings representing a path, nibabel.Nifti1Image-objects, nibabel.GiftiImage-objects, or numpy
+        arrays. All ROIs must have the same number of voxels
+    nr: int, optional
+        number of voxels to select from float ROIs, by default 15
+    highest: bool, optional
+        If True, we select *nr* HIGHEST voxels from float ROIs. If False, we select the *nr* LOWEST. By default True
+    verbose: bool, optional
+        Make some noise, by default False
+
+    Example
+    ----------
+
+    .. code-block:: python
+
+        from fmriproc import roi
+        index = roi.ROIIndex(["ACC_L.nii.gz", "ACC_R.nii.gz"])
+        tcs = index.extract(func)   # func: (voxels, time) -> tcs: (2, time)
+    """
+
+    def __init__(
+        self,
+        rois,
+        nr=15,
+        highest=True,
+        verbose=False
+        ):
+
+        self.rois = rois
+        self.nr = nr
+        self.highest = highest
+        self.verbose = verbose
+
+        if self.rois is None:
+            # filled by ROIIndex.load
+            return
+
+        if not isinstance(self.rois, list):
+            self.rois = [self.rois]
+
+        self.compile()
+
+    def compile(self):
+        """Read the ROIs and build the averaging matrix"""
+
+        rows = []
+        cols = []
+        self.shape = None
+        for ix,roi in enumerate(self.rois):
+
+            roi_dat = ExtractFromROIs.load_file(roi)
+            if self.shape is None:
+                self.shape = roi_dat.shape
+            elif roi_dat.size != np.prod(self.shape):
+                raise ValueError(f"ROI #{ix+1} has {roi_dat.size} voxels, expected {np.prod(self.shape)} like the first ROI")
+
+            flat_roi = roi_dat.ravel()
+            if 0 <= flat_roi.max() <= 1:
+                idx = np.flatnonzero(flat_roi > 0)
+            else:
+                if self.highest:
+                    idx = np.argpartition(-flat_roi, self.nr-1)[:self.nr]
+                else:
+                    idx = np.argpartition(flat_roi, self.nr-1)[:self.nr]
+
+            rows.append(np.full(idx.shape[0], ix))
+            cols.append(idx)
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+
+        self.n_rois = len(self.rois)
+        self.n_voxels = int(np.prod(self.shape))
+        self.counts = np.bincount(rows, minlength=self.n_rois)
+
+        # voxels selected by any ROI; matrix columns index into this array
+        self.voxels,cols = np.unique(cols, return_inverse=True)
+
+        # weights of 1/n turn the product into an average
+        weights = 1/self.counts[rows]
+        self.matrix = sparse.csr_matrix(
+            (weights, (rows, cols.ravel())),
+            shape=(self.n_rois, self.voxels.shape[0])
+        )
+
+        utils.verbose(f"Compiled {self.n_rois} ROI(s) covering {self.voxels.shape[0]} voxels", self.verbose)
+
+    def roi_voxels(self, ix):
+        """Indices (in the flattened volume) of the voxels selected for the *ix*-th ROI"""
+        start,stop = self.matrix.indptr[ix],self.matrix.indptr[ix+1]
+        return self.voxels[self.matrix.indices[start:stop]]
+
+    def save(self, out_dir):
+        """Write the averaging matrix to `npy`-files in *out_dir*, so that worker processes can memory-map it with
+        :func:`fmriproc.roi.ROIIndex.load` rather than receiving a copy"""
+
+        os.makedirs(out_dir, exist_ok=True)
+        arrays = {
+            "data": self.matrix.data,
+            "indices": self.matrix.indices,
+            "indptr": self.matrix.indptr,
+            "counts": self.counts,
+            "voxels": self.voxels,
+            "shape": np.array(self.shape),
+            "settings": np.array([self.nr, self.highest])
+        }
+
+        for key,val in arrays.items():
+            np.save(opj(out_dir, f"{key}.npy"), val)
+
+    @classmethod
+    def load(cls, in_dir, mmap_mode="r"):
+        """Read an index written by :func:`fmriproc.roi.ROIIndex.save`; arrays are memory-mapped (read-only) by default"""
+
+        arrays = {}
+        for key in ["data", "indices", "indptr", "counts", "voxels", "shape"]:
+            arrays[key] = np.load(opj(in_dir, f"{key}.npy"), mmap_mode=mmap_mode)
+
+        # indices saved by earlier versions lack the settings they were compiled with
+        nr,highest = None,None
+        if os.path.exists(opj(in_dir, "settings.npy")):
+            nr,highest = np.load(opj(in_dir, "settings.npy"))
+            nr,highest = int(nr),bool(highest)
+
+        index = cls(None, nr=nr, highest=highest)
+        index.shape = tuple(int(i) for i in arrays["shape"])
+        index.counts = arrays["counts"]
+        index.n_rois = arrays["counts"].shape[0]
+        index.n_voxels = int(np.prod(index.shape))
+        index.voxels = arrays["voxels"]
+        index.matrix = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=(index.n_rois, index.voxels.shape[0]),
+            copy=False
+        )
+
+        return index
+
+    def signature(self):
+        """Hash of the selected voxels and averaging weights; identifies the index regardless of where it is stored"""
+
+        sha = hashlib.sha1()
+        for arr in [np.array(self.shape), self.voxels, self.matrix.data, self.matrix.indices, self.matrix.indptr]:
+            sha.update(np.ascontiguousarray(arr).tobytes())
+
+        return sha.hexdigest()
+
+    def extract(self, func):
+        """extract
+
+        Average timecourses of all ROIs.
+
+        Parameters
+        ----------
+        func: np.ndarray
+            2D timeseries representing the functional data (voxels, time)
+
+        Returns
+        ----------
+        np.ndarray
+            average timecourses (n_rois, time). ROIs without voxels are returned as NaN
+        """
+
+        if func.shape[0] != self.n_voxels:
+            raise ValueError(f"Functional data has {func.shape[0]} voxels, but ROIs have {self.n_voxels}; are they in the same space?")
+
+        tcs = np.asarray(self.matrix @ func[self.voxels])
+        tcs[self.counts == 0] = np.nan
+
+        return tcs
+
+    def extract_image(self, img, max_mem=1024):
+        """extract_image
+
+        Average timecourses of all ROIs, streamed from a 4D NIfTI image. Rather than loading the full image (as float64) with
+        ``get_fdata()``, volumes are read through ``img.dataobj`` in chunks of time points. Time is the slowest axis on disk, so
+        each chunk is a contiguous slab of the file; uncompressed images are memory-mapped by nibabel and gzipped images are
+        decompressed front to back. Only the selected voxels of each chunk are gathered (no flattened copy of the chunk) and
+        only the ROI averages are kept, so peak memory is bounded by `max_mem` regardless of the number of volumes.
+
+        Parameters
+        ----------
+        img: str, nibabel.Nifti1Image
+            path to a 4D NIfTI image or a nibabel.Nifti1Image-object
+        max_mem: int, float, optional
+            memory budget in MB for a chunk of volumes, by default 1024. Always at least 1 volume is read at a time
+
+        Returns
+        ----------
+        np.ndarray
+            average timecourses (n_rois, time). ROIs without voxels are returned as NaN
+        """
+
+        if isinstance(img, str):
+            img = nb.load(img, keep_file_open=True)
+
+        V = int(np.prod(img.shape[:-1]))
+        T = img.shape[-1]
+        if V != self.n_voxels:
+            raise ValueError(f"Functional data has {V} voxels, but ROIs have {self.n_voxels}; are they in the same space?")
+
+        # float64 copy of a chunk is the dominant cost
+        chunk_size = int(max(1, min(T, max_mem*2**20 // (V*8))))
+        utils.verbose(f" Streaming {T} volumes in chunks of {chunk_size} (max_mem={max_mem}MB)", self.verbose)
+
+        # gather selected voxels straight from the (x,y,z,t) chunk
+        coords = np.unravel_index(self.voxels, img.shape[:-1])
+
+        tcs = np.empty((self.n_rois, T))
+        for t0 in range(0, T, chunk_size):
+            t1 = min(T, t0+chunk_size)
+            chunk = np.asarray(img.dataobj[..., t0:t1])
+            tcs[:, t0:t1] = self.matrix @ chunk[coords].astype(float)
+
+        tcs[self.counts == 0] = np.nan
+
+        return tcs
+
+_roi_indices = {}
+
+def roi_index(rois, nr=15, highest=True, verbose=False, cache_dir=None):
+    """roi_index
+
+    Return a :class:`fmriproc.roi.ROIIndex` for `rois`, reusing the index if the same ROI files were compiled before in this
+    process (e.g., for the next run or subject in MNI-space). ROIs that are not file paths are compiled every time, unless
+    `cache_dir` is specified: the index is then also stored in "<cache_dir>/roi_index-<hash>" (see
+    :func:`fmriproc.roi.ROIIndex.save`) and memory-mapped from there by later calls with the same ROIs, `nr`, and `highest`.
+    The directory is available as the `index_dir` attribute of the index.
+    """
+
+    if not isinstance(rois, list):
+        rois = [rois]
+
+    if isinstance(cache_dir, str):
+        key = json.dumps([input_signature(rois), nr, highest], default=str)
+        index_dir = opj(cache_dir, f"roi_index-{hashlib.sha1(key.encode()).hexdigest()[:16]}")
+        if not os.path.isdir(index_dir):
+            index = ROIIndex(rois, nr=nr, highest=highest, verbose=verbose)
+
+            # write to a temporary directory first so an interrupted write is never picked up
+            tmp_dir = f"{index_dir}.{os.getpid()}.tmp"
+            index.save(tmp_dir)
+            try:
+                os.rename(tmp_dir, index_dir)
+            except OSError:
+                # written by another process in the meantime
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            utils.verbose(f"Using compiled ROIs from '{index_dir}'", verbose)
+
+        index = ROIIndex.load(index_dir)
+        index.index_dir = index_dir
+        return index
+
+    if not all(isinstance(i, str) for i in rois):
+        return ROIIndex(rois, nr=nr, highest=highest, verbose=verbose)
+
+    key = (tuple((os.path.abspath(i), os.path.getmtime(i)) for i in rois), nr, highest)
+    if key not in _roi_indices:
+        _roi_indices[key] = ROIIndex(rois, nr=nr, highest=highest, verbose=verbose)
+
+    return _roi_indices[key]
+
+def input_signature(obj):
+    """input_signature
+
+    Cheap description of an input for cache keys: (path, size, mtime) for files, a hash of the data for arrays and images.
+    """
+
+    if isinstance(obj, str):
+        stat = os.stat(obj)
+        return [os.path.abspath(obj), stat.st_size, stat.st_mtime]
+    elif isinstance(obj, (list, tuple)):
+        return [input_signature(i) for i in obj]
+    
+    data = ExtractFromROIs.load_file(obj)
+    return hashlib.sha1(np.ascontiguousarray(data).tobytes()).hexdigest()
+
+def extract_runs(
+    funcs,
+    index,
+    max_mem=1024,
+    dtype=float,
+    **kwargs
+    ):
+    """extract_runs
+
+    Average timecourses of all ROIs in *index* for a list of functional runs. NIfTI files are streamed with
+    :func:`fmriproc.roi.ROIIndex.extract_image`, other inputs are read with :func:`fmriproc.roi.ExtractFromROIs.load_file`.
+    Timecourses are normalized with :func:`fmriproc.roi.ExtractFromROIs.normalize_tc`.
+
+    Parameters
+    ----------
+    funcs: list
+        functional runs (paths, nibabel-objects, or numpy arrays)
+    index: fmriproc.roi.ROIIndex
+        compiled ROIs
+    max_mem: int, float, optional
+        memory budget (in MB) for streaming NIfTI files, by default 1024
+    dtype: type, optional
+        data type of the output arrays, by default float
+    **kwargs: dict
+        passed on to :func:`fmriproc.roi.ExtractFromROIs.normalize_tc` (*bsl*, *psc*, *zscore*)
+
+    Returns
+    ----------
+    list
+        one (time, n_rois) array per run
+    """
+
+    if isinstance(funcs, (str,nb.Nifti1Image,np.ndarray,nb.GiftiImage)):
+        funcs = [funcs]
+
+    output = []
+    for func in funcs:
+        if ExtractFromROIs.is_nifti(func):
+            tcs = index.extract_image(func, max_mem=max_mem).T
+        else:
+            data = ExtractFromROIs.load_file(func)
+            V = np.prod(data.shape[:-1])
+            tcs = index.extract(data.reshape(V, data.shape[-1])).T
+
+        for i in range(tcs.shape[1]):
+            tcs[:,i] = ExtractFromROIs.normalize_tc(tcs[:,i], **kwargs)
+
+        output.append(tcs.astype(dtype))
+
+    return output
+
+# ROI index loaded by a worker process of ExtractSubjects; keyed by content (see ROIIndex.signature) so each index is read
+# once per worker. Only the last index is kept: persistent workers would otherwise hold on to memory-maps of removed
+# (temporary) directories
+_worker_indices = {}
+
+def _extract_subject(files, index_dir, index_key, max_mem=1024, **kwargs):
+    """extract the runs of a single subject in a worker of :class:`fmriproc.roi.ExtractSubjects`"""
+
+    if index_key not in _worker_indices:
+        _worker_indices.clear()
+        _worker_indices[index_key] = ROIIndex.load(index_dir)
+
+    return extract_runs(
+        files,
+        _worker_indices[index_key],
+        max_mem=max_mem,
+        dtype=np.float32,
+        **kwargs
+    )
+
 class ExtractFromROIs():
 
     """ExtractFromROIs
@@ -60,6 +427,13 @@ class ExtractFromROIs():
         Subject ID to use for the dataframe formation, by default 1
     verbose: bool, optional
         Make some noise, by default False
+    roi_index: fmriproc.roi.ROIIndex, optional
+        Previously compiled ROIs (see :func:`fmriproc.roi.roi_index`). If None, *rois* will be compiled (or reused from
+        earlier calls with the same ROI files)
+    max_mem: int, float, optional
+        Memory budget (in MB) for reading NIfTI files, by default 1024. Files are streamed in chunks of volumes rather than
+        loaded as a whole, see :func:`fmriproc.roi.ROIIndex.extract_image`. Note that with :class:`fmriproc.roi.ExtractSubjects`
+        this budget applies to each job
     **kwargs: dict
         Same as :func:`fmriproc.roi.ExtractFromROIs.extract_data`
 
@@ -94,11 +468,15 @@ class ExtractFromROIs():
         TR=2,
         subject=1,
         verbose=False,
+        roi_index=None,
+        max_mem=1024,
         **kwargs
         ):
 
         self.func = func
         self.rois = rois
+        self.roi_index = roi_index
+        self.max_mem = max_mem
         self.filters = filters
         self.TR = TR
         self.subject = subject
@@ -160,77 +538,156 @@ class ExtractFromROIs():
     def main_extractor(
         self, 
         sep="_",
+        nr=15,
+        highest=True,
         **kwargs
         ):
 
-        """Loop through functional files to extract data using :func:`fmriproc.roi.ExtractFromROIs.extract_data`"""
-        df = []
-        # loop through functionals
-        for ix,func in enumerate(self.func):
-            
-            # try to read subject/run info from file
-            subject = self.subject
-            self.run = ix+1
+        """Extract the timecourses of all ROIs from the functional files with :func:`fmriproc.roi.extract_runs`, using a
+        :class:`fmriproc.roi.ROIIndex` that is compiled once for all runs"""
+
+        # ROIs are read once for all runs
+        if not isinstance(self.roi_index, ROIIndex):
+            self.roi_index = roi_index(
+                self.roi_list,
+                nr=nr,
+                highest=highest,
+                verbose=self.verbose
+            )
 
-            # load data
+        for ix,func in enumerate(self.func):
             if isinstance(func, str):
                 utils.verbose(f"Func #{ix+1}: {func}", self.verbose)
             else:
                 utils.verbose(f"Func #{ix+1}: input={type(func)}", self.verbose)
 
-            # load functional file
-            data = self.load_file(func)
-            T = data.shape[-1]
-            V = np.prod(data.shape[:-1])           # total # of voxels
-            flat_func = data.reshape(V, T)              # shape: (V, T)
-
-            # pre-allocate storage
-            n_rois  = len(self.roi_list)
-            all_data = np.empty((T, n_rois), dtype=float)
-            colnames = [None] * n_rois
-
-            # --- fill the array ---
-            for ix, roi in enumerate(self.roi_list):
-                # 1) name
-                colnames[ix] = self.extract_run_identifier(roi, ix, sep=sep)
-
-                # 2) load & extract
-                roi_dat = self.load_file(roi)
-                flat_roi = roi_dat.ravel()
-                extr_dat = self.extract_data(
-                    flat_func,
-                    flat_roi,
-                    **kwargs
-                )
+        runs = extract_runs(
+            self.func,
+            self.roi_index,
+            max_mem=self.max_mem,
+            **kwargs
+        )
 
-                # 3) stick into the big array
-                all_data[:, ix] = extr_dat.squeeze()
+        colnames,ids = self.roi_identifiers(
+            self.roi_list,
+            roi_names=self.roi_names,
+            sep=sep
+        )
 
-            # --- build the DataFrame just once ---
-            roi_df = pd.DataFrame(all_data, columns=colnames)
+        # identifiers from ROI filenames take precedence
+        for key,val in ids.items():
+            setattr(self, key, val)
+
+        df = pd.concat(
+            self.runs_to_dataframe(
+                runs,
+                colnames,
+                subject=self.subject,
+                TR=self.TR,
+                ses=self.ses,
+                task=self.task,
+                run=ids.get("run")
+            )
+        )
+
+        utils.verbose(f"Done", self.verbose)
+        return df
+
+    @staticmethod
+    def runs_to_dataframe(
+        runs,
+        colnames,
+        subject=1,
+        TR=2,
+        ses=None,
+        task=None,
+        run=None
+        ):
+
+        """Turn the (time, n_rois) arrays from :func:`fmriproc.roi.extract_runs` into one dataframe per run with *subject*,
+        *run* (by default the position in *runs*, starting at 1), *t*, and (if not None) *ses* and *task* columns"""
+
+        df = []
+        for ix,tcs in enumerate(runs):
+            roi_df = pd.DataFrame(np.asarray(tcs, dtype=float), columns=colnames)
 
-            # --- prepare all of the columns you want to assign ---
             assign_kwargs = {
                 "subject": subject,
-                "run":     self.run,
-                "t":       np.arange(T, dtype=float) * self.TR
+                "run": run if run is not None else ix+1,
+                "t": np.arange(tcs.shape[0], dtype=float) * TR
             }
 
             # add ses and task only if they exist and are not None
-            for k in ("ses", "task"):
-                val = getattr(self, k, None)
+            for key,val in zip(["ses", "task"], [ses, task]):
                 if val is not None:
-                    assign_kwargs[k] = val
+                    assign_kwargs[key] = val
 
-            # --- one-shot assign of everything ---
-            roi_df = roi_df.assign(**assign_kwargs)
+            df.append(roi_df.assign(**assign_kwargs))
 
-            df.append(roi_df)
-
-        df = pd.concat(df)
-        utils.verbose(f"Done", self.verbose)
         return df
 
+    @staticmethod
+    def roi_identifiers(
+        roi_list,
+        roi_names=None,
+        sep="_"
+        ):
+
+        """Column names for all ROIs (see :func:`fmriproc.roi.ExtractFromROIs.parse_roi_name`) and the ses/task/run identifiers
+        found in their filenames (the last ROI wins)"""
+
+        colnames = []
+        ids = {}
+        for ix,roi in enumerate(roi_list):
+            roi_name,comps = ExtractFromROIs.parse_roi_name(
+                roi,
+                ix,
+                roi_names=roi_names,
+                sep=sep
+            )
+
+            colnames.append(roi_name)
+            ids.update(comps)
+
+        return colnames,ids
+
+    @staticmethod
+    def parse_roi_name(
+        roi,
+        ix,
+        roi_names=None,
+        sep="_"
+        ):
+
+        """Name of the *ix*-th ROI: from *roi_names* if specified, from the filename if *roi* is a path, and "roi_<ix+1>"
+        otherwise. Also returns the ses/task/run identifiers in the filename"""
+
+        comps = {}
+        if isinstance(roi_names, list):
+            return roi_names[ix],comps
+
+        # extract ROI name from file
+        if isinstance(roi, str):
+            roi_name = os.path.basename(roi)
+            if roi_name.endswith("gz"):
+                roi_name = sep.join(roi_name.split(".")[:-2])
+            elif roi_name.endswith("nii"):
+                roi_name = sep.join(roi_name.split(".")[:-1])
+            else:
+                raise NotImplementedError()
+            
+            try:
+                bids_comps = utils.split_bids_components(roi)
+                for key in ["ses", "task", "run"]:
+                    if key in list(bids_comps.keys()):
+                        comps[key] = bids_comps[key]
+            except Exception:
+                pass
+        else:
+            roi_name = f"roi_{ix+1}"
+
+        return roi_name,comps
+
     def extract_run_identifier(
         self,
         roi,
@@ -238,33 +695,21 @@ class ExtractFromROIs():
         sep="_",
         ):
 
-        roi_name = None
-        if isinstance(self.roi_names, list):
-            roi_name = self.roi_names[ix]
+        """Name of the *ix*-th ROI; ses/task/run identifiers in the filename are set as attributes. See
+        :func:`fmriproc.roi.ExtractFromROIs.parse_roi_name`"""
 
-        # extract ROI name from file
-        if roi_name is None:
-            if isinstance(roi, str):
-                utils.verbose(f" Dealing with roi: {roi}", self.verbose)
-    
-                roi_name = os.path.basename(roi)
-                if roi_name.endswith("gz"):
-                    roi_name = sep.join(roi_name.split(".")[:-2])
-                elif roi_name.endswith("nii"):
-                    roi_name = sep.join(roi_name.split(".")[:-1])
-                else:
-                    raise NotImplementedError()
-                
-                try:
-                    bids_comps = utils.split_bids_components(roi)
-                    for key in ["ses", "task", "run"]:
-                        if key in list(bids_comps.keys()):
-                            setattr(self, key, bids_comps[key])
-                except Exception:
-                    pass
+        if isinstance(roi, str):
+            utils.verbose(f" Dealing with roi: {roi}", self.verbose)
 
-        else:
-            roi_name = f"roi_{ix+1}"
+        roi_name,comps = self.parse_roi_name(
+            roi,
+            ix,
+            roi_names=self.roi_names,
+            sep=sep
+        )
+
+        for key,val in comps.items():
+            setattr(self, key, val)
 
         return roi_name
     
@@ -325,6 +770,27 @@ class ExtractFromROIs():
         # 3) extract & average timecourses
         tc = func[mask].mean(axis=0) # shape (T,)      
 
+        return ExtractFromROIs.normalize_tc(
+            tc,
+            bsl=bsl,
+            psc=psc,
+            zscore=zscore
+        )
+
+    @staticmethod
+    def normalize_tc(
+        tc,
+        bsl=15,
+        psc=True,
+        zscore=False
+        ):
+
+        """normalize_tc
+
+        Normalize an extracted timecourse to percent signal change (default) or z-scores. See
+        :func:`fmriproc.roi.ExtractFromROIs.extract_data` for the parameters.
+        """
+
         if zscore:
             psc = False
 
@@ -344,6 +810,14 @@ class ExtractFromROIs():
             else:
                 return tc
 
+    @staticmethod
+    def is_nifti(file):
+        """Check whether *file* is a NIfTI file or nibabel.Nifti1Image-object, which can be streamed"""
+        if isinstance(file, str):
+            return file.endswith((".nii.gz", ".nii"))
+        
+        return isinstance(file, nb.Nifti1Image)
+
     @staticmethod
     def load_file(file):
         """Load file based on whether it is a string, numpy array, or nibabel.Nifti1Image object"""
@@ -400,6 +874,11 @@ class ExtractSubjects(ExtractFromROIs):
     in_file: str, optional
         Directly specify a 4D file to extract timecourses from, rather than looking in
         predefined folders such as fMRIPrep, FEAT, or Pybest..
+    cache_dir: str, optional
+        Directory to store the extracted timecourses of each subject in ("sub-<subject>_desc-tcs.parquet"), by default None
+        (no caching). A subject is only extracted again if its functional files (path, size, modification time), the ROIs,
+        or the extraction settings (e.g., *nr*, *psc*, *zscore*, *bsl*) changed. Requires `pyarrow`; otherwise pickles are
+        used
     **kwargs: dict
         Same as :func:`fmriproc.roi.ExtractFromROIs.extract_data`
     """
@@ -415,11 +894,13 @@ class ExtractSubjects(ExtractFromROIs):
         incl_subjs=None,
         n_jobs=None,
         verbose=False,
+        cache_dir=None,
         **kwargs
         ):
 
         self.in_file = in_file
         self.ft_dir = ft_dir
+        self.cache_dir = cache_dir
         self.excl_subjs = excl_subjs
         self.incl_subjs = incl_subjs
         self.n_jobs = n_jobs
@@ -607,19 +1088,100 @@ class ExtractSubjects(ExtractFromROIs):
         self, 
         **kwargs
         ):
-        """Wrapper around :func:`fmriproc.roi.ExtractSubjects.extract_single_subject` to loop through subjects"""
-        output = Parallel(n_jobs=self.n_jobs, verbose=True)(
-            delayed(self.extract_single_subject)(
-                utils.get_file_from_substring([sub], self.all_files),
-                subject=sub.split("-")[-1],
+        """Extract the timecourses of all subjects. The ROIs are compiled once (:func:`fmriproc.roi.roi_index`) and shared with
+        the workers as a read-only, memory-mapped matrix (:func:`fmriproc.roi.ROIIndex.save`). Workers return float32 arrays
+        per run, which are assembled into a single dataframe here. Subjects with up-to-date timecourses in *cache_dir* are read
+        from there instead"""
+
+        self.rois = kwargs.get("rois")
+        self.filters = kwargs.get("filters")
+        if isinstance(self.filters, str):
+            self.filters = [self.filters]
+
+        self.set_rois_input()
+
+        roi_names = kwargs.get("roi_names")
+        if isinstance(roi_names, str):
+            roi_names = [roi_names]
+
+        colnames,ids = self.roi_identifiers(
+            self.roi_list,
+            roi_names=roi_names,
+            sep=kwargs.get("sep", "_")
+        )
+
+        # check cache
+        output = {}
+        cache_keys = {}
+        todo = []
+        for sub in self.subjects:
+            if isinstance(self.cache_dir, str):
+                cache_keys[sub] = self.cache_key(
+                    utils.get_file_from_substring([sub], self.all_files),
+                    **kwargs
+                )
+
+                output[sub] = self.read_cache(sub, cache_keys[sub])
+                if isinstance(output[sub], pd.DataFrame):
+                    utils.verbose(f"Using cached timecourses for {sub}", self.verbose)
+                    continue
+
+            todo.append(sub)
+
+        if len(todo) > 0:
+
+            # compile ROIs once for all subjects; with a cache, also across calls
+            self.roi_index = roi_index(
+                self.roi_list,
+                nr=kwargs.get("nr", 15),
+                highest=kwargs.get("highest", True),
                 verbose=self.verbose,
-                **kwargs
+                cache_dir=self.cache_dir
             )
-            for sub in self.subjects
-        )
+
+            # settings used by the workers
+            worker_kws = {key: kwargs[key] for key in ["bsl", "psc", "zscore", "max_mem"] if key in list(kwargs.keys())}
+
+            # without a cache directory, the index is shared through a temporary directory
+            tmp_dir = None
+            try:
+                index_dir = getattr(self.roi_index, "index_dir", None)
+                if not isinstance(index_dir, str):
+                    tmp_dir = tempfile.mkdtemp(prefix="extractsubjects_")
+                    index_dir = opj(tmp_dir, "roi_index")
+                    self.roi_index.save(index_dir)
+
+                extracted = Parallel(n_jobs=min(self.n_jobs, len(todo)), verbose=True)(
+                    delayed(_extract_subject)(
+                        utils.get_file_from_substring([sub], self.all_files),
+                        index_dir,
+                        self.roi_index.signature(),
+                        **worker_kws
+                    )
+                    for sub in todo
+                )
+            finally:
+                if isinstance(tmp_dir, str):
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+            for sub,runs in zip(todo, extracted):
+                output[sub] = pd.concat(
+                    self.runs_to_dataframe(
+                        runs,
+                        colnames,
+                        subject=sub.split("-")[-1],
+                        TR=kwargs.get("TR", 2),
+                        ses=ids.get("ses", kwargs.get("ses")),
+                        task=ids.get("task"),
+                        run=ids.get("run")
+                    )
+                )
+
+                if isinstance(self.cache_dir, str):
+                    self.write_cache(sub, cache_keys[sub], output[sub])
 
         # concat
-        df = pd.concat(output)
+        df = pd.concat([output[sub] for sub in self.subjects])
 
         # set indices
         idx_list = ["subject", "run", "t"]
@@ -631,17 +1193,67 @@ class ExtractSubjects(ExtractFromROIs):
 
         return df
 
-    def extract_single_subject(
-        self, 
+    def cache_key(
+        self,
         files,
-        **kwargs):
-        """Wrapper around :class:`fmriproc.roi.ExtractFromROIs` to extract data from a single subject"""
-        super().__init__(
-            files,
-            **kwargs
-        )
+        **kwargs
+        ):
+        """Hash of the functional files, ROIs, and extraction settings of a subject"""
 
-        return self.extracted_data.copy()
+        # settings that do not change the extracted timecourses
+        skip = ["rois", "filters", "verbose", "max_mem", "roi_index"]
+        settings = {key: val for key,val in kwargs.items() if key not in skip}
+
+        key = {
+            "func": input_signature(files),
+            "rois": input_signature(self.roi_list),
+            "settings": settings
+        }
+
+        key = json.dumps(key, sort_keys=True, default=str)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def cache_file(self, sub):
+        """Cached timecourses of *sub*; parquet if pyarrow is available, pickle otherwise"""
+        ext = "parquet" if importlib.util.find_spec("pyarrow") is not None else "pkl"
+        return opj(self.cache_dir, f"{sub}_desc-tcs.{ext}")
+
+    def read_cache(self, sub, key):
+        """Read cached timecourses of *sub* if they were extracted with the same *key*, otherwise return None"""
+
+        fname = self.cache_file(sub)
+        key_file = opj(self.cache_dir, f"{sub}_desc-tcs.json")
+        if not os.path.exists(fname) or not os.path.exists(key_file):
+            return None
+
+        with open(key_file) as f:
+            if json.load(f).get("key") != key:
+                return None
+
+        if fname.endswith("parquet"):
+            return pd.read_parquet(fname)
+        else:
+            return pd.read_pickle(fname)
+
+    def write_cache(self, sub, key, df):
+        """Store extracted timecourses of *sub* together with the *key* they were extracted with"""
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fname = self.cache_file(sub)
+        key_file = opj(self.cache_dir, f"{sub}_desc-tcs.json")
+        if os.path.exists(key_file):
+            os.remove(key_file)
+
+        # column names must be strings for parquet
+        df = df.rename(columns=str)
+        if fname.endswith("parquet"):
+            df.to_parquet(fname, index=False)
+        else:
+            df.to_pickle(fname)
+
+        # write key last; an interrupted write leaves no valid cache
+        with open(key_file, "w") as f:
+            json.dump({"key": key, "date": datetime.datetime.now()}, f, indent=4, cls=DateTimeEncoder)
 
 
 def format_onsets(
@@ -749,6 +1361,10 @@ class FullExtractionPipeline(ExtractSubjects):
         Switch to different plotting function, by default False.
     do_fit: bool, optional
         If False, we'll only extract the data and will not perform deconvolution, by default True
+    cache: bool, optional
+        Cache the extracted timecourses of each subject in "<output_dir>/cache", by default True. Re-running with different
+        deconvolution or plotting settings then skips the extraction of subjects whose functional files, ROIs, and extraction
+        settings did not change. See *cache_dir* in :class:`fmriproc.roi.ExtractSubjects`
     """
     def __init__(
         self, 
@@ -763,6 +1379,7 @@ class FullExtractionPipeline(ExtractSubjects):
         pos_neg=False,
         do_fit=True,
         excl_evs=[],
+        cache=True,
         **kwargs
         ):
 
@@ -796,6 +1413,10 @@ class FullExtractionPipeline(ExtractSubjects):
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir, exist_ok=True)
 
+        # cache extracted timecourses
+        if cache and "cache_dir" not in list(kwargs.keys()):
+            kwargs["cache_dir"] = opj(self.output_dir, "cache")
+
         # initiate ExtractSubjects class
         super().__init__(
             verbose=self.verbose,
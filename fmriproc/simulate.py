@@ -364,7 +364,7 @@ class ITI():
             # check if we should also resample to n_pix (can only be done if make_square=True)
             if isinstance(n_pix, int):
                 if dm.shape[0] != n_pix:
-                    dm = utils.resample2d(dm, n_pix)
+                    dm = prf.resample2d(dm, n_pix)
 
         return dm
 
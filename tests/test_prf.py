@@ -31,3 +31,563 @@ def test_fit_prf_with_example(examples_dir):
 
     assert isinstance(result, np.ndarray), "fit_prf should return a numpy array"
     assert 0 <= result[0,-1] <= 1, "r2 should be between 0 and 1"
+
+def test_fit_prf_float32(examples_dir):
+    """Test that single precision fitting matches double precision fitting on the example timecourse."""
+    mat_file = os.path.join(examples_dir, "design_task-2R.mat")
+    prf_file = os.path.join(examples_dir, "prf.npy")
+
+    design = prf.read_par_file(mat_file)
+    timecourse = np.load(prf_file)
+
+    results = {}
+    for precision in ["float64", "float32"]:
+        model_fitter = prf.pRFmodelFitting(
+            timecourse.T, 
+            design,
+            TR=1.5,
+            model="gauss",
+            constraints="bgfs",
+            precision=precision,
+            verbose=False
+        )
+
+        model_fitter.fit()
+        results[precision] = model_fitter.gauss_iter
+
+    r2_diff = np.abs(results["float32"][:,-1]-results["float64"][:,-1]).max()
+
+    assert model_fitter.design_matrix.dtype == np.float32, "design should be single precision"
+    assert r2_diff < 0.01, "r2 of float32 fit should be close to float64 fit"
+
+def test_adaptive_grid_norm(examples_dir):
+    """Test that the coarse-to-fine DN-grid is at least as good as the dense grid."""
+    mat_file = os.path.join(examples_dir, "design_task-2R.mat")
+    prf_file = os.path.join(examples_dir, "prf.npy")
+
+    design = prf.read_par_file(mat_file)
+    timecourse = np.load(prf_file)
+
+    r2 = {}
+    for depth in [0, 1]:
+        model_fitter = prf.pRFmodelFitting(
+            timecourse.T, 
+            design,
+            TR=1.5,
+            model="norm",
+            stage="grid",
+            constraints="bgfs",
+            adaptive_depth=depth,
+            verbose=False
+        )
+        model_fitter.fit()
+        r2[depth] = model_fitter.norm_grid[:,-1]
+
+    assert np.all(r2[1] >= r2[0]-1e-4), "adaptive grid should not be worse than the dense grid"
+
+def test_resample2d():
+    """Test that the vectorised resampler reproduces per-frame interp2d on a 270->100 px design."""
+    design = np.zeros((270,270,225))
+    for ii in range(design.shape[-1]):
+        design[:,(ii*5)%250:(ii*5)%250+20,ii] = 1
+
+    new = prf.resample2d(design, 100)
+
+    assert new.shape == (100,100,225), "resampled design should be (100,100,225)"
+    assert prf.resample2d(design, 90, kind="block").shape == (90,90,225), "block average should be (90,90,225)"
+    assert prf.resample2d(design[...,0], 100).shape == (100,100), "2D input should stay 2D"
+
+    from scipy import interpolate
+    try:
+        x = np.arange(design.shape[0])
+        old = np.zeros_like(new)
+        for dd in range(design.shape[-1]):
+            f = interpolate.interp2d(x, x, design[...,dd], kind="linear")
+            old[...,dd] = f(np.linspace(0,270,100), np.linspace(0,270,100))
+    except (AttributeError, NotImplementedError):
+        return
+
+    assert np.allclose(old, new), "resample2d should reproduce interp2d"
+
+def test_norm_2d_sr_function_chunks():
+    """Test that chunked SR-functions match the tiled reference implementation."""
+    x = np.linspace(-10,10,60)
+    y = np.linspace(-5,5,30)
+    xx,yy = np.meshgrid(x,y)
+    stims = np.stack([((xx**2+yy**2)**0.5 < r).astype(int) for r in np.linspace(0,10,15)], axis=-1)
+
+    rng = np.random.default_rng(1)
+    a,b,c,d = [rng.uniform(0.5,2,25) for _ in range(4)]
+    s_1 = rng.uniform(0.5,2,25)
+    s_2 = s_1*rng.uniform(2,4,25)
+
+    n_stims = stims.shape[-1]
+    gauss_1 = np.exp(-(xx[...,np.newaxis]**2+yy[...,np.newaxis]**2)/(2*s_1**2))
+    gauss_2 = np.exp(-(xx[...,np.newaxis]**2+yy[...,np.newaxis]**2)/(2*s_2**2))
+    ref = (a[...,np.newaxis]*np.sum(np.tile(gauss_1[...,np.newaxis],n_stims)*stims[:,:,np.newaxis,:],axis=(0,1))+b[...,np.newaxis])/\
+        (c[...,np.newaxis]*np.sum(np.tile(gauss_2[...,np.newaxis],n_stims)*stims[:,:,np.newaxis,:],axis=(0,1))+d[...,np.newaxis])-(b/d)[...,np.newaxis]
+
+    sr = prf.norm_2d_sr_function(a,b,c,d,s_1,s_2,x,y,stims,chunk_size=7,n_jobs=2)
+    assert sr.shape == (25,n_stims), "SR-function should be (n_vertices,n_stims)"
+    assert np.allclose(sr, ref), "chunked SR-function should match the tiled implementation"
+
+def test_unique_sr_function():
+    """Test that pRF-centered SR-functions match per-pRF stimulus generation."""
+    x = np.linspace(-10,10,60)
+    y = np.linspace(-5,5,30)
+
+    rng = np.random.default_rng(2)
+    n = 10
+    a,b,c,d = [rng.uniform(0.5,2,n) for _ in range(4)]
+    s_1 = rng.uniform(0.5,2,n)
+    s_2 = s_1*rng.uniform(2,4,n)
+    mu_x,mu_y = rng.uniform(-8,8,n),rng.uniform(-4,4,n)
+
+    _,sizes = prf.make_stims((x,y), factor=1, dt="fill")
+    for dt in ["fill","hole"]:
+        ref = []
+        for ix in range(n):
+            stims,_ = prf.make_stims((x,y), factor=1, dt=dt, loc=(mu_x[ix],mu_y[ix]))
+            ref.append(prf.norm_2d_sr_function(a[ix],b[ix],c[ix],d[ix],s_1[ix],s_2[ix],x,y,stims,mu_x=mu_x[ix],mu_y=mu_y[ix]))
+
+        sr = prf.norm_2d_sr_function_local(a,b,c,d,s_1,s_2,x,y,np.asarray(sizes)/2,mu_x=mu_x,mu_y=mu_y,dt=dt,chunk_size=3,n_jobs=2)
+        assert np.allclose(sr, np.concatenate(ref)), f"local SR-functions ({dt}) should match per-pRF stimuli"
+
+def test_par_store(tmp_path):
+    """Test that parameter stores round-trip and support column/vertex reads."""
+    rng = np.random.default_rng(3)
+    pars = rng.standard_normal((1000,10))
+    settings = {"TR": 1.5, "screen_size_cm": [70,39.3]}
+
+    par_file = str(tmp_path / "sub-01_model-norm_stage-iter_desc-prf_params.npz")
+    prf.write_par_file(pars, par_file, model="norm", stage="iter", settings=settings)
+
+    assert np.array_equal(prf.read_par_file(par_file), pars), "store should round-trip parameters"
+    assert prf.read_par_file(par_file, key="settings") == settings, "store should round-trip settings"
+
+    r2 = prf.read_par_store(par_file, columns="r2")
+    assert isinstance(r2, np.memmap) and np.array_equal(r2, pars[:,-1]), "single column should be memory-mapped"
+    assert np.array_equal(prf.read_par_store(par_file, vertices=[42])[0], pars[42]), "single vertex read should match"
+    assert list(prf.Parameters(par_file, model="norm").to_df()["x"]) == list(pars[:,0]), "Parameters should read stores"
+
+def test_find_most_similar_prf_batch():
+    """Test that batched KD-tree matching agrees with brute-force distances."""
+    rng = np.random.default_rng(4)
+    pars = np.column_stack([rng.uniform(-5,5,(2000,2)), rng.uniform(0.5,3,2000), rng.standard_normal((2000,2)), rng.uniform(0,1,2000)])
+    refs = pars[rng.choice(2000, 20, replace=False)]
+
+    matches = prf.find_most_similar_prf(refs, pars, return_nr=3, r2_thresh=0.5)
+    assert matches.shape == (20,3), "should return 3 matches per reference pRF"
+
+    valid = np.flatnonzero(pars[:,-1] > 0.5)
+    for ref,match in zip(refs,matches):
+        dist = np.linalg.norm(pars[valid,:3]-ref[:3], axis=-1)
+        assert np.array_equal(match, valid[np.argsort(dist)[:3]]), "KD-tree matches should equal brute-force matches"
+
+    ranked = prf.find_most_similar_prf(refs, pars, r2_thresh=0.5)
+    assert ranked.shape == (20,valid.shape[0]), "should rank all pRFs surviving the threshold"
+    for ref,match in zip(refs,ranked):
+        dist = np.linalg.norm(pars[match,:3]-ref[:3], axis=-1)
+        assert np.all(np.diff(dist) >= 0), "matches should be sorted by distance"
+
+    assert np.array_equal(prf.find_most_similar_prf(refs[0], pars, r2_thresh=0.5), ranked[0])
+
+def test_render_prfs_chunks():
+    """Test that chunked RF rendering matches per-vertex rendering and streaming coverage."""
+    from prfpy import rf
+
+    class Stim():
+        x_coordinates,y_coordinates = np.meshgrid(np.linspace(-5,5,40), np.linspace(-5,5,40))
+
+    stim = Stim()
+    rng = np.random.default_rng(5)
+    pars = np.column_stack([
+        rng.uniform(-3,3,(50,2)), rng.uniform(0.5,2,50), rng.uniform(0.5,2,50), np.zeros(50),
+        rng.uniform(0.1,1,50), rng.uniform(3,5,50), rng.uniform(0.5,2,(50,2)), rng.uniform(0,1,50)
+    ])
+
+    stack = np.concatenate([rfs for _,rfs in prf.render_prfs(pars, stim, model="norm", chunk_size=7)])
+    for ix in [0,17,49]:
+        p = pars[ix]
+        gauss = [np.rot90(rf.gauss2D_iso_cart(x=stim.x_coordinates, y=stim.y_coordinates, mu=(p[0],p[1]), sigma=s).T) for s in [p[2],p[6]]]
+        ref = (p[3]*gauss[0]+p[7])/(p[5]*gauss[1]+p[8])-p[7]/p[8]
+        assert np.allclose(stack[ix], ref), "rendered RF should match per-vertex rendering"
+
+    coverage = prf.prf_coverage(pars, stim, model="norm", reduction="sum", normalize=False, chunk_size=7)
+    assert np.allclose(coverage, stack.sum(axis=0)), "streaming coverage should match the full stack"
+
+    # single vertex returns a 2D RF, multiple vertices a stack
+    assert np.allclose(prf.make_prf(stim, pars[17], model="norm"), stack[17])
+    rfs = prf.make_prf(stim, pars[:3], model="norm")
+    assert rfs.shape == (3,40,40), "multiple vertices should return a (n_vertices,n_pix,n_pix)-stack"
+    assert np.allclose(rfs, stack[:3])
+    assert prf.make_prf(stim, pars[:3], model="norm", resize_pix=60).shape == (3,60,60)
+
+def test_parameters_lazy_columns():
+    """Test that Parameters serves views, memoises derived columns, and only materialises requested columns."""
+    rng = np.random.default_rng(6)
+    pars = prf.Parameters(rng.uniform(0.5,2,(100,10)), model="norm")
+
+    assert np.shares_memory(pars["x"], pars.params), "base columns should be views on the estimates"
+    assert pars["ecc"] is pars["ecc"], "derived columns should be computed once"
+
+    df = pars.to_df(columns=["x","size ratio"])
+    assert list(df.columns) == ["x","size ratio"], "only requested columns should be materialised"
+    assert np.allclose(df["size ratio"], pars.to_df()["size ratio"]), "selected columns should match the full dataframe"
+
+def _bar_design(n_pix=100, n_vols=120):
+    """synthetic design with a bar sweeping horizontally and vertically, separated by blanks"""
+    design = np.zeros((n_pix, n_pix, n_vols))
+    for ii in range(n_vols):
+        pos = ii % 40
+        if pos < 30:
+            lo = int(pos/30*n_pix)
+            if (ii//40) % 2 == 0:
+                design[:,lo:lo+n_pix//8,ii] = 1
+            else:
+                design[lo:lo+n_pix//8,:,ii] = 1
+
+    return design
+
+def test_fit_subjects(tmp_path):
+    """Fitting several subjects on one pool should write the same parameters as fitting them separately."""
+    design = _bar_design()
+    reg = prf.stimulus_energy_regressor(design, TR=1.5)
+
+    rng = np.random.default_rng(5)
+    subjects = []
+    for ix in range(2):
+        data = 5*reg + rng.normal(0, 0.1, size=(3, reg.shape[0]))
+        data_file = str(tmp_path / f"sub-{ix}_bold.npy")
+        np.save(data_file, data)
+        subjects.append({
+            "data": data_file,
+            "design_matrix": design,
+            "output_dir": str(tmp_path),
+            "output_base": f"sub-{ix}",
+        })
+
+    fitter = prf.FitSubjects(
+        subjects,
+        n_jobs=2,
+        batch_size=2,
+        grid_cache=str(tmp_path / "grid_cache"),
+        verbose=False,
+        model="gauss",
+        TR=1.5,
+        constraints="bgfs"
+    )
+    fitter.fit()
+
+    for ix,subj in enumerate(subjects):
+        pars = prf.read_par_file(str(tmp_path / f"sub-{ix}_model-gauss_stage-iter_desc-prf_params.npz"))
+        assert pars.shape[0] == 3, "parameters should be written for all vertices"
+
+        ref = prf.pRFmodelFitting(
+            np.load(subj["data"]),
+            design,
+            TR=1.5,
+            model="gauss",
+            constraints="bgfs",
+            verbose=False
+        )
+        ref.fit()
+        assert np.allclose(pars[:,-1], ref.gauss_iter[:,-1], atol=1e-3), "r2 should match a regular fit"
+
+class _NeighbourFit():
+    """stand-in for pRFmodelFitting with the attributes used by the neighbour-seeded fit"""
+
+    neighbour_waves = prf.pRFmodelFitting.neighbour_waves
+    neighbour_iterfit = prf.pRFmodelFitting.neighbour_iterfit
+    restore_fitter = prf.pRFmodelFitting.restore_fitter
+
+    def __init__(self, adjacency, params):
+        self.adjacency = adjacency
+        self.fit_idx = None
+        self.nr_jobs = 1
+        self.verbose = False
+        self.settings = {"rsq_threshold": 0.1}
+        self.params = params
+        self.starts = {}
+
+    def iterfit_subset(self, fitter, data, idx, start_params, bounds, **kwargs):
+        # record starting points; "converge" to the true parameters
+        self.starts.update({i: start_params[i].copy() for i in idx})
+        return self.params[idx]
+
+class _PRFpyFitter():
+    """stand-in for a prfpy fitter; like prfpy, `iterative_fit` only derives `rsq_mask` if the attribute is missing"""
+
+    def __init__(self, data, gridsearch_params, fail_after=None, model=None):
+        self.data = data
+        self.model = model
+        self.n_units = data.shape[0]
+        self.gridsearch_params = gridsearch_params
+        self.fail_after = fail_after
+        self.n_fits = 0
+
+    def iterative_fit(self, rsq_threshold, starting_params=None, bounds=None, **kwargs):
+        if self.n_fits == self.fail_after:
+            raise RuntimeError("fit was killed")
+
+        self.n_fits += 1
+        self.starting_params = self.gridsearch_params if starting_params is None else starting_params
+        if not hasattr(self, "rsq_mask"):
+            self.rsq_mask = self.starting_params[:,-1] > rsq_threshold
+
+        # "converge" to the mean of each timecourse
+        self.iterative_search_params = self.starting_params.copy()
+        self.iterative_search_params[self.rsq_mask,0] = self.data[self.rsq_mask].mean(axis=-1)
+
+class _BatchedFit():
+    """stand-in for pRFmodelFitting with the attributes used by the batched (checkpointed) fit"""
+
+    batched_iterfit = prf.pRFmodelFitting.batched_iterfit
+    iterfit_subset = prf.pRFmodelFitting.iterfit_subset
+    restore_fitter = prf.pRFmodelFitting.restore_fitter
+    checkpoint_dir = prf.pRFmodelFitting.checkpoint_dir
+    checkpoint_key = prf.pRFmodelFitting.checkpoint_key
+    read_manifest = prf.pRFmodelFitting.read_manifest
+    write_manifest = prf.pRFmodelFitting.write_manifest
+
+    def __init__(self, output_dir, batch_size):
+        self.adjacency = None
+        self.batch_size = batch_size
+        self.write_files = True
+        self.output_dir = output_dir
+        self.output_base = "sub-01"
+        self.verbose = False
+        self.settings = {"rsq_threshold": 0.1}
+
+def _path_graph(n):
+    from scipy import sparse
+    i = np.arange(n-1)
+    adj = sparse.coo_matrix((np.ones(n-1), (i, i+1)), shape=(n,n))
+    return (adj+adj.T).tocsr()
+
+def test_neighbour_waves():
+    """Waves should cover each vertex once, start at the best vertex, and hold at least 100 vertices."""
+    from scipy import sparse
+    adj = sparse.block_diag([_path_graph(250), _path_graph(30)], format="csr")
+    rsq = np.zeros(280)
+    rsq[200] = 0.9
+    rsq[265] = 0.5
+
+    waves = _NeighbourFit(adj, None).neighbour_waves(adj, rsq)
+    order = np.concatenate(waves)
+
+    assert np.array_equal(np.sort(order), np.arange(280)), "each vertex should be in exactly one wave"
+    assert order[0] == 200, "first wave should start at the vertex with the highest r2"
+    assert all([len(w) >= 100 for w in waves[:-1]]), "waves should hold at least 100 vertices"
+    assert order[250] == 265, "second component should start at its best vertex"
+
+def test_neighbour_iterfit():
+    """Neighbours seed the starting position, but the grid r2 keeps gating the fit."""
+    from types import SimpleNamespace
+
+    n = 300
+    x = np.sin(np.linspace(0, 20, 100))
+    data = 2*x + np.random.default_rng(6).normal(0, 0.1, size=(n,100))
+
+    # (amplitude, baseline, r2); only vertex 0 has a good grid solution
+    grid = np.tile([0.1, 0, 0.05], (n,1))
+    grid[0] = [2, 0, 0.9]
+    true = np.tile([2, 0, 0.95], (n,1))
+
+    model = SimpleNamespace(return_prediction=lambda amp, bsl: amp[:,None]*x + bsl[:,None])
+    fitter = SimpleNamespace(data=data, gridsearch_params=grid, model=model)
+
+    obj = _NeighbourFit(_path_graph(n), true)
+    obj.neighbour_iterfit(fitter)
+
+    assert np.isnan(fitter.seed_rsq[0]), "the first vertex starts from its grid"
+    assert fitter.seed_rsq[100] > 0.9, "vertex 100 should be seeded by its converged neighbour"
+    assert obj.starts[100][0] == 2, "seeded vertex should start at the neighbour's solution"
+    assert obj.starts[100][-1] == 0.05, "last column should keep the grid r2"
+    assert not fitter.rsq_mask[100], "vertices below rsq_threshold in the grid should not pass the mask"
+
+def test_min_stim_corr():
+    """Timecourses following the stimulus energy should be fitted, pure noise should be skipped."""
+    from types import SimpleNamespace
+
+    design = _bar_design()
+    reg = prf.stimulus_energy_regressor(design, TR=1.5)
+    assert reg.shape == (design.shape[-1],), "regressor should have one value per volume"
+
+    rng = np.random.default_rng(7)
+    noise = rng.normal(0, 1, size=(20, reg.shape[0]))
+    data = noise.copy()
+    data[:10] = 3*(reg-reg.mean())/reg.std() + 0.5*noise[:10]
+
+    obj = SimpleNamespace(
+        data=data,
+        n_vertices=20,
+        mask=None,
+        min_variance=None,
+        min_stim_corr=0.3,
+        design_matrix=design,
+        TR=1.5,
+        verbose=False
+    )
+    prf.pRFmodelFitting.define_fit_vertices(obj)
+
+    assert np.array_equal(obj.fit_idx, np.arange(10)), "only stimulus-driven timecourses should be kept"
+    assert obj.n_prefiltered == 10, "all noise timecourses should be skipped"
+    assert obj.data.shape[0] == 10
+
+def test_nearest_onsets():
+    """Vectorized onset lookup should match the per-TR argmin it replaced, including ties and unsorted onsets."""
+    rng = np.random.default_rng(8)
+    times = np.arange(300)*1.5 + 0.75
+
+    # TR-midpoints fall exactly between the equidistant onsets
+    ties = np.arange(0, 450, 3.0) - 0.75
+    for onsets in [np.sort(rng.uniform(0, 450, 60)), rng.uniform(0, 450, 60), ties, rng.permutation(ties), np.repeat(np.arange(0, 450, 15.0), 2)]:
+        ref = np.array([np.argmin(np.abs(onsets-t)) for t in times])
+        assert np.array_equal(prf.nearest_onsets(onsets, times), ref), "should equal per-TR argmin"
+
+def test_index_screenshots(tmp_path):
+    """Screenshots are indexed by trial number, and ambiguous trial numbers raise."""
+    import pytest
+
+    for ff in ["Screenshots0.png", "Screenshots12.png", "Screenshots103.png", "notes.txt"]:
+        (tmp_path / ff).touch()
+
+    assert prf.index_screenshots(str(tmp_path)) == {0: "Screenshots0.png", 12: "Screenshots12.png", 103: "Screenshots103.png"}
+
+    (tmp_path / "Screenshots012.png").touch()
+    with pytest.raises(ValueError):
+        prf.index_screenshots(str(tmp_path))
+
+def test_get_prfdesign_cache(tmp_path):
+    """Threaded decoding equals serial decoding, and the cache only hits for identical screenshots and settings."""
+    import matplotlib.image as mpimg
+
+    rng = np.random.default_rng(9)
+    screenshots = tmp_path / "screenshots"
+    screenshots.mkdir()
+    for ix in range(1,6):
+        # black/white stimulus on a grey background, with a non-square screen
+        img = np.full((60, 80, 3), 127, dtype=np.uint8)
+        img[rng.uniform(size=(60, 80)) > 0.5] = 0
+        img[:, 30+ix:40+ix] = 255
+        mpimg.imsave(str(screenshots / f"Screenshots{ix:03d}.png"), img)
+
+    cache_dir = str(tmp_path / "cache")
+    serial = prf.get_prfdesign(str(screenshots), n_pix=30, n_jobs=1)
+    threaded = prf.get_prfdesign(str(screenshots), n_pix=30, n_jobs=4)
+    assert serial.shape == (30, 30, 6)
+    assert np.array_equal(serial, threaded), "threaded decoding should equal serial decoding"
+
+    fresh = prf.get_prfdesign(str(screenshots), n_pix=30, cache_dir=cache_dir)
+    cached = prf.get_prfdesign(str(screenshots), n_pix=30, cache_dir=cache_dir)
+    assert np.array_equal(fresh, serial)
+    assert np.array_equal(cached, fresh), "cached design should equal a fresh one"
+    assert len(os.listdir(cache_dir)) == 1
+
+    # different settings should miss the cache
+    for kw in [{"n_pix": 20}, {"n_pix": 30, "dm_edges_clipping": [2,0,0,0]}]:
+        ref = prf.get_prfdesign(str(screenshots), **kw)
+        assert np.array_equal(prf.get_prfdesign(str(screenshots), cache_dir=cache_dir, **kw), ref)
+
+    assert len(os.listdir(cache_dir)) == 3, "each setting should be stored separately"
+
+def test_batch_sr_function_normalize():
+    """Small inputs are normalized by their global maximum, larger ones per stimulus."""
+    import pandas as pd
+
+    rng = np.random.default_rng(10)
+    sr = rng.uniform(0.1, 1, size=(150,8))
+    obj = type("SR", (), {
+        "verbose": False,
+        "batch_sr_function": prf.SizeResponse.batch_sr_function,
+        "make_sr_function": lambda self, params, **kwargs: sr[:params.shape[0]].copy()
+    })()
+
+    sizes = np.arange(8)
+    for n,ref in [(50, sr[:50]/sr[:50].max()), (150, sr/sr.max(axis=0))]:
+        params = pd.DataFrame({"prf_size": np.ones(n)})
+        df = obj.batch_sr_function(params, normalize="max", stims=np.zeros((5,5,8)), sizes=sizes)
+        assert np.allclose(df[np.arange(n)].values.T, ref)
+
+def test_vertex_lookup():
+    """Neighbour, k-ring, and pRF-queries on a synthetic two-hemisphere surface."""
+    from scipy import sparse
+
+    rng = np.random.default_rng(11)
+    pars = rng.standard_normal((50,8))
+    lookup = prf.vertex_lookup("sub-synthetic", prf_params=pars, model="gauss")
+    assert prf.vertex_lookup("sub-synthetic", prf_params=pars, model="gauss") is lookup, "lookup should be reused"
+
+    # 'lh' is a path of 20 vertices, 'rh' one of 30
+    lookup._adjacency = sparse.block_diag([_path_graph(20), _path_graph(30)], format="csr")
+    lookup._n_lh = 20
+
+    assert lookup.index(5, hemi="lh") == 5
+    assert np.array_equal(lookup.index([0,5], hemi="rh"), [20,25])
+
+    assert np.array_equal(np.sort(lookup.neighbours(10)), [9,11])
+    assert np.array_equal(lookup.neighbours(20), [21]), "hemispheres should not be connected"
+    assert np.array_equal(lookup.k_ring(10, k=2), [8,9,11,12])
+    assert np.array_equal(lookup.k_ring(10, k=2, include_self=True), [8,9,10,11,12])
+    assert np.array_equal(lookup.k_ring([19,21], k=1), [18,20,22])
+
+    df = lookup.prf([25,3])
+    assert list(df.index) == [25,3]
+    assert np.allclose(df[["x","y","prf_size"]].values, pars[[25,3],:3])
+
+    res = lookup.query([10], k=1)
+    assert list(res[10].index) == [9,10,11]
+
+def test_batched_iterfit(tmp_path):
+    """Batched fits should equal a single fit, and a killed fit should resume from its checkpoints."""
+    rng = np.random.default_rng(12)
+    data = rng.normal(0, 1, size=(32,50))
+    grid = np.column_stack([np.zeros(32), rng.uniform(0, 0.3, 32)])
+
+    ref = _PRFpyFitter(data, grid)
+    ref.iterative_fit(rsq_threshold=0.1)
+
+    # 32 timecourses in batches of 7: the last batches are shorter than the first
+    fitter = _PRFpyFitter(data, grid, fail_after=2)
+    obj = _BatchedFit(str(tmp_path), 7)
+    try:
+        obj.batched_iterfit(fitter, model="gauss", bounds=[(-5,5),(0,1)])
+    except RuntimeError:
+        pass
+
+    ckpt_dir = obj.checkpoint_dir(model="gauss")
+    assert sorted(os.listdir(ckpt_dir)) == ["batch-0000.npy", "batch-0001.npy", "manifest.json"]
+
+    fitter = _PRFpyFitter(data, grid)
+    obj.batched_iterfit(fitter, model="gauss", bounds=[(-5,5),(0,1)])
+    assert fitter.n_fits == 3, "completed batches should be read from the checkpoints"
+    assert np.array_equal(fitter.iterative_search_params, ref.iterative_search_params), "batched fit should equal a single fit"
+    assert np.array_equal(fitter.rsq_mask, ref.rsq_mask)
+
+def test_neighbour_iterfit_subsets():
+    """Each wave should be gated by its own rsq_mask when fitted through iterfit_subset."""
+    from types import SimpleNamespace
+
+    class _SubsetFit(_NeighbourFit):
+        iterfit_subset = prf.pRFmodelFitting.iterfit_subset
+
+    # waves of 100, 100, and 50 vertices
+    n = 250
+    rng = np.random.default_rng(13)
+    x = np.sin(np.linspace(0, 20, 100))
+    data = rng.uniform(0.5, 2, size=(n,1))*x + rng.normal(0, 0.1, size=(n,100))
+
+    # (amplitude, r2)
+    grid = np.column_stack([np.ones(n), rng.uniform(0, 0.3, n)])
+    grid[0,-1] = 0.9
+
+    model = SimpleNamespace(return_prediction=lambda amp: amp[:,None]*x)
+    fitter = _PRFpyFitter(data, grid, model=model)
+    _SubsetFit(_path_graph(n), None).neighbour_iterfit(fitter, bounds=[(0,5),(0,1)])
+
+    mask = grid[:,-1] > 0.1
+    assert fitter.n_fits == 3, "each wave should be fitted separately"
+    assert np.array_equal(fitter.rsq_mask, mask)
+    assert np.allclose(fitter.iterative_search_params[mask,0], data[mask].mean(axis=-1)), "vertices passing the grid r2 should be fitted"
+    assert np.all(fitter.iterative_search_params[~mask,0] == fitter.starting_params[~mask,0]), "other vertices should keep their start"
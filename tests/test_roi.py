@@ -0,0 +1,120 @@
+import numpy as np
+from fmriproc import roi
+
+def test_roi_index_matches_extract_data():
+    """Compiled ROIs should give the same timecourses as the per-ROI extraction."""
+    rng = np.random.default_rng(1)
+    func = rng.normal(100, 5, size=(500, 40))
+
+    binary = np.zeros(500)
+    binary[10:60] = 1
+    stat = rng.normal(0, 3, size=500)
+
+    for highest in [True, False]:
+        index = roi.ROIIndex([binary, stat], nr=15, highest=highest)
+        tcs = index.extract(func)
+
+        for ix,r in enumerate([binary, stat]):
+            ref = roi.ExtractFromROIs.extract_data(func, r, nr=15, highest=highest, psc=False)
+            assert np.allclose(tcs[ix], ref)
+
+def test_roi_index_streaming(tmp_path):
+    """Streaming a NIfTI file in chunks of volumes should match extraction from the loaded array."""
+    import nibabel as nb
+
+    rng = np.random.default_rng(2)
+    data = rng.normal(100, 5, size=(8, 8, 6, 30))
+    mask = np.zeros(data.shape[:-1])
+    mask[2:5, 2:5, 1:4] = 1
+
+    func_file = str(tmp_path / "bold.nii.gz")
+    nb.Nifti1Image(data, np.eye(4)).to_filename(func_file)
+
+    index = roi.ROIIndex([mask, rng.normal(0, 3, size=mask.shape)])
+    ref = index.extract(data.reshape(-1, data.shape[-1]))
+
+    # budget of ~1 volume
+    tcs = index.extract_image(func_file, max_mem=data[..., 0].nbytes/2**20)
+    assert np.allclose(tcs, ref)
+
+def test_roi_index_save_load(tmp_path):
+    """A memory-mapped index should give the same float32 runs as the compiled one."""
+    rng = np.random.default_rng(3)
+    runs = [rng.normal(100, 5, size=(200, 20)) for _ in range(2)]
+    rois = [rng.normal(0, 3, size=200), (np.arange(200) < 50).astype(float)]
+
+    index = roi.ROIIndex(rois, nr=20, highest=False)
+    index.save(str(tmp_path / "index"))
+    loaded = roi.ROIIndex.load(str(tmp_path / "index"))
+    assert (loaded.nr, loaded.highest) == (20, False), "settings should be restored"
+
+    ref = roi.extract_runs(runs, index, psc=False)
+    tcs = roi.extract_runs(runs, loaded, psc=False, dtype=np.float32)
+    for r,t in zip(ref, tcs):
+        assert t.dtype == np.float32
+        assert np.allclose(r, t, rtol=1e-5)
+
+def test_roi_index_voxel_selection(tmp_path):
+    """Top-n voxels are selected once per ROI and reused from the cache directory."""
+    rng = np.random.default_rng(4)
+    stats = [rng.normal(0, 3, size=300) for _ in range(3)]
+
+    index = roi.roi_index(stats, nr=10, highest=False, cache_dir=str(tmp_path))
+    for ix,stat in enumerate(stats):
+        assert np.array_equal(np.sort(index.roi_voxels(ix)), np.sort(np.argsort(stat)[:10]))
+
+    again = roi.roi_index(stats, nr=10, highest=False, cache_dir=str(tmp_path))
+    assert again.index_dir == index.index_dir
+    assert np.array_equal(again.voxels, index.voxels)
+
+def test_extract_subjects_cache(tmp_path):
+    """Cached timecourses are reused for the same inputs and settings, and extracted again if either changed."""
+    import os
+    import pandas as pd
+
+    func_file = tmp_path / "sub-01_bold.npy"
+    np.save(func_file, np.zeros((10, 5)))
+
+    # cache methods only need the cache directory and the ROIs
+    obj = roi.ExtractSubjects.__new__(roi.ExtractSubjects)
+    obj.cache_dir = str(tmp_path / "cache")
+    obj.roi_list = [(np.arange(10) < 5).astype(float)]
+
+    df = pd.DataFrame({"subject": ["01"]*3, "t": np.arange(3), "roi": np.arange(3, dtype=float)})
+    key = obj.cache_key([str(func_file)], nr=15, psc=True)
+    assert obj.read_cache("sub-01", key) is None
+
+    obj.write_cache("sub-01", key, df)
+    assert obj.cache_key([str(func_file)], nr=15, psc=True, verbose=True) == key, "verbosity should not invalidate the cache"
+    assert np.allclose(obj.read_cache("sub-01", key)["roi"].values, df["roi"].values), "rerun should hit the cache"
+
+    assert obj.read_cache("sub-01", obj.cache_key([str(func_file)], nr=10, psc=True)) is None
+    assert obj.read_cache("sub-01", obj.cache_key([str(func_file)], nr=15, psc=False)) is None
+
+    stat = os.stat(func_file)
+    os.utime(func_file, (stat.st_atime, stat.st_mtime+10))
+    assert obj.read_cache("sub-01", obj.cache_key([str(func_file)], nr=15, psc=True)) is None, "a changed file should miss the cache"
+
+def test_worker_index(tmp_path):
+    """Workers reuse an index with the same content and only keep the last one."""
+    rng = np.random.default_rng(5)
+    func = rng.normal(100, 5, size=(200, 20))
+    rois = [rng.normal(0, 3, size=200), (np.arange(200) < 50).astype(float)]
+
+    index = roi.ROIIndex(rois)
+    index.save(str(tmp_path / "a"))
+    index.save(str(tmp_path / "b"))
+    assert roi.ROIIndex.load(str(tmp_path / "b")).signature() == index.signature()
+
+    ref = roi.extract_runs([func], index, psc=False)[0]
+    tcs = roi._extract_subject([func], str(tmp_path / "a"), index.signature(), psc=False)[0]
+    assert np.allclose(tcs, ref, rtol=1e-5)
+
+    loaded = roi._worker_indices[index.signature()]
+    roi._extract_subject([func], str(tmp_path / "b"), index.signature(), psc=False)
+    assert roi._worker_indices[index.signature()] is loaded, "same content should not be loaded again"
+
+    other = roi.ROIIndex(rois[::-1])
+    other.save(str(tmp_path / "c"))
+    roi._extract_subject([func], str(tmp_path / "c"), other.signature(), psc=False)
+    assert list(roi._worker_indices.keys()) == [other.signature()], "only the last index should be kept"